@@ -0,0 +1,488 @@
+"""
+Audio nodes
+Worker processes that run FFmpeg, apply volume and encode Opus for the bot process, which then
+only encrypts and sends packets on its voice connections. The bot talks to each node over a Unix
+socket: JSON commands (play, volume, ack, stop, drain) one way, Opus packets and events (ended,
+error, load, draining) the other. Guilds are placed on the least loaded node.
+
+Run a node by hand with:  python audio_node.py <socket path>
+SIGTERM drains a node: it refuses new tracks, finishes the current ones and exits.
+"""
+import asyncio
+import json
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+import discord
+
+from ffmpeg_supervisor import supervisor, read_proc_stats, CLOCK_TICKS
+
+logger = logging.getLogger('discord_bot')
+
+# Sockets of externally managed nodes, comma separated
+AUDIO_NODES = [path.strip() for path in os.getenv("AUDIO_NODES", "").split(',') if path.strip()]
+# Nodes the bot spawns itself (0 = play in the bot process unless AUDIO_NODES is set)
+AUDIO_NODE_WORKERS = int(os.getenv("AUDIO_NODE_WORKERS", "0"))
+AUDIO_NODE_DIR = os.getenv("AUDIO_NODE_DIR", "cache/nodes")
+if os.getenv("CLUSTER_ID"):
+    # Each cluster process spawns its own workers
+    AUDIO_NODE_DIR = os.path.join(AUDIO_NODE_DIR, f"cluster-{os.getenv('CLUSTER_ID')}")
+# Packets a node may send ahead of playback; small, so volume changes and fades stay responsive
+AUDIO_NODE_WINDOW = int(os.getenv("AUDIO_NODE_WINDOW", "15"))
+ACK_EVERY = 5
+LOAD_INTERVAL = 5.0
+RECONNECT_MAX = 30.0
+FIRST_PACKET_TIMEOUT = 10.0
+
+HEADER = struct.Struct('<BII')  # Message kind, stream id, payload length
+KIND_CONTROL = 0
+KIND_AUDIO = 1
+OPUS_SILENCE = b'\xf8\xff\xfe'
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+
+def encode_message(kind: int, stream_id: int, payload: bytes) -> bytes:
+    return HEADER.pack(kind, stream_id, len(payload)) + payload
+
+
+def encode_control(message: dict, stream_id: int = 0) -> bytes:
+    return encode_message(KIND_CONTROL, stream_id, json.dumps(message).encode())
+
+
+async def read_message(reader: asyncio.StreamReader):
+    kind, stream_id, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return kind, stream_id, await reader.readexactly(length)
+
+
+# --- Node (worker process) side ---
+
+class NodeTrack:
+    """One playing track on a node: FFmpeg -> volume -> Opus, sent while the bot has window credits."""
+    def __init__(self, node: "AudioNode", stream_id: int, url: str, options: dict, volume: float, window: int):
+        self.node = node
+        self.stream_id = stream_id
+        self.audio = discord.FFmpegPCMAudio(url, **options)
+        supervisor.track(self.audio, 'node')
+        self.transformer = discord.PCMVolumeTransformer(self.audio, volume)
+        self.encoder = discord.opus.Encoder()
+        self.frames = 0
+        self._credits = window
+        self._stopped = False
+        self._credit_ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"node-track-{stream_id}", daemon=True)
+        self._thread.start()
+
+    def ack(self, count: int):
+        with self._credit_ready:
+            self._credits += count
+            self._credit_ready.notify()
+
+    def stop(self):
+        with self._credit_ready:
+            self._stopped = True
+            self._credit_ready.notify()
+
+    def _run(self):
+        error = None
+        try:
+            while True:
+                with self._credit_ready:
+                    while self._credits <= 0 and not self._stopped:
+                        self._credit_ready.wait()
+                    if self._stopped:
+                        break
+                    self._credits -= 1
+                pcm = self.transformer.read()
+                if len(pcm) != FRAME_SIZE:
+                    break
+                packet = self.encoder.encode(pcm, self.encoder.SAMPLES_PER_FRAME)
+                self.frames += 1
+                self.node.send(encode_message(KIND_AUDIO, self.stream_id, packet))
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Node track {self.stream_id} failed: {e}")
+        finally:
+            self.transformer.cleanup()
+            if not self._stopped:
+                self.node.send(encode_control({'event': 'ended', 'frames': self.frames, 'error': error}, self.stream_id))
+            self.node.track_finished(self.stream_id)
+
+
+class AudioNode:
+    """Serves one bot connection on a Unix socket."""
+    def __init__(self, path: str):
+        self.path = path
+        self.tracks: Dict[int, NodeTrack] = {}
+        self.draining = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._done = asyncio.Event()
+        self._cpu = (None, None)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        self.loop.add_signal_handler(signal.SIGTERM, self.drain)
+        self.loop.add_signal_handler(signal.SIGINT, self.drain)
+        reporter = self.loop.create_task(self._report_load())
+        logger.info(f"Audio node listening on {self.path}")
+        async with server:
+            await self._done.wait()
+        reporter.cancel()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        logger.info(f"Audio node {self.path} drained and stopped")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._writer is not None:
+            self._writer.close()  # A reconnecting bot replaces its old connection
+        self._writer = writer
+        if self.draining:
+            self.send(encode_control({'event': 'draining'}))
+        try:
+            while True:
+                kind, stream_id, payload = await read_message(reader)
+                if kind == KIND_CONTROL:
+                    self._dispatch(stream_id, json.loads(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+                # The bot's voice connections went with it
+                for track in list(self.tracks.values()):
+                    track.stop()
+            writer.close()
+
+    def _dispatch(self, stream_id: int, message: dict):
+        op = message.get('op')
+        track = self.tracks.get(stream_id)
+        if op == 'play':
+            if self.draining:
+                self.send(encode_control({'event': 'error', 'error': 'node is draining'}, stream_id))
+                return
+            try:
+                self.tracks[stream_id] = NodeTrack(self, stream_id, message['url'], message['options'],
+                                                   message.get('volume', 0.5), message.get('window', AUDIO_NODE_WINDOW))
+            except Exception as e:
+                self.send(encode_control({'event': 'error', 'error': str(e)}, stream_id))
+        elif op == 'ack' and track:
+            track.ack(message.get('count', 0))
+        elif op == 'volume' and track:
+            track.transformer.volume = message.get('volume', 0.5)
+        elif op == 'stop' and track:
+            track.stop()
+        elif op == 'drain':
+            self.drain()
+
+    def send(self, data: bytes):
+        """Thread-safe write to the bot connection."""
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data: bytes):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(data)
+
+    def track_finished(self, stream_id: int):
+        self.loop.call_soon_threadsafe(self._forget, stream_id)
+
+    def _forget(self, stream_id: int):
+        self.tracks.pop(stream_id, None)
+        if self.draining and not self.tracks:
+            self._done.set()
+
+    def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        logger.info(f"Audio node {self.path} draining ({len(self.tracks)} track(s) left)")
+        self.send(encode_control({'event': 'draining'}))
+        if not self.tracks:
+            self._done.set()
+
+    def _cpu_percent(self) -> Optional[float]:
+        stats = read_proc_stats(os.getpid())
+        if stats is None:
+            return None
+        now = time.monotonic()
+        last_ticks, last_at = self._cpu
+        self._cpu = (stats['cpu_ticks'], now)
+        if last_ticks is None:
+            return None
+        return (stats['cpu_ticks'] - last_ticks) / CLOCK_TICKS / (now - last_at) * 100
+
+    async def _report_load(self):
+        while True:
+            await asyncio.sleep(LOAD_INTERVAL)
+            supervisor.check()
+            ffmpeg = supervisor.get_stats()
+            cpu = self._cpu_percent()
+            self.send(encode_control({
+                'event': 'load',
+                'tracks': len(self.tracks),
+                'cpu_percent': round(cpu, 1) if cpu is not None else None,
+                'ffmpeg_cpu_percent': ffmpeg['cpu_percent'],
+                'ffmpeg_rss_mb': ffmpeg['rss_mb'],
+            }))
+
+
+# --- Bot side ---
+
+class RemoteStream(discord.AudioSource):
+    """
+    Bot-side end of a node track. Packets arrive on the event loop and are read by the voice
+    thread; every few packets read are acknowledged so the node can send more.
+    """
+    def __init__(self, connection: "AudioNodeConnection", stream_id: int):
+        self.connection = connection
+        self.stream_id = stream_id
+        self.underruns = 0
+        self.ended = False  # The node's FFmpeg stopped before we stopped it (EOF, error, node lost)
+        self.error: Optional[str] = None
+        self.last_frame_at: Optional[float] = None
+        self._packets: deque = deque()
+        self._ready = threading.Event()
+        self._finished = False
+        self._closed = False
+        self._unacked = 0
+
+    def _push(self, packet: bytes):
+        self._packets.append(packet)
+        self.last_frame_at = time.monotonic()
+        self._ready.set()
+
+    def _finish(self, error: Optional[str] = None):
+        self._finished = True
+        self.ended = True
+        self.error = error
+        self._ready.set()
+
+    def wait_ready(self, timeout: float = FIRST_PACKET_TIMEOUT) -> bool:
+        return self._ready.wait(timeout) and bool(self._packets)
+
+    def read(self) -> bytes:
+        if not self._ready.wait(FIRST_PACKET_TIMEOUT):
+            return b''
+        try:
+            packet = self._packets.popleft()
+        except IndexError:
+            if self._finished:
+                return b''
+            self.underruns += 1
+            return OPUS_SILENCE
+        self._unacked += 1
+        if self._unacked >= ACK_EVERY:
+            self.connection.send_control({'op': 'ack', 'count': self._unacked}, self.stream_id)
+            self._unacked = 0
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def set_volume(self, volume: float):
+        self.connection.send_control({'op': 'volume', 'volume': volume}, self.stream_id)
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            if not self._finished:
+                self.connection.send_control({'op': 'stop'}, self.stream_id)
+            self.connection.streams.pop(self.stream_id, None)
+
+    def get_stats(self) -> dict:
+        return {
+            'node': self.connection.name,
+            'buffered_seconds': round(len(self._packets) * 0.02, 2),
+            'underruns': self.underruns,
+        }
+
+
+class AudioNodeConnection:
+    """The bot's connection to one node, reconnecting with backoff."""
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.state = 'connecting'
+        self.draining = False
+        self.load: dict = {}
+        self.streams: Dict[int, RemoteStream] = {}
+        self.reconnects = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._next_id = 1
+
+    @property
+    def available(self) -> bool:
+        return self.state == 'ready' and not self.draining
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        backoff = 1.0
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX)
+                continue
+            backoff = 1.0
+            self.state = 'ready'
+            self.draining = False
+            logger.info(f"Connected to audio node {self.name}")
+            try:
+                while True:
+                    kind, stream_id, payload = await read_message(reader)
+                    if kind == KIND_AUDIO:
+                        stream = self.streams.get(stream_id)
+                        if stream is not None:
+                            stream._push(payload)
+                    else:
+                        self._on_event(stream_id, json.loads(payload))
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                logger.warning(f"Lost audio node {self.name}: {e!r}")
+            finally:
+                self.state = 'disconnected'
+                self._writer.close()
+                self._writer = None
+                # Playing tracks end early; the music manager resumes them on another node
+                for stream in list(self.streams.values()):
+                    stream._finish('node disconnected')
+                self.streams.clear()
+                self.reconnects += 1
+
+    def _on_event(self, stream_id: int, message: dict):
+        event = message.get('event')
+        if event == 'load':
+            self.load = message
+        elif event == 'draining':
+            self.draining = True
+            logger.info(f"Audio node {self.name} is draining")
+        elif event in ('ended', 'error'):
+            stream = self.streams.pop(stream_id, None)
+            if stream is not None:
+                stream._finish(message.get('error'))
+            if message.get('error'):
+                logger.warning(f"Audio node {self.name} stream {stream_id}: {message['error']}")
+
+    def open_stream(self, url: str, options: dict, volume: float) -> RemoteStream:
+        stream_id, self._next_id = self._next_id, self._next_id + 1
+        stream = RemoteStream(self, stream_id)
+        self.streams[stream_id] = stream
+        self.send_control({'op': 'play', 'url': url, 'options': options, 'volume': volume,
+                           'window': AUDIO_NODE_WINDOW}, stream_id)
+        return stream
+
+    def send_control(self, message: dict, stream_id: int = 0):
+        """Thread-safe (called from the voice thread for acks)."""
+        self.loop.call_soon_threadsafe(self._write, encode_control(message, stream_id))
+
+    def _write(self, data: bytes):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(data)
+
+    def get_stats(self) -> dict:
+        return {
+            'state': 'draining' if self.state == 'ready' and self.draining else self.state,
+            'streams': len(self.streams),
+            'cpu_percent': self.load.get('cpu_percent'),
+            'ffmpeg_cpu_percent': self.load.get('ffmpeg_cpu_percent'),
+            'ffmpeg_rss_mb': self.load.get('ffmpeg_rss_mb'),
+            'reconnects': self.reconnects,
+        }
+
+
+class AudioNodePool:
+    """Connections to all nodes, spawning local workers when AUDIO_NODE_WORKERS is set, and guild placement."""
+    def __init__(self, paths: List[str] = AUDIO_NODES, workers: int = AUDIO_NODE_WORKERS):
+        self.connections: Dict[str, AudioNodeConnection] = {}
+        self.assignments: Dict[int, str] = {}
+        self.workers: Dict[str, asyncio.subprocess.Process] = {}
+        self._spawn_paths = [os.path.join(AUDIO_NODE_DIR, f"node-{i + 1}.sock") for i in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        for path in list(paths) + self._spawn_paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            self.connections[name] = AudioNodeConnection(name, path)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.connections)
+
+    async def start(self):
+        if self._spawn_paths:
+            os.makedirs(AUDIO_NODE_DIR, exist_ok=True)
+            self._tasks.append(asyncio.get_running_loop().create_task(self._keep_workers()))
+        for connection in self.connections.values():
+            self._tasks.append(asyncio.get_running_loop().create_task(connection.run()))
+
+    async def _keep_workers(self):
+        """Runs the spawned workers, starting a fresh one when one exits (e.g. after draining)."""
+        while not self._closing:
+            for path in self._spawn_paths:
+                name = os.path.splitext(os.path.basename(path))[0]
+                process = self.workers.get(name)
+                if process is None or process.returncode is not None:
+                    self.workers[name] = await asyncio.create_subprocess_exec(
+                        sys.executable, os.path.abspath(__file__), path)
+                    logger.info(f"Started audio node {name} (pid {self.workers[name].pid})")
+            await asyncio.sleep(LOAD_INTERVAL)
+
+    def node_for(self, guild_id: int) -> Optional[AudioNodeConnection]:
+        """The guild's node, placing it on the least loaded available node. None means play locally."""
+        connection = self.connections.get(self.assignments.get(guild_id))
+        if connection is not None and connection.available:
+            return connection
+        candidates = [c for c in self.connections.values() if c.available]
+        if not candidates:
+            self.assignments.pop(guild_id, None)
+            return None
+        connection = min(candidates, key=lambda c: (len(c.streams), c.load.get('cpu_percent') or 0))
+        self.assignments[guild_id] = connection.name
+        return connection
+
+    def release(self, guild_id: int):
+        self.assignments.pop(guild_id, None)
+
+    def drain(self, name: str) -> bool:
+        """Stops placing tracks on a node; it exits once its current tracks end."""
+        connection = self.connections.get(name)
+        if connection is None or connection.state != 'ready':
+            return False
+        connection.draining = True
+        connection.send_control({'op': 'drain'})
+        return True
+
+    async def close(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        for process in self.workers.values():
+            if process.returncode is None:
+                process.terminate()
+        for process in self.workers.values():
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                process.kill()
+
+    def get_stats(self) -> dict:
+        return {
+            'nodes': {name: connection.get_stats() for name, connection in self.connections.items()},
+            'guilds': len(self.assignments),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    if len(sys.argv) != 2:
+        sys.exit("usage: python audio_node.py <socket path>")
+    asyncio.run(AudioNode(sys.argv[1]).serve())
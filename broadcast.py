@@ -0,0 +1,229 @@
+"""
+Broadcast fan-out
+Shares one FFmpeg decode between every guild playing the same stream with the same filter at
+about the same position. Each guild gets its own small frame buffer; the upstream stops when
+its last subscriber goes away
+"""
+import os
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional, Set
+
+import discord
+
+logger = logging.getLogger('discord_bot')
+
+BROADCAST_ENABLED = os.getenv("BROADCAST_ENABLED", "true").lower() == "true"
+# How far (seconds) an on-demand track may start past the requested position to join another guild's
+# upstream. The default is two frames, so nothing audible is skipped; live streams and stations always share.
+BROADCAST_JOIN_WINDOW = float(os.getenv("BROADCAST_JOIN_WINDOW", "0.04"))
+# Frames each subscriber may hold, and how far the upstream runs ahead of real time
+BROADCAST_BUFFER_FRAMES = int(os.getenv("BROADCAST_BUFFER_FRAMES", "50"))
+BROADCAST_LEAD = 0.2
+FIRST_FRAME_TIMEOUT = 10.0
+
+FRAME_LENGTH = 0.02
+SILENCE = b'\0' * discord.opus.Encoder.FRAME_SIZE
+
+
+class BroadcastSource(discord.AudioSource):
+    """One guild's view of an upstream. Frames are the upstream's bytes objects, shared, not copied."""
+    def __init__(self, hub: "BroadcastHub", upstream: "BroadcastUpstream"):
+        self.hub = hub
+        self.upstream = upstream
+        self.start_position = upstream.position
+        self.underruns = 0
+        self._buffer: deque = deque(maxlen=BROADCAST_BUFFER_FRAMES)
+        self._ready = threading.Event()
+        self._finished = False
+        self._closed = False
+
+    def _push(self, frame: bytes):
+        self._buffer.append(frame)
+        self._ready.set()
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._buffer) >= BROADCAST_BUFFER_FRAMES
+
+    def _finish(self):
+        self._finished = True
+        self._ready.set()
+
+    @property
+    def ended(self) -> bool:
+        """The shared FFmpeg reached the end of its output (see BroadcastUpstream.ended)."""
+        return self.upstream.ended
+
+    @property
+    def last_frame_at(self) -> Optional[float]:
+        return self.upstream.last_frame_at
+
+    def get_stats(self) -> dict:
+        """Read-ahead stats of the shared upstream, plus this guild's own underruns."""
+        stats = self.upstream.get_buffer_stats() or {}
+        return {**stats, 'underruns': stats.get('underruns', 0) + self.underruns}
+
+    def read(self) -> bytes:
+        if not self._ready.wait(FIRST_FRAME_TIMEOUT):
+            return b''
+        try:
+            return self._buffer.popleft()
+        except IndexError:
+            if self._finished:
+                return b''
+            # Upstream is late: keep the voice connection fed instead of ending playback
+            self.underruns += 1
+            return SILENCE
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self.hub.unsubscribe(self)
+
+
+class BroadcastUpstream:
+    """Reads one source on its own thread at real time (plus a small lead) and fans frames out."""
+    def __init__(self, hub: "BroadcastHub", key: Hashable, source: discord.AudioSource, start: float):
+        self.hub = hub
+        self.key = key
+        self.source = source
+        self.start = start
+        self.frames = 0
+        self.subscribers: Set[BroadcastSource] = set()
+        self.finished = False
+        self.ended = False  # The source ran out (not stopped because the last subscriber left)
+        self._last_frame_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"broadcast-{id(self):x}", daemon=True)
+
+    @property
+    def position(self) -> float:
+        return self.start + self.frames * FRAME_LENGTH
+
+    @property
+    def last_frame_at(self) -> Optional[float]:
+        """Monotonic time of the last frame, for stall detection. A read-ahead buffer knows when FFmpeg last
+        produced one (its underrun silence must not look like progress)."""
+        buffered = getattr(self.source, 'last_frame_at', None)
+        return buffered if buffered is not None else self._last_frame_at
+
+    def get_buffer_stats(self) -> Optional[dict]:
+        get_stats = getattr(self.source, 'get_stats', None)
+        return get_stats() if get_stats else None
+
+    def add(self, subscriber: BroadcastSource):
+        with self._lock:
+            self.subscribers.add(subscriber)
+        if not self._thread.is_alive() and not self.finished:
+            self._thread.start()
+
+    def remove(self, subscriber: BroadcastSource) -> int:
+        with self._lock:
+            self.subscribers.discard(subscriber)
+            return len(self.subscribers)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        next_at = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                frame = self.source.read()
+                if not frame:
+                    self.ended = not self._stop.is_set()
+                    break
+                # A read-ahead buffer hands out views of slots it reuses; subscribers keep frames longer
+                frame = bytes(frame)
+                self._last_frame_at = time.monotonic()
+                with self._lock:
+                    subscribers = list(self.subscribers)
+                # Back-pressure: hold while every subscriber is full (e.g. the only listener paused);
+                # a single paused guild among others just skips ahead
+                while subscribers and all(s.is_full for s in subscribers) and not self._stop.is_set():
+                    self._stop.wait(FRAME_LENGTH)
+                    next_at = time.perf_counter()
+                    self._last_frame_at = time.monotonic()  # Held back on purpose, not stalled
+                for subscriber in subscribers:
+                    subscriber._push(frame)
+                self.frames += 1
+                next_at += FRAME_LENGTH
+                delay = next_at - time.perf_counter() - BROADCAST_LEAD
+                if delay > 0:
+                    self._stop.wait(delay)
+        except Exception as e:
+            logger.error(f"Broadcast upstream failed: {e}")
+        finally:
+            self.finished = True
+            with self._lock:
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber._finish()
+            self.source.cleanup()
+            self.hub._forget(self)
+
+
+class BroadcastHub:
+    """Keeps upstreams by key and reference-counts them through their subscribers."""
+    def __init__(self):
+        self._upstreams: Dict[Hashable, BroadcastUpstream] = {}
+        self._active: Set[BroadcastUpstream] = set()
+        self._lock = threading.RLock()
+        self.upstreams_started = 0
+        self.subscriptions = 0
+        self.underruns = 0
+
+    def subscribe(self, key: Hashable, factory: Callable[[], discord.AudioSource], *, start: float = 0.0, live: bool = False,
+                  replacing=None) -> BroadcastSource:
+        """
+        Joins a running upstream for `key`, or starts one with `factory()`.
+        Non-live upstreams are only joined while they are within BROADCAST_JOIN_WINDOW of `start`.
+        `replacing` is the caller's current source (seek/filter switch): its own upstream is never rejoined,
+        or a seek back within the window would land where it already is.
+        """
+        bucket_key = (key, 'live') if live else (key, int(start // max(BROADCAST_JOIN_WINDOW, FRAME_LENGTH)))
+        current = getattr(replacing, 'upstream', None)
+        with self._lock:
+            upstream = self._upstreams.get(bucket_key)
+            if (upstream is None or upstream.finished or upstream is current
+                    or (not live and not 0 <= upstream.position - start <= BROADCAST_JOIN_WINDOW)):
+                upstream = BroadcastUpstream(self, bucket_key, factory(), start)
+                self._upstreams[bucket_key] = upstream
+                self._active.add(upstream)
+                self.upstreams_started += 1
+            subscriber = BroadcastSource(self, upstream)
+            upstream.add(subscriber)
+            self.subscriptions += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: BroadcastSource):
+        upstream = subscriber.upstream
+        # Under the hub lock so no new subscriber can join an upstream that is being stopped
+        with self._lock:
+            self.underruns += subscriber.underruns
+            if upstream.remove(subscriber) == 0:
+                upstream.stop()
+                self._forget(upstream)
+
+    def _forget(self, upstream: BroadcastUpstream):
+        with self._lock:
+            self._active.discard(upstream)
+            if self._upstreams.get(upstream.key) is upstream:
+                del self._upstreams[upstream.key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            active = list(self._active)
+        subscribers = sum(len(u.subscribers) for u in active)
+        return {
+            'upstreams': len(active),
+            'subscribers': subscribers,
+            'pipelines_saved': subscribers - len(active),
+            'upstreams_started': self.upstreams_started,
+            'subscriptions': self.subscriptions,
+            'underruns': self.underruns + sum(s.underruns for u in active for s in list(u.subscribers)),
+        }
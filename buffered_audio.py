@@ -0,0 +1,132 @@
+"""
+Read-ahead audio buffer
+Decouples the voice thread from FFmpeg: a reader thread fills a preallocated ring of PCM frames
+a few seconds ahead, so upstream hiccups and GIL contention don't turn into audible stutter
+"""
+import os
+import threading
+import time
+import logging
+from typing import List
+
+import discord
+
+logger = logging.getLogger('discord_bot')
+
+# Seconds of audio read ahead of playback
+READ_AHEAD_SECONDS = float(os.getenv("READ_AHEAD_SECONDS", "2.0"))
+READ_AHEAD_ENABLED = READ_AHEAD_SECONDS > 0
+
+FRAME_LENGTH = 0.02
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+FIRST_FRAME_TIMEOUT = 10.0
+
+
+class BufferedAudio(discord.AudioSource):
+    """
+    Wraps a PCM source. Frames are read (with readinto straight from FFmpeg's stdout when possible)
+    into fixed slots of one bytearray, so the reader thread allocates nothing per frame. read() hands
+    out a memoryview of the slot, which is only reused after the following read().
+    The encoder needs bytes: wrap this in a PCMVolumeTransformer (as YTDLSource does), whose
+    audioop.mul makes the one copy per frame, and never pass its frames to the voice client directly.
+    """
+    def __init__(self, source: discord.AudioSource, seconds: float = READ_AHEAD_SECONDS):
+        self.source = source
+        self.capacity = max(2, int(seconds / FRAME_LENGTH))
+        self._ring = bytearray(self.capacity * FRAME_SIZE)
+        view = memoryview(self._ring)
+        self._slots: List[memoryview] = [view[i * FRAME_SIZE:(i + 1) * FRAME_SIZE] for i in range(self.capacity)]
+        self._silence = memoryview(bytes(FRAME_SIZE))
+        self._written = 0  # Frames produced (writer thread only)
+        self._read = 0  # Frames released back to the writer (voice thread only)
+        self._holding = False  # The last returned slot is still in use by the caller
+        self._eof = False
+        self._stopped = False
+        self.ended = False  # FFmpeg reached the end of its output (not stopped by cleanup)
+        self.last_frame_at = None  # Monotonic time of the last frame read from FFmpeg
+        self._data_ready = threading.Condition()
+        self._space_ready = threading.Condition()
+        self.underruns = 0
+        self._started = False
+        self._thread = threading.Thread(target=self._fill, name=f"read-ahead-{id(self):x}", daemon=True)
+        self._thread.start()
+
+    @property
+    def buffered(self) -> int:
+        return self._written - self._read - (1 if self._holding else 0)
+
+    @property
+    def fill(self) -> float:
+        return self.buffered / self.capacity
+
+    def _fill(self):
+        stdout = getattr(self.source, '_stdout', None)
+        readinto = getattr(stdout, 'readinto', None)
+        try:
+            while not self._stopped:
+                with self._space_ready:
+                    while self._written - self._read >= self.capacity and not self._stopped:
+                        self._space_ready.wait(FRAME_LENGTH)
+                if self._stopped:
+                    break
+                slot = self._slots[self._written % self.capacity]
+                if readinto is not None:
+                    count = readinto(slot)
+                else:
+                    frame = self.source.read()
+                    count = len(frame)
+                    if count == FRAME_SIZE:
+                        slot[:] = frame
+                if count != FRAME_SIZE:
+                    self.ended = not self._stopped
+                    break  # EOF (a short read is the end of the stream, as in FFmpegPCMAudio)
+                self.last_frame_at = time.monotonic()
+                with self._data_ready:
+                    self._written += 1
+                    self._data_ready.notify()
+        except (OSError, ValueError) as e:
+            if not self._stopped:
+                logger.warning(f"Read-ahead reader stopped: {e}")
+        finally:
+            with self._data_ready:
+                self._eof = True
+                self._data_ready.notify_all()
+
+    def read(self):
+        if self._holding:
+            # The caller has finished with the previous slot
+            with self._space_ready:
+                self._read += 1
+                self._holding = False
+                self._space_ready.notify()
+        with self._data_ready:
+            if self._written == self._read and not self._eof:
+                # Wait for FFmpeg to start; afterwards allow at most one frame period
+                self._data_ready.wait(FRAME_LENGTH if self._started else FIRST_FRAME_TIMEOUT)
+            if self._written == self._read:
+                if self._eof or not self._started:
+                    return b''
+                self.underruns += 1
+                return self._silence
+        self._started = True
+        self._holding = True
+        return self._slots[self._read % self.capacity]
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self._stopped = True
+        with self._space_ready:
+            self._space_ready.notify_all()
+        # Killing FFmpeg unblocks a reader waiting on its stdout
+        self.source.cleanup()
+        self._thread.join(timeout=1.0)
+
+    def get_stats(self) -> dict:
+        return {
+            'buffered_seconds': round(self.buffered * FRAME_LENGTH, 2),
+            'fill': round(self.fill, 2),
+            'capacity_seconds': round(self.capacity * FRAME_LENGTH, 2),
+            'underruns': self.underruns,
+        }
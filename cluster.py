@@ -0,0 +1,432 @@
+"""
+Cluster mode
+Runs the bot as several processes, each an AutoShardedBot over its own slice of shard IDs with its
+own managers, caches and DB connection, so gateway and voice load spread over all cores.
+The launcher serves the dashboard and merges /api/health, /api/stats, /api/logs and /api/perf from
+every process over a local Unix socket (newline-delimited JSON).
+
+Start with:  python cluster.py        (a single process is still just: python main.py)
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# The launcher is an entry point of its own: read .env before the settings below
+load_dotenv()
+
+logger = logging.getLogger('discord_bot')
+
+# Set by the launcher for each child process
+CLUSTER_ID = int(os.getenv("CLUSTER_ID")) if os.getenv("CLUSTER_ID") else None
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(',') if shard.strip()] or None
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0) or None
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET", "cache/cluster.sock")
+# Launcher settings: number of processes (default: one per core, at most one per shard)
+CLUSTER_PROCESSES = int(os.getenv("CLUSTER_PROCESSES") or 0) or os.cpu_count() or 1
+CLUSTER_REQUEST_TIMEOUT = 3.0
+# How long to wait for a process to finish identifying before starting the next one
+CLUSTER_READY_TIMEOUT = float(os.getenv("CLUSTER_READY_TIMEOUT", "120"))
+RESTART_MAX = 60.0
+LOG_LIMIT = 200
+
+
+def shard_slices(shard_count: int, processes: int) -> List[List[int]]:
+    """Splits shard IDs into contiguous slices, one per process."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    slices, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(list(range(start, end)))
+        start = end
+    return slices
+
+
+def owns_guild(guild_id: int) -> bool:
+    """True if this process runs the shard of `guild_id` (always true outside cluster mode)."""
+    if SHARD_IDS is None or not SHARD_COUNT:
+        return True
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+
+# --- Child process side ---
+
+class ClusterClient:
+    """Connects a bot process to its launcher: answers requests with `handlers` and pushes events."""
+    def __init__(self, cluster_id: int, handlers: Dict[str, Callable[..., Awaitable[Any]]], path: str = CLUSTER_SOCKET):
+        self.cluster_id = cluster_id
+        self.handlers = handlers
+        self.path = path
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+            except OSError:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RESTART_MAX)
+                continue
+            backoff = 1.0
+            self._writer = writer
+            self._write({'event': 'hello', 'cluster': self.cluster_id, 'shards': SHARD_IDS, 'pid': os.getpid()})
+            try:
+                while line := await reader.readline():
+                    request = json.loads(line)
+                    self.loop.create_task(self._answer(request))
+            except ConnectionError:
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+
+    async def _answer(self, request: dict):
+        handler = self.handlers.get(request.get('op'))
+        try:
+            result = await handler(**request.get('args', {})) if handler else None
+            self._write({'id': request['id'], 'result': result})
+        except Exception as e:
+            self._write({'id': request['id'], 'error': str(e)})
+
+    def _write(self, message: dict):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(json.dumps(message, default=str).encode() + b'\n')
+
+    def send_event(self, event: str, **fields):
+        """Thread-safe; dropped while the launcher is unreachable."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._write, {'event': event, **fields})
+
+
+# --- Launcher side ---
+
+class ClusterProcess:
+    def __init__(self, cluster_id: int, shard_ids: List[int]):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.ready = asyncio.Event()
+        self.restarts = 0
+        self.started_at: Optional[float] = None
+        self.stats: Optional[dict] = None  # Latest snapshot pushed by the process
+
+
+class ClusterLauncher:
+    """Starts and restarts the bot processes and fans dashboard requests out to them."""
+    def __init__(self, shard_count: int, processes: int = CLUSTER_PROCESSES, path: str = CLUSTER_SOCKET):
+        self.shard_count = shard_count
+        self.path = path
+        self.clusters = {i: ClusterProcess(i, shards) for i, shards in enumerate(shard_slices(shard_count, processes))}
+        self.logs: deque = deque(maxlen=LOG_LIMIT)
+        self.log_listeners: List[Callable[[List[dict]], None]] = []  # Called with each batch of new entries
+        self.stats_listeners: List[Callable[[], None]] = []  # Called when any process's stats change
+        self.start_time = datetime.now()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 1
+        self._stopping = False
+        self._stop_task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=2 ** 20)
+        async with server:
+            # Start one process at a time so their shards don't identify concurrently
+            for cluster in self.clusters.values():
+                await self._spawn(cluster)
+                try:
+                    await asyncio.wait_for(cluster.ready.wait(), CLUSTER_READY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Cluster {cluster.cluster_id} not ready after {CLUSTER_READY_TIMEOUT:.0f}s; starting the next one")
+            await asyncio.gather(*(self._watch(cluster) for cluster in self.clusters.values()))
+
+    async def _spawn(self, cluster: ClusterProcess):
+        env = {
+            **os.environ,
+            'CLUSTER_ID': str(cluster.cluster_id),
+            'SHARD_IDS': ','.join(map(str, cluster.shard_ids)),
+            'SHARD_COUNT': str(self.shard_count),
+            'CLUSTER_SOCKET': os.path.abspath(self.path),
+        }
+        cluster.ready.clear()
+        cluster.started_at = time.time()
+        cluster.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'), env=env)
+        logger.info(f"Started cluster {cluster.cluster_id} (pid {cluster.process.pid}, shards {cluster.shard_ids})")
+
+    async def _watch(self, cluster: ClusterProcess):
+        """Restarts a process that exits, with backoff if it keeps crashing."""
+        backoff = 1.0
+        while not self._stopping:
+            returncode = await cluster.process.wait()
+            if self._stopping:
+                return
+            uptime = time.time() - cluster.started_at
+            backoff = 1.0 if uptime > RESTART_MAX else min(backoff * 2, RESTART_MAX)
+            logger.warning(f"Cluster {cluster.cluster_id} exited with {returncode}; restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            cluster.restarts += 1
+            await self._spawn(cluster)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster = None
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if 'id' in message:
+                    future = self._pending.pop(message['id'], None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif message.get('event') == 'hello':
+                    cluster = self.clusters.get(message['cluster'])
+                    if cluster is not None:
+                        cluster.writer = writer
+                elif message.get('event') == 'ready' and cluster is not None:
+                    cluster.ready.set()
+                elif message.get('event') == 'stats' and cluster is not None:
+                    cluster.stats = message['stats']
+                    self._stats_changed()
+                elif message.get('event') == 'logs' and cluster is not None:
+                    entries = [{**entry, 'cluster': cluster.cluster_id} for entry in message['logs']]
+                    self.logs.extend(entries)
+                    for listener in list(self.log_listeners):
+                        listener(entries)
+        except ConnectionError:
+            pass
+        finally:
+            if cluster is not None and cluster.writer is writer:
+                cluster.writer = None
+                # Its guilds are offline until it reconnects and reports again
+                cluster.stats = None
+                self._stats_changed()
+            writer.close()
+
+    def _stats_changed(self):
+        for listener in list(self.stats_listeners):
+            listener()
+
+    def merged_stats(self) -> dict:
+        """The /api/stats payload summed over the snapshots the processes pushed."""
+        results = {cid: cluster.stats for cid, cluster in self.clusters.items() if cluster.stats}
+        elapsed = datetime.now() - self.start_time
+        return {
+            "servers": sum(stats.get('servers', 0) for stats in results.values()),
+            "users": sum(stats.get('users', 0) for stats in results.values()),
+            "uptime": self.get_uptime(),
+            "uptime_raw": {
+                "days": elapsed.days,
+                "total_seconds": elapsed.total_seconds()
+            },
+            "clusters": {str(cid): stats for cid, stats in results.items()},
+        }
+
+    async def request(self, op: str, timeout: float = CLUSTER_REQUEST_TIMEOUT, **args) -> Dict[int, Any]:
+        """Sends a request to every connected process; results by cluster ID (missing if it did not answer)."""
+        futures = {}
+        for cluster_id, cluster in self.clusters.items():
+            if cluster.writer is None or cluster.writer.is_closing():
+                continue
+            request_id, self._next_id = self._next_id, self._next_id + 1
+            futures[cluster_id] = self._pending[request_id] = asyncio.get_running_loop().create_future()
+            cluster.writer.write(json.dumps({'id': request_id, 'op': op, 'args': args}).encode() + b'\n')
+        if not futures:
+            return {}
+        await asyncio.wait(futures.values(), timeout=timeout)
+        results = {}
+        for cluster_id, future in futures.items():
+            if future.done() and 'result' in future.result():
+                results[cluster_id] = future.result()['result']
+            else:
+                future.cancel()
+        self._pending = {k: v for k, v in self._pending.items() if not v.done()}
+        return results
+
+    async def stop(self):
+        """Stops every process (SIGTERM runs their graceful shutdown). Safe to call more than once."""
+        if self._stop_task is None:
+            self._stopping = True
+            self._stop_task = asyncio.get_running_loop().create_task(self._stop())
+        await asyncio.shield(self._stop_task)
+
+    async def _stop(self):
+        for cluster in self.clusters.values():
+            if cluster.process and cluster.process.returncode is None:
+                cluster.process.send_signal(signal.SIGTERM)
+        for cluster in self.clusters.values():
+            if cluster.process:
+                try:
+                    await asyncio.wait_for(cluster.process.wait(), 30)
+                except asyncio.TimeoutError:
+                    cluster.process.kill()
+
+    def get_uptime(self) -> str:
+        delta = datetime.now() - self.start_time
+        return f"{delta.days}d {delta.seconds // 3600}h {(delta.seconds % 3600) // 60}m"
+
+
+def create_dashboard(launcher: ClusterLauncher):
+    """The dashboard API of main.py, with every endpoint merged across processes."""
+    from fastapi import FastAPI, HTTPException, Request, WebSocket
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.staticfiles import StaticFiles
+    from fastapi.responses import FileResponse, PlainTextResponse
+    from metrics import merge_expositions
+    from loop_monitor import PROFILE_MAX_SECONDS, check_profiler_token
+    from ws_hub import FanoutHub
+    from stats_aggregator import make_etag, stats_response
+
+    app = FastAPI(title="Sakudoko Bot Dashboard API (cluster)", version="2.0.0")
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    app.mount("/assets", StaticFiles(directory="assets"), name="assets")
+    ws_hub = FanoutHub()
+    launcher.log_listeners.append(lambda entries: ws_hub.publish({"type": "log_batch", "logs": entries}))
+    launcher.stats_listeners.append(lambda: ws_hub.publish({"type": "stats", "stats": launcher.merged_stats()}))
+
+    @app.get("/")
+    async def read_root():
+        return FileResponse("index.html", headers={"Cache-Control": "no-cache, no-store, must-revalidate"})
+
+    @app.get("/health")
+    async def health_check_simple():
+        return {"status": "ok"}
+
+    @app.get("/api/health")
+    async def health_check():
+        results = await launcher.request('health')
+        online = [cid for cid, health in results.items() if health.get('status') == 'online']
+        latencies = [results[cid]['latency'] for cid in online]
+        if len(online) == len(launcher.clusters):
+            status = "online"
+        else:
+            status = "degraded" if online else "offline"
+        return {
+            "status": status,
+            "latency": round(sum(latencies) / len(latencies)) if latencies else 0,
+            "timestamp": datetime.now().isoformat(),
+            "clusters": {
+                str(cid): {
+                    "status": results.get(cid, {}).get('status', 'unreachable'),
+                    "latency": results.get(cid, {}).get('latency'),
+                    "shards": cluster.shard_ids,
+                    "restarts": cluster.restarts,
+                    "event_loop": results.get(cid, {}).get('event_loop'),
+                    "voice": results.get(cid, {}).get('voice'),
+                } for cid, cluster in launcher.clusters.items()
+            },
+        }
+
+    @app.get("/api/stats")
+    async def get_stats(request: Request):
+        payload = launcher.merged_stats()
+        # uptime_raw moves on every call; the version is everything else (uptime to the minute)
+        version = json.dumps([payload['servers'], payload['users'], payload['uptime'], payload['clusters']])
+        return stats_response(request, payload, etag=make_etag(version.encode()))
+
+    @app.get("/api/logs")
+    async def get_logs(limit: int = 20):
+        logs = list(launcher.logs)
+        return {"logs": logs[-limit:], "total": len(logs)}
+
+    @app.get("/api/perf")
+    async def get_perf():
+        results = await launcher.request('perf')
+        # Flat timings for the dashboard, labelled by process
+        timings = {
+            f"{name} [c{cid}]": timing
+            for cid, perf in sorted(results.items()) for name, timing in perf.get('timings', {}).items()
+        }
+        return {
+            "timings": timings,
+            "websocket": ws_hub.get_stats(),
+            "clusters": {str(cid): perf for cid, perf in results.items()},
+        }
+
+    @app.get("/metrics")
+    async def get_metrics():
+        results = await launcher.request('metrics')
+        text = merge_expositions({str(cid): text for cid, text in sorted(results.items()) if text}, 'cluster')
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+    @app.get("/api/profile")
+    async def get_profile(token: str = "", seconds: float = 5.0, interval: float = 0.005, format: str = "json"):
+        if not check_profiler_token(token):
+            raise HTTPException(status_code=403, detail="Profiler disabled or wrong token")
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        results = await launcher.request('profile', timeout=seconds + CLUSTER_REQUEST_TIMEOUT,
+                                         seconds=seconds, interval=interval)
+        results = {cid: result for cid, result in results.items() if result}
+        if format == "collapsed":
+            # One root per process
+            text = '\n'.join(f"cluster {cid};{line}" for cid, result in sorted(results.items())
+                             for line in result['collapsed'].splitlines())
+            return PlainTextResponse(text + "\n")
+        return {"clusters": {str(cid): result for cid, result in results.items()}}
+
+    @app.get("/api/commands")
+    async def get_commands():
+        results = await launcher.request('commands')
+        return next(iter(results.values()), {"commands": []})
+
+    @app.websocket("/ws/logs")
+    async def websocket_logs(websocket: WebSocket):
+        await websocket.accept()
+        await ws_hub.serve(websocket, initial={
+            "type": "initial",
+            "logs": list(launcher.logs)[-10:],
+            "stats": launcher.merged_stats()
+        })
+
+    return app
+
+
+async def fetch_shard_count(token: str) -> int:
+    """Discord's recommended shard count for the bot."""
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+async def run_launcher():
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    shard_count = SHARD_COUNT or await fetch_shard_count(os.getenv("DISCORD_TOKEN"))
+    launcher = ClusterLauncher(shard_count)
+    logger.info(f"Cluster mode: {shard_count} shard(s) over {len(launcher.clusters)} process(es)")
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: loop.create_task(launcher.stop()))
+
+    server = uvicorn.Server(uvicorn.Config(create_dashboard(launcher), host="0.0.0.0", port=8080, log_level="error"))
+    launcher_task = loop.create_task(launcher.run())
+    serve_task = loop.create_task(server.serve())
+    # uvicorn also exits on SIGINT/SIGTERM; either way the bot processes are stopped
+    await asyncio.wait([launcher_task, serve_task], return_when=asyncio.FIRST_COMPLETED)
+    server.should_exit = True
+    await launcher.stop()
+    await serve_task
+
+
+if __name__ == "__main__":
+    asyncio.run(run_launcher())
@@ -11,6 +11,11 @@ import json
 
 logger = logging.getLogger('discord_bot')
 
+# Calls run on the event loop: wait only briefly for another cluster process's write lock.
+# Session snapshots that find the file locked are kept and retried on the next flush; one-off
+# writes (history, playlists) that still find it locked fail and are logged.
+SQLITE_BUSY_TIMEOUT = 0.25
+
 class Database:
     def __init__(self, db_path: str = "bot_data.db"):
         self.db_path = db_path
@@ -21,7 +26,9 @@ class Database:
     def initialize(self):
         """Initialize database connection and create tables"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+            # WAL lets cluster processes share the file: readers don't block the writer
+            self.conn.execute('PRAGMA journal_mode=WAL')
             self.cursor = self.conn.cursor()
             self.create_tables()
             logger.info(f"Database initialized: {self.db_path}")
@@ -70,6 +77,79 @@ class Database:
         )
         ''')
         
+        # Resolved track metadata cache (keyed by the queued URL)
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS track_cache (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            webpage_url TEXT,
+            duration INTEGER,
+            thumbnail TEXT,
+            is_live INTEGER DEFAULT 0,
+            stream_url TEXT,
+            stream_expires REAL,
+            loudness REAL,
+            loudness_gain REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Playback session snapshots for crash/redeploy recovery
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS guild_sessions (
+            guild_id INTEGER PRIMARY KEY,
+            voice_channel_id INTEGER,
+            text_channel_id INTEGER,
+            owner_id INTEGER,
+            loop_queue INTEGER DEFAULT 0,
+            auto_play INTEGER DEFAULT 0,
+            selected_filter TEXT,
+            current_url TEXT,
+            position REAL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_queue (
+            guild_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            PRIMARY KEY (guild_id, seq)
+        )
+        ''')
+        
+        # Pre-encoded Opus files of frequently played tracks
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS opus_cache (
+            url TEXT PRIMARY KEY,
+            file_key TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            duration REAL,
+            hits INTEGER DEFAULT 0,
+            last_used REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Rooms tuned to a 24/7 station, restored on startup
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS guild_stations (
+            guild_id INTEGER PRIMARY KEY,
+            station TEXT NOT NULL,
+            voice_channel_id INTEGER,
+            text_channel_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Columns added after track_cache was introduced
+        self.cursor.execute("PRAGMA table_info(track_cache)")
+        columns = {row[1] for row in self.cursor.fetchall()}
+        for column in ('loudness', 'loudness_gain'):
+            if column not in columns:
+                self.cursor.execute(f"ALTER TABLE track_cache ADD COLUMN {column} REAL")
+        
         self.conn.commit()
     
     # Song History Methods
@@ -238,8 +318,215 @@ class Database:
         except Exception as e:
             logger.error(f"Failed to update guild settings: {e}")
     
+    # Track Cache Methods
+    def get_cached_track(self, url: str) -> Optional[Dict]:
+        """Get cached metadata for a track URL"""
+        try:
+            self.cursor.execute('''
+            SELECT title, webpage_url, duration, thumbnail, is_live, stream_url, stream_expires,
+                   loudness, loudness_gain
+            FROM track_cache
+            WHERE url = ?
+            ''', (url,))
+            
+            row = self.cursor.fetchone()
+            if row:
+                return {
+                    'title': row[0],
+                    'webpage_url': row[1],
+                    'duration': row[2],
+                    'thumbnail': row[3],
+                    'is_live': bool(row[4]),
+                    'url': row[5],
+                    'stream_expires': row[6],
+                    'loudness': row[7],
+                    'loudness_gain': row[8]
+                }
+            return None
+        except Exception as e:
+            logger.error(f"Failed to get cached track: {e}")
+            return None
+    
+    def save_cached_track(self, url: str, data: Dict):
+        """Insert or update cached metadata for a track URL"""
+        try:
+            self.cursor.execute('''
+            INSERT INTO track_cache (url, title, webpage_url, duration, thumbnail, is_live, stream_url, stream_expires, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(url)
+            DO UPDATE SET
+                title = excluded.title,
+                webpage_url = excluded.webpage_url,
+                duration = excluded.duration,
+                thumbnail = excluded.thumbnail,
+                is_live = excluded.is_live,
+                stream_url = excluded.stream_url,
+                stream_expires = excluded.stream_expires,
+                updated_at = CURRENT_TIMESTAMP
+            ''', (
+                url,
+                data.get('title'),
+                data.get('webpage_url'),
+                data.get('duration'),
+                data.get('thumbnail'),
+                int(bool(data.get('is_live'))),
+                data.get('url'),
+                data.get('stream_expires')
+            ))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to save cached track: {e}")
+    
+    def save_track_loudness(self, url: str, loudness: float, gain: float):
+        """Store the measured integrated loudness (LUFS) and playback gain (dB) of a cached track"""
+        try:
+            self.cursor.execute('''
+            UPDATE track_cache SET loudness = ?, loudness_gain = ? WHERE url = ?
+            ''', (loudness, gain, url))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to save track loudness: {e}")
+    
+    # Opus Cache Methods
+    def get_opus_cache_entries(self) -> List[Dict]:
+        """Get every entry of the on-disk Opus cache"""
+        try:
+            self.cursor.execute('''
+            SELECT url, file_key, size, duration, hits, last_used FROM opus_cache
+            ''')
+            return [
+                {'url': row[0], 'file_key': row[1], 'size': row[2], 'duration': row[3],
+                 'hits': row[4] or 0, 'last_used': row[5] or 0.0}
+                for row in self.cursor.fetchall()
+            ]
+        except Exception as e:
+            logger.error(f"Failed to get opus cache entries: {e}")
+            return []
+    
+    def save_opus_cache_entry(self, entry: Dict):
+        """Insert or update an Opus cache entry"""
+        try:
+            self.cursor.execute('''
+            INSERT INTO opus_cache (url, file_key, size, duration, hits, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url)
+            DO UPDATE SET
+                file_key = excluded.file_key,
+                size = excluded.size,
+                duration = excluded.duration,
+                hits = excluded.hits,
+                last_used = excluded.last_used
+            ''', (entry['url'], entry['file_key'], entry['size'], entry.get('duration'),
+                  entry.get('hits', 0), entry.get('last_used')))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to save opus cache entry: {e}")
+    
+    def delete_opus_cache_entry(self, url: str):
+        """Delete an Opus cache entry"""
+        try:
+            self.cursor.execute('DELETE FROM opus_cache WHERE url = ?', (url,))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to delete opus cache entry: {e}")
+    
+    # Station Methods
+    def get_guild_stations(self) -> List[Dict]:
+        """Get every room tuned to a station"""
+        try:
+            self.cursor.execute('''
+            SELECT guild_id, station, voice_channel_id, text_channel_id FROM guild_stations
+            ''')
+            return [
+                {'guild_id': row[0], 'station': row[1], 'voice_channel_id': row[2], 'text_channel_id': row[3]}
+                for row in self.cursor.fetchall()
+            ]
+        except Exception as e:
+            logger.error(f"Failed to get guild stations: {e}")
+            return []
+    
+    def save_guild_station(self, guild_id: int, station: str, voice_channel_id: Optional[int], text_channel_id: Optional[int]):
+        """Remember that a room is tuned to a station"""
+        try:
+            self.cursor.execute('''
+            INSERT INTO guild_stations (guild_id, station, voice_channel_id, text_channel_id, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(guild_id)
+            DO UPDATE SET
+                station = excluded.station,
+                voice_channel_id = excluded.voice_channel_id,
+                text_channel_id = excluded.text_channel_id,
+                updated_at = CURRENT_TIMESTAMP
+            ''', (guild_id, station, voice_channel_id, text_channel_id))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to save guild station: {e}")
+    
+    def delete_guild_station(self, guild_id: int):
+        """Forget a room's station"""
+        try:
+            self.cursor.execute('DELETE FROM guild_stations WHERE guild_id = ?', (guild_id,))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to delete guild station: {e}")
+    
+    # Session Snapshot Methods
+    def apply_session_ops(self, ops: List[Tuple[str, tuple]]) -> bool:
+        """Apply a batch of session writes in a single transaction. Returns False if it was rolled back"""
+        try:
+            for sql, params in ops:
+                self.cursor.execute(sql, params)
+            self.conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            # Usually another cluster process holding the write lock past SQLITE_BUSY_TIMEOUT;
+            # SessionStore keeps the batch and retries it on its next flush
+            self.conn.rollback()
+            logger.warning(f"Session snapshot deferred: {e}")
+            return False
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Failed to write session snapshot: {e}")
+            return False
+    
+    def get_sessions(self) -> List[Dict]:
+        """Get every saved session with its queue"""
+        try:
+            self.cursor.execute('''
+            SELECT guild_id, voice_channel_id, text_channel_id, owner_id, loop_queue, auto_play,
+                   selected_filter, current_url, position
+            FROM guild_sessions
+            ''')
+            sessions = []
+            for row in self.cursor.fetchall():
+                sessions.append({
+                    'guild_id': row[0],
+                    'voice_channel_id': row[1],
+                    'text_channel_id': row[2],
+                    'owner_id': row[3],
+                    'loop_queue': bool(row[4]),
+                    'auto_play': bool(row[5]),
+                    'selected_filter': row[6],
+                    'current_url': row[7],
+                    'position': row[8] or 0.0,
+                })
+            for session in sessions:
+                self.cursor.execute('''
+                SELECT seq, url FROM session_queue
+                WHERE guild_id = ?
+                ORDER BY seq
+                ''', (session['guild_id'],))
+                rows = self.cursor.fetchall()
+                session['queue'] = [row[1] for row in rows]
+                session['queue_seqs'] = [row[0] for row in rows]
+            return sessions
+        except Exception as e:
+            logger.error(f"Failed to get sessions: {e}")
+            return []
+    
     def close(self):
         """Close database connection"""
         if self.conn:
             self.conn.close()
+            self.conn = None
             logger.info("Database connection closed")
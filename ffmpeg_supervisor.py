@@ -0,0 +1,252 @@
+"""
+FFmpeg process supervisor
+Tracks every FFmpeg child (PID, CPU, RSS, bytes read, last frame), detects playback stalls so the
+guild can re-resolve the stream and restart at its current offset, and reaps leftover zombies
+"""
+import asyncio
+import os
+import time
+import logging
+from collections import Counter
+from typing import Dict, Optional
+
+from metrics import timings
+
+logger = logging.getLogger('discord_bot')
+
+SUPERVISOR_INTERVAL = float(os.getenv("FFMPEG_SUPERVISOR_INTERVAL", "5"))
+# Seconds without a new frame from a playing FFmpeg before it counts as stalled
+FFMPEG_STALL_SECONDS = float(os.getenv("FFMPEG_STALL_SECONDS", "8"))
+# Recovery attempts per track (stalls and early ends)
+FFMPEG_MAX_RECOVERIES = int(os.getenv("FFMPEG_MAX_RECOVERIES", "2"))
+# A track that stops this far before its duration ended early
+FFMPEG_EARLY_END_MARGIN = 10.0
+
+PROC = '/proc'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def read_proc_stats(pid: int) -> Optional[dict]:
+    """CPU ticks, RSS and bytes read of a process from /proc (None if unavailable)."""
+    try:
+        with open(f"{PROC}/{pid}/stat") as f:
+            # comm may contain spaces; fields after the closing parenthesis are fixed
+            fields = f.read().rpartition(')')[2].split()
+        stats = {
+            'state': fields[0],
+            'cpu_ticks': int(fields[11]) + int(fields[12]),
+            'rss_bytes': int(fields[21]) * PAGE_SIZE,
+            'read_bytes': None,
+        }
+    except (OSError, IndexError, ValueError):
+        return None
+    try:
+        with open(f"{PROC}/{pid}/io") as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    stats['read_bytes'] = int(line.split()[1])
+                    break
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+class SupervisedProcess:
+    def __init__(self, process, kind: str, source=None, url: Optional[str] = None,
+                 guild_id: Optional[int] = None, external: bool = False):
+        self.process = process
+        self.pid = process.pid
+        self.kind = kind
+        self.source = source  # BufferedAudio or BroadcastUpstream, exposing last_frame_at
+        self.url = url
+        self.guild_id = guild_id
+        self.external = external  # Reaped by its owner (e.g. asyncio subprocesses)
+        self.started = time.monotonic()
+        self.cpu_percent: Optional[float] = None
+        self.rss_bytes: Optional[int] = None
+        self.read_bytes: Optional[int] = None
+        self.state: Optional[str] = None
+        self._last_ticks: Optional[int] = None
+        self._last_sample: Optional[float] = None
+
+    def sample(self):
+        stats = read_proc_stats(self.pid)
+        if stats is None:
+            return
+        now = time.monotonic()
+        if self._last_ticks is not None and now > self._last_sample:
+            self.cpu_percent = (stats['cpu_ticks'] - self._last_ticks) / CLOCK_TICKS / (now - self._last_sample) * 100
+        self._last_ticks = stats['cpu_ticks']
+        self._last_sample = now
+        self.rss_bytes = stats['rss_bytes']
+        self.read_bytes = stats['read_bytes']
+        self.state = stats['state']
+
+    @property
+    def last_frame_age(self) -> Optional[float]:
+        last = getattr(self.source, 'last_frame_at', None)
+        return time.monotonic() - last if last else None
+
+    def as_dict(self) -> dict:
+        frame_age = self.last_frame_age
+        return {
+            'pid': self.pid,
+            'kind': self.kind,
+            'guild_id': str(self.guild_id) if self.guild_id else None,
+            'age': round(time.monotonic() - self.started),
+            'state': self.state,
+            'cpu_percent': round(self.cpu_percent, 1) if self.cpu_percent is not None else None,
+            'rss_mb': round(self.rss_bytes / 1048576, 1) if self.rss_bytes is not None else None,
+            'read_mb': round(self.read_bytes / 1048576, 1) if self.read_bytes is not None else None,
+            'last_frame_age': round(frame_age, 1) if frame_age is not None else None,
+        }
+
+
+class FFmpegSupervisor:
+    """Registry and monitor of FFmpeg children. start(bot) runs the periodic check on the bot loop."""
+    def __init__(self):
+        self.processes: Dict[int, SupervisedProcess] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._recovering: Dict[int, asyncio.Task] = {}
+        self.bot = None
+        self.spawned = 0
+        self.exited = 0
+        self.reaped = 0
+        self.stalls = 0
+        self.recoveries: Counter = Counter()  # Restarts by reason ('stall', 'early_end')
+        self.recovery_failures = 0
+
+    # --- Registration ---
+    def track(self, audio, kind: str, source=None, url: Optional[str] = None) -> None:
+        """Registers the Popen behind a discord FFmpeg audio source."""
+        process = getattr(audio, '_process', None)
+        if process is None:
+            return
+        self.processes[process.pid] = SupervisedProcess(process, kind, source=source, url=url)
+        self.spawned += 1
+
+    def track_process(self, process, kind: str, url: Optional[str] = None) -> None:
+        """Registers an asyncio subprocess (its owner awaits it, so it is never reaped here)."""
+        self.processes[process.pid] = SupervisedProcess(process, kind, url=url, external=True)
+        self.spawned += 1
+
+    def watch(self, audio, source):
+        """
+        Points the entry for the FFmpeg behind `audio` (raw, or its read-ahead buffer) at `source`,
+        e.g. the shared upstream that knows which guilds it feeds.
+        """
+        process = getattr(audio, '_process', None)
+        for entry in self.processes.values():
+            if entry.source is audio or (process is not None and entry.process is process):
+                entry.source = source
+                return
+
+    def assign(self, source, guild_id: int):
+        """Attributes the process feeding `source` to a guild, for stall recovery and stats."""
+        for entry in self.processes.values():
+            if entry.source is source:
+                entry.guild_id = guild_id
+                return
+
+    def record_recovery(self, reason: str, ok: bool):
+        if ok:
+            self.recoveries[reason] += 1
+        else:
+            self.recovery_failures += 1
+
+    # --- Monitoring ---
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._task = bot.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SUPERVISOR_INTERVAL)
+            try:
+                with timings.timer('ffmpeg_supervisor.check'):
+                    self.check()
+            except Exception as e:
+                logger.error(f"FFmpeg supervisor check failed: {e}")
+
+    def check(self):
+        for pid, entry in list(self.processes.items()):
+            returncode = entry.process.returncode if entry.external else entry.process.poll()
+            if returncode is not None:
+                # poll() has reaped it; forget the entry
+                del self.processes[pid]
+                self.exited += 1
+                continue
+            entry.sample()
+            self._check_stall(entry)
+        self._reap_zombies()
+
+    def _check_stall(self, entry: SupervisedProcess):
+        if entry.kind not in ('playback', 'broadcast') or self.bot is None:
+            return
+        age = entry.last_frame_age
+        if age is None or age < FFMPEG_STALL_SECONDS:
+            return
+        if entry.kind == 'playback':
+            sources = {entry.source}
+            guild_ids = [entry.guild_id] if entry.guild_id is not None else []
+        else:
+            # A shared upstream stalls for every guild subscribed to it; each recovers on its own stream
+            sources = set(getattr(entry.source, 'subscribers', ()))
+            guild_ids = list(self.bot.managers) if sources else []
+        for guild_id in guild_ids:
+            manager = self.bot.managers.get(guild_id)
+            vc = manager.voice_client if manager else None
+            if not vc or not vc.is_playing() or getattr(vc.source, 'original', None) not in sources:
+                continue
+            task = self._recovering.get(guild_id)
+            if task and not task.done():
+                continue
+            self.stalls += 1
+            logger.warning(f"FFmpeg {entry.pid} stalled for {age:.0f}s in guild {guild_id}; restarting stream")
+            self._recovering[guild_id] = self.bot.loop.create_task(manager.recover_stream('stall'))
+
+    def _reap_zombies(self):
+        """Collects exited FFmpeg children nobody waited for."""
+        try:
+            children = set()
+            for tid in os.listdir(f"{PROC}/self/task"):
+                with open(f"{PROC}/self/task/{tid}/children") as f:
+                    children.update(int(pid) for pid in f.read().split())
+        except (OSError, ValueError):
+            return
+        for pid in children:
+            entry = self.processes.get(pid)
+            if entry is not None and entry.external:
+                continue
+            stats = read_proc_stats(pid)
+            if not stats or stats['state'] != 'Z':
+                continue
+            try:
+                with open(f"{PROC}/{pid}/comm") as f:
+                    if f.read().strip() != 'ffmpeg':
+                        continue
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    self.reaped += 1
+                    self.processes.pop(pid, None)
+            except (OSError, ChildProcessError):
+                pass
+
+    def get_stats(self) -> dict:
+        live = [entry.as_dict() for entry in self.processes.values()]
+        return {
+            'running': len(live),
+            'spawned': self.spawned,
+            'exited': self.exited,
+            'reaped': self.reaped,
+            'stalls': self.stalls,
+            'recoveries': dict(self.recoveries),
+            'recovery_failures': self.recovery_failures,
+            'cpu_percent': round(sum(p['cpu_percent'] or 0 for p in live), 1),
+            'rss_mb': round(sum(p['rss_mb'] or 0 for p in live), 1),
+            'processes': live,
+        }
+
+
+supervisor = FFmpegSupervisor()
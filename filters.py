@@ -0,0 +1,180 @@
+"""
+Audio filter engine
+Parses user filter specs (e.g. "bass=6 speed=1.1 eq=1000:-3 reverb"), validates them against a CPU
+budget and compiles them into a single FFmpeg -af graph, memoised per canonical spec
+"""
+import os
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger('discord_bot')
+
+# Maximum relative CPU cost of one filter graph (see FILTER_COSTS)
+FILTER_CPU_BUDGET = float(os.getenv("FILTER_CPU_BUDGET", "10"))
+MAX_EQ_BANDS = 8
+SAMPLE_RATE = 48000
+
+# Rough per-stage cost, relative to a single biquad
+FILTER_COSTS = {
+    'eq': 1.0,         # per band
+    'bass': 1.0,
+    'speed': 1.0,      # atempo
+    'rate': 2.0,       # asetrate + aresample
+    'pitch': 3.0,      # asetrate + aresample + atempo
+    'reverb': 2.0,     # aecho
+    'normalize': 4.0,  # loudnorm (upsamples internally)
+}
+
+# Named presets, expanded before parsing (kept compatible with the old fixed filters)
+PRESETS = {
+    'bass': 'bass=10',
+    'nightcore': 'rate=1.25 speed=1.1',
+    'pitch': 'rate=1.15',
+    'vaporwave': 'rate=0.8',
+    'chipmunk': 'pitch=1.5',
+    'slowed': 'speed=0.85 reverb=0.4',
+    'loud': 'normalize',
+}
+
+# name: (min, max, default when given without a value)
+RANGES = {
+    'bass': (-20.0, 20.0, 8.0),
+    'speed': (0.5, 2.0, 1.25),
+    'rate': (0.5, 2.0, 1.25),
+    'pitch': (0.5, 2.0, 1.25),
+    'reverb': (0.05, 0.9, 0.3),
+}
+EQ_FREQ_RANGE = (20.0, 20000.0)
+EQ_GAIN_RANGE = (-20.0, 20.0)
+
+
+class FilterError(ValueError):
+    """Raised for filter specs that are malformed, out of range or too expensive."""
+
+
+class FilterGraph:
+    """A compiled filter graph: the -af string, its playback speed and its CPU cost."""
+    __slots__ = ('spec', 'af', 'speed', 'cost')
+
+    def __init__(self, spec: str, af: Optional[str], speed: float, cost: float):
+        self.spec = spec
+        self.af = af
+        self.speed = speed
+        self.cost = cost
+
+
+def _number(name: str, value: str, low: float, high: float) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise FilterError(f"`{name}` ต้องเป็นตัวเลข")
+    if not low <= number <= high:
+        raise FilterError(f"`{name}` ต้องอยู่ระหว่าง {low:g} ถึง {high:g}")
+    return number
+
+
+@lru_cache(maxsize=256)
+def parse_filter(text: Optional[str]) -> Optional[str]:
+    """
+    Validates a filter spec and returns its canonical form (or None for no filter).
+    Tokens are separated by spaces: preset names, `name` or `name=value`, and `eq=<freq>:<gain>` (repeatable).
+    """
+    if not text or text.strip().lower() in ('none', 'off'):
+        return None
+    tokens: List[str] = []
+    for token in text.lower().replace(',', ' ').split():
+        tokens.extend(PRESETS[token].split() if token in PRESETS else [token])
+
+    params: Dict[str, float] = {}
+    bands: Dict[float, float] = {}
+    for token in tokens:
+        name, _, value = token.partition('=')
+        if name == 'eq':
+            freq, _, gain = value.partition(':')
+            bands[_number('eq freq', freq, *EQ_FREQ_RANGE)] = _number('eq gain', gain, *EQ_GAIN_RANGE)
+        elif name == 'normalize':
+            params['normalize'] = 1.0
+        elif name in RANGES:
+            low, high, default = RANGES[name]
+            params[name] = _number(name, value, low, high) if value else default
+        else:
+            raise FilterError(f"ไม่รู้จัก filter `{name}`")
+    if len(bands) > MAX_EQ_BANDS:
+        raise FilterError(f"EQ ได้สูงสุด {MAX_EQ_BANDS} ย่าน")
+
+    # Drop no-op values so equivalent specs share one cache entry
+    for name in ('speed', 'rate', 'pitch'):
+        if params.get(name) == 1.0:
+            del params[name]
+    if params.get('bass') == 0.0:
+        del params['bass']
+    bands = {f: g for f, g in bands.items() if g != 0.0}
+
+    parts = [f"eq={f:g}:{g:g}" for f, g in sorted(bands.items())]
+    parts += [name if name == 'normalize' else f"{name}={params[name]:g}" for name in sorted(params)]
+    if not parts:
+        return None
+    spec = ' '.join(parts)
+    compile_filter(spec)  # Enforces the CPU budget
+    return spec
+
+
+@lru_cache(maxsize=256)
+def compile_filter(spec: Optional[str]) -> FilterGraph:
+    """Compiles a canonical spec (from parse_filter) into an FFmpeg graph. Results are memoised."""
+    if not spec:
+        return FilterGraph(None, None, 1.0, 0.0)
+    stages: List[str] = []
+    speed = 1.0
+    cost = 0.0
+    params: Dict[str, float] = {}
+    bands: List[Tuple[float, float]] = []
+    for token in spec.split():
+        name, _, value = token.partition('=')
+        if name == 'eq':
+            freq, gain = value.split(':')
+            bands.append((float(freq), float(gain)))
+        else:
+            params[name] = float(value) if value else 1.0
+
+    for freq, gain in bands:
+        stages.append(f"equalizer=f={freq:g}:t=o:w=1:g={gain:g}")
+        cost += FILTER_COSTS['eq']
+    if 'bass' in params:
+        stages.append(f"bass=g={params['bass']:g}")
+        cost += FILTER_COSTS['bass']
+    if 'rate' in params:
+        # Vinyl-style: speed and pitch together
+        stages.append(f"aresample={SAMPLE_RATE},asetrate={SAMPLE_RATE}*{params['rate']:g},aresample={SAMPLE_RATE}")
+        speed *= params['rate']
+        cost += FILTER_COSTS['rate']
+    if 'pitch' in params:
+        # Shift pitch, then undo the tempo change
+        stages.append(f"aresample={SAMPLE_RATE},asetrate={SAMPLE_RATE}*{params['pitch']:g},"
+                      f"aresample={SAMPLE_RATE},atempo={1 / params['pitch']:.4f}")
+        cost += FILTER_COSTS['pitch']
+    if 'speed' in params:
+        stages.append(f"atempo={params['speed']:g}")
+        speed *= params['speed']
+        cost += FILTER_COSTS['speed']
+    if 'reverb' in params:
+        decay = params['reverb']
+        stages.append(f"aecho=0.8:0.88:60|120:{decay:g}|{decay * 0.6:.3g}")
+        cost += FILTER_COSTS['reverb']
+    if 'normalize' in params:
+        stages.append("loudnorm=I=-16:TP=-1.5:LRA=11")
+        cost += FILTER_COSTS['normalize']
+
+    if cost > FILTER_CPU_BUDGET:
+        raise FilterError(f"filter นี้ใช้ CPU มากเกินไป ({cost:g}/{FILTER_CPU_BUDGET:g})")
+    return FilterGraph(spec, ','.join(stages), speed, cost)
+
+
+def resolve_filter(spec: Optional[str]) -> FilterGraph:
+    """Parses and compiles a stored spec or preset name; falls back to no filter if it is not valid."""
+    try:
+        return compile_filter(parse_filter(spec))
+    except (FilterError, ValueError) as e:
+        logger.warning(f"Ignoring invalid filter '{spec}': {e}")
+        return compile_filter(None)
@@ -0,0 +1,58 @@
+"""
+Non-blocking logging
+Log calls only put the record on a bounded queue; a QueueListener thread does the formatting,
+file writes, rotation and dashboard hand-off, so logging never blocks the event loop or the
+voice threads. Records that don't fit in the queue are dropped and counted.
+"""
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record instead."""
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        # prepare() only merges args and traceback into the message; the listener's handlers add the rest
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self.enqueued = 0
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler: Optional[BoundedQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(handlers: List[logging.Handler], level: int = logging.INFO) -> BoundedQueueHandler:
+    """Routes the root logger through the queue to `handlers`, which run on the listener thread."""
+    global _queue_handler, _listener
+    _queue_handler = BoundedQueueHandler()
+    logging.basicConfig(level=level, handlers=[_queue_handler])
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _queue_handler
+
+
+def get_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {
+        'queued': _queue_handler.queue.qsize(),
+        'capacity': _queue_handler.queue.maxsize,
+        'enqueued': _queue_handler.enqueued,
+        'dropped': _queue_handler.dropped,
+    }
@@ -0,0 +1,249 @@
+"""
+Runtime health monitor
+Measures event loop scheduling lag, captures the stack of whatever blocks the loop longer than
+LOOP_SLOW_CALLBACK (sync SQLite, big embeds, ...), counts voice frames sent late, and provides an
+on-demand sampling profiler for /api/profile.
+"""
+import asyncio
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import logging
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+
+from metrics import timings, registry
+
+logger = logging.getLogger('discord_bot')
+
+# Seconds between loop ticks; lag is how late each tick runs
+LOOP_MONITOR_INTERVAL = 0.05
+# A loop blocked for longer than this records the blocking stack
+LOOP_SLOW_CALLBACK = float(os.getenv("LOOP_SLOW_CALLBACK", "0.1"))
+SLOW_CALLBACK_HISTORY = 20
+STACK_LIMIT = 25
+
+FRAME_LENGTH = 0.02
+# A frame read this long after the previous one went out late (one full frame of slack)
+FRAME_DEADLINE = FRAME_LENGTH * 2
+# Longer gaps are pauses or source swaps, not missed deadlines
+FRAME_PAUSE_GAP = 1.0
+
+# /api/profile is disabled unless a token is configured
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILE_MAX_SECONDS = 30.0
+
+LOOP_LAG_SECONDS = registry.histogram(
+    'event_loop_lag_seconds', 'How late the event loop ran a callback scheduled every 50ms',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+class LoopMonitor:
+    """
+    A callback rescheduled every LOOP_MONITOR_INTERVAL measures lag. A watchdog thread notices when the
+    tick is overdue by LOOP_SLOW_CALLBACK and grabs the loop thread's stack while it is still blocked.
+    """
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_SLOW_CALLBACK):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = timings.get('event_loop.lag')  # Rolling window, also listed on the dashboard
+        self.max_lag = 0.0
+        self.blocked = 0
+        self.slow_callbacks: deque = deque(maxlen=SLOW_CALLBACK_HISTORY)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        self._stall: Optional[dict] = None  # Stack captured by the watchdog, completed by the next tick
+        self._stopped = threading.Event()
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        if self._handle is not None:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._expected = time.perf_counter() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._expected)
+        self.lag.observe(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        stall, self._stall = self._stall, None
+        if stall is not None:
+            stall['duration_ms'] = round(lag * 1000, 1)
+            self.blocked += 1
+            self.slow_callbacks.append(stall)
+            logger.warning(f"Event loop blocked for {stall['duration_ms']:.0f}ms at {stall['where']}")
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            overdue = time.perf_counter() - self._expected
+            if overdue < self.threshold or self._stall is not None:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            where = stack[-1] if stack else None
+            self._stall = {
+                'time': datetime.now().strftime("%H:%M:%S"),
+                'where': f"{os.path.basename(where.filename)}:{where.lineno} in {where.name}" if where else '?',
+                'stack': ''.join(stack.format()),
+                'duration_ms': None,
+            }
+
+    def get_stats(self) -> dict:
+        lag = self.lag.snapshot()
+        return {
+            'lag_p50_ms': lag['p50_ms'],
+            'lag_p95_ms': lag['p95_ms'],
+            'lag_max_ms': round(self.max_lag * 1000, 2),
+            'slow_threshold_ms': round(self.threshold * 1000),
+            'blocked': self.blocked,
+            'slow_callbacks': list(self.slow_callbacks)[::-1],
+        }
+
+
+class FrameDeadlines:
+    """
+    Gaps between consecutive frame reads by the voice threads. The player reads one frame per 20ms,
+    so a gap beyond FRAME_DEADLINE means a packet went out late (GIL contention, slow encode).
+    Sources call check() from read(); it is one clock read and a comparison.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.missed = 0
+        self.worst_gap = 0.0
+        self._recent: deque = deque(maxlen=1000)  # Monotonic times of recent misses
+
+    def check(self, last: Optional[float]) -> float:
+        now = time.perf_counter()
+        self.frames += 1
+        if last is not None:
+            gap = now - last
+            if FRAME_DEADLINE < gap < FRAME_PAUSE_GAP:
+                self.missed += 1
+                self._recent.append(now)
+                if gap > self.worst_gap:
+                    self.worst_gap = gap
+        return now
+
+    def get_stats(self) -> dict:
+        cutoff = time.perf_counter() - 60
+        return {
+            'frames': self.frames,
+            'missed': self.missed,
+            'missed_last_minute': sum(1 for t in list(self._recent) if t >= cutoff),
+            'miss_rate': round(self.missed / self.frames, 5) if self.frames else 0.0,
+            'worst_gap_ms': round(self.worst_gap * 1000, 1),
+        }
+
+
+# --- Sampling profiler ---
+
+_profile_lock = threading.Lock()
+
+
+def check_profiler_token(token: str) -> bool:
+    return bool(PROFILER_TOKEN) and hmac.compare_digest(token.encode(), PROFILER_TOKEN.encode())
+
+
+def _thread_group(name: str) -> str:
+    """Folds per-instance thread names (read-ahead-7f3a..., Thread-12 (...)) into one group."""
+    name = re.sub(r'-[0-9a-f]{6,}$', '', name)
+    return re.sub(r'^Thread-\d+', 'Thread', name)
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Optional[dict]:
+    """
+    Samples the stacks of every thread for `seconds`. Returns None if a profile is already running.
+    Blocking: run it on its own thread (see profile()).
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        own = threading.get_ident()
+        names = {}
+        stacks: Counter = Counter()
+        threads: Counter = Counter()
+        samples = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: _thread_group(thread.name) for thread in threading.enumerate()}
+                group = names.get(ident, 'unknown')
+                frames = []
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    location = f"{os.path.basename(code.co_filename)}:{frame.f_lineno}" if leaf else os.path.basename(code.co_filename)
+                    frames.append(f"{code.co_name} ({location})")
+                    frame = frame.f_back
+                    leaf = False
+                stacks[(group,) + tuple(reversed(frames))] += 1
+                threads[group] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+
+    total = sum(stacks.values()) or 1
+    return {
+        'seconds': seconds,
+        'interval': interval,
+        'samples': samples,
+        'threads': dict(threads.most_common()),
+        'top': [
+            {'thread': stack[0], 'stack': list(stack[1:][-10:]), 'count': count, 'percent': round(count / total * 100, 1)}
+            for stack, count in stacks.most_common(20)
+        ],
+        # Brendan Gregg's folded format, for flamegraph.pl or speedscope
+        'collapsed': '\n'.join(f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()),
+    }
+
+
+async def profile(seconds: float, interval: float = 0.005) -> Optional[dict]:
+    """Runs sample_stacks on a dedicated thread (the default executor may be busy with yt-dlp)."""
+    seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+    interval = max(0.001, float(interval))
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def run():
+        try:
+            result = sample_stacks(seconds, interval)
+            loop.call_soon_threadsafe(future.set_result, result)
+        except Exception as e:
+            loop.call_soon_threadsafe(future.set_exception, e)
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return await future
+
+
+loop_monitor = LoopMonitor()
+voice_deadlines = FrameDeadlines()
+
+registry.counter('voice_frames_missed_total', 'Voice frames read more than one frame late', lambda: voice_deadlines.missed)
+registry.counter('event_loop_blocked_total', 'Times the event loop was blocked beyond the slow-callback threshold',
+                 lambda: loop_monitor.blocked)
@@ -0,0 +1,132 @@
+"""
+Background loudness analysis
+Measures integrated loudness (EBU R128) of tracks that are queued or replayed with FFmpeg's
+ebur128 filter, off the playback path, and stores the resulting gain with the cached metadata
+"""
+import asyncio
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import timings
+from ffmpeg_supervisor import supervisor
+
+logger = logging.getLogger('discord_bot')
+
+# Target integrated loudness and the largest correction applied
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-14"))
+LOUDNESS_MAX_GAIN = float(os.getenv("LOUDNESS_MAX_GAIN", "10"))
+# Seconds of audio to measure (0 = whole track)
+LOUDNESS_SAMPLE_SECONDS = float(os.getenv("LOUDNESS_SAMPLE_SECONDS", "90"))
+# Minimum seconds between starting two analyses, and pending tracks kept
+LOUDNESS_MIN_INTERVAL = float(os.getenv("LOUDNESS_MIN_INTERVAL", "5"))
+LOUDNESS_QUEUE_SIZE = int(os.getenv("LOUDNESS_QUEUE_SIZE", "50"))
+LOUDNESS_TIMEOUT = 120.0
+
+INTEGRATED_RE = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+def loudness_gain(loudness: float) -> float:
+    """Gain in dB that brings `loudness` (LUFS) to the target, clamped and rounded to 0.5 dB."""
+    gain = max(-LOUDNESS_MAX_GAIN, min(LOUDNESS_MAX_GAIN, LOUDNESS_TARGET_LUFS - loudness))
+    return round(gain * 2) / 2
+
+
+class LoudnessAnalyzer:
+    """
+    One analysis at a time, at most one start per LOUDNESS_MIN_INTERVAL, run as a low-priority
+    FFmpeg process. Tracks are deduplicated and the oldest pending ones are dropped past LOUDNESS_QUEUE_SIZE.
+    """
+    def __init__(self, cache, resolver=None):
+        self.cache = cache
+        self.resolver = resolver  # async (url) -> yt-dlp info, used when no usable stream URL is cached
+        self._pending: "OrderedDict[str, None]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.analyzed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def schedule(self, url: Optional[str]):
+        """Queues a track for analysis unless it has already been measured."""
+        if not url or url in self._pending:
+            return
+        cached = self.cache.get(url)
+        if cached and (cached.get('loudness') is not None or cached.get('is_live')):
+            return
+        self._pending[url] = None
+        while len(self._pending) > LOUDNESS_QUEUE_SIZE:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            url, _ = self._pending.popitem(last=False)
+            started = time.perf_counter()
+            try:
+                await self.analyze(url)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Loudness analysis failed for {url}: {e}")
+            await asyncio.sleep(max(0.0, LOUDNESS_MIN_INTERVAL - (time.perf_counter() - started)))
+
+    async def analyze(self, url: str):
+        data = self.cache.get_playable(url)
+        if data is None and self.resolver:
+            info = await self.resolver(url)
+            if info and 'url' in info:
+                data = self.cache.put(url, info)
+        if not data or data.get('is_live') or data.get('loudness') is not None:
+            return
+
+        args = ['ffmpeg', '-hide_banner', '-nostats', '-nostdin']
+        duration = data.get('duration') or 0
+        if LOUDNESS_SAMPLE_SECONDS and duration > 2 * LOUDNESS_SAMPLE_SECONDS:
+            # Measure from a quarter of the way in, past quiet intros
+            args += ['-ss', f"{duration * 0.25:.0f}"]
+        args += ['-i', data['url'], '-vn']
+        if LOUDNESS_SAMPLE_SECONDS:
+            args += ['-t', f"{LOUDNESS_SAMPLE_SECONDS:.0f}"]
+        args += ['-af', 'ebur128', '-f', 'null', '-']
+
+        with timings.timer('loudness.analyze'):
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=(lambda: os.nice(10)) if hasattr(os, 'nice') else None
+            )
+            supervisor.track_process(process, 'loudness', url=data['url'])
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), LOUDNESS_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise RuntimeError("ffmpeg timed out")
+
+        # The summary at the end repeats the integrated value; take the last one
+        matches = INTEGRATED_RE.findall(stderr.decode(errors='ignore'))
+        if process.returncode != 0 or not matches:
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}")
+        loudness = float(matches[-1])
+        gain = loudness_gain(loudness)
+        self.cache.set_loudness(url, loudness, gain)
+        self.analyzed += 1
+        logger.info(f"Loudness of {data.get('title') or url}: {loudness:.1f} LUFS, gain {gain:+.1f} dB")
+
+    def get_stats(self) -> dict:
+        return {
+            'analyzed': self.analyzed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'pending': len(self._pending),
+        }
@@ -3,17 +3,29 @@ import discord
 import os
 import logging
 import json
-from threading import Thread
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 import uvicorn
 from discord.ext import commands
 from typing import Dict, Optional, List
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
+# Project modules read their settings at import time, so .env has to be loaded first
+load_dotenv()
+
+from metrics import timings, registry as metrics_registry, INTERACTION_FOLLOWUP_SECONDS
+from cluster import CLUSTER_ID, SHARD_IDS, SHARD_COUNT, ClusterClient, owns_guild
+from ws_hub import FanoutHub
+from stats_aggregator import StatsAggregator
+from loop_monitor import loop_monitor, voice_deadlines, profile, check_profiler_token
+
 # --- 1. Dashboard API & Health Check Server ---
 app = FastAPI(title="Sakudoko Bot Dashboard API", version="2.0.0")
 
@@ -26,6 +38,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Seconds between batched log pushes to the dashboard
+LOG_PUSH_INTERVAL = 0.25
+
 # Global state for bot and dashboard
 class BotState:
     def __init__(self):
@@ -33,16 +48,15 @@ class BotState:
         self.start_time = datetime.now()
         self.is_online = False
         self.logs = []
-        self.websocket_clients: List[WebSocket] = []
+        self._logs_lock = threading.Lock()
+        self._pending_logs: List[dict] = []  # Entries not yet pushed to WebSocket clients
+        self._push_scheduled = False
+        self.ws_hub = FanoutHub()  # Dashboard WebSocket clients
+        self.stats = StatsAggregator(self.start_time)  # Server/user counts kept current from gateway events
+        self.stats.listeners.append(self._push_stats)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # The bot loop, which also serves the dashboard
+        self.dashboard: Optional["DashboardServer"] = None
         
-    def get_uptime(self):
-        """Calculate uptime from start_time"""
-        delta = datetime.now() - self.start_time
-        days = delta.days
-        hours = delta.seconds // 3600
-        minutes = (delta.seconds % 3600) // 60
-        return f"{days}d {hours}h {minutes}m"
-    
     def add_log(self, log_type: str, message: str):
         """Add a new log entry"""
         timestamp = datetime.now().strftime("[%H:%M:%S]")
@@ -51,38 +65,45 @@ class BotState:
             "type": log_type,
             "message": message
         }
-        self.logs.append(log_entry)
-        # Keep only last 50 logs
-        if len(self.logs) > 50:
-            self.logs.pop(0)
+        loop = self.loop
+        with self._logs_lock:
+            self.logs.append(log_entry)
+            # Keep only last 50 logs
+            if len(self.logs) > 50:
+                self.logs.pop(0)
+            self._pending_logs.append(log_entry)
+            schedule = loop is not None and not self._push_scheduled
+            self._push_scheduled = self._push_scheduled or schedule
         
-        # Broadcast to WebSocket clients (only if event loop is running)
-        try:
-            loop = asyncio.get_running_loop()
-            asyncio.create_task(self.broadcast_log(log_entry))
-        except RuntimeError:
-            # Event loop not running yet, skip broadcasting
-            pass
+        # Called from any thread (mostly the log listener); entries are pushed in batches on the bot loop
+        if schedule and not loop.is_closed():
+            loop.call_soon_threadsafe(loop.call_later, LOG_PUSH_INTERVAL, self._push_pending)
         return log_entry
     
-    async def broadcast_log(self, log_entry: dict):
-        """Broadcast new log to all connected WebSocket clients"""
-        disconnected = []
-        for client in self.websocket_clients:
-            try:
-                await client.send_json({
-                    "type": "new_log",
-                    "log": log_entry
-                })
-            except:
-                disconnected.append(client)
-        
-        # Remove disconnected clients
-        for client in disconnected:
-            self.websocket_clients.remove(client)
+    def _push_pending(self):
+        with self._logs_lock:
+            batch, self._pending_logs = self._pending_logs, []
+            self._push_scheduled = False
+        if not batch:
+            return
+        # In cluster mode the launcher's dashboard shows the logs of every process
+        if self.bot and self.bot.cluster:
+            self.bot.cluster.send_event("logs", logs=batch)
+        self.ws_hub.publish({"type": "log_batch", "logs": batch})
+
+    def _push_stats(self, stats: dict):
+        if self.bot and self.bot.cluster:
+            self.bot.cluster.send_event("stats", stats=stats)
+        self.ws_hub.publish({"type": "stats", "stats": stats})
 
 bot_state = BotState()
 
+@app.middleware("http")
+async def time_requests(request, call_next):
+    """Requests run on the bot loop, so their cost shows up next to the gateway timings."""
+    with timings.timer('dashboard.request'):
+        return await call_next(request)
+
 # Mount static files (assets folder)
 app.mount("/assets", StaticFiles(directory="assets"), name="assets")
 
@@ -101,30 +122,36 @@ async def health_check_simple():
 @app.get("/api/health")
 async def health_check():
     """Detailed health check endpoint"""
+    latency = bot_state.bot.latency if bot_state.bot else float('nan')
     return {
         "status": "online" if bot_state.is_online else "offline",
-        "latency": round(bot_state.bot.latency * 1000) if bot_state.bot else 0,
-        "timestamp": datetime.now().isoformat()
+        # NaN until the first heartbeat (the dashboard is up before login)
+        "latency": round(latency * 1000) if math.isfinite(latency) else 0,
+        "timestamp": datetime.now().isoformat(),
+        "event_loop": loop_monitor.get_stats(),
+        "voice": voice_deadlines.get_stats()
     }
 
+@app.get("/api/profile")
+async def get_profile(token: str = "", seconds: float = 5.0, interval: float = 0.005, format: str = "json"):
+    """Sample every thread's stack for a few seconds (requires PROFILER_TOKEN)"""
+    if not check_profiler_token(token):
+        raise HTTPException(status_code=403, detail="Profiler disabled or wrong token")
+    result = await profile(seconds, interval)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if format == "collapsed":
+        return PlainTextResponse(result["collapsed"] + "\n")
+    return result
+
 @app.get("/api/stats")
-async def get_stats():
-    """Get bot statistics"""
-    if not bot_state.bot:
-        return {"servers": 0, "users": 0, "uptime": "0d 0h 0m"}
-    
-    servers = len(bot_state.bot.guilds)
-    users = sum(guild.member_count for guild in bot_state.bot.guilds)
-    
-    return {
-        "servers": servers,
-        "users": users,
-        "uptime": bot_state.get_uptime(),
-        "uptime_raw": {
-            "days": (datetime.now() - bot_state.start_time).days,
-            "total_seconds": (datetime.now() - bot_state.start_time).total_seconds()
-        }
-    }
+async def get_stats(request: Request):
+    """Get bot statistics (precomputed snapshot; answers 304 to a matching If-None-Match)"""
+    return bot_state.stats.response(request)
+
+async def get_stats_snapshot():
+    """Bot statistics as a dict, for the cluster launcher"""
+    return bot_state.stats.snapshot()[0]
 
 @app.get("/api/logs")
 async def get_logs(limit: int = 20):
@@ -134,6 +161,39 @@ async def get_logs(limit: int = 20):
         "total": len(bot_state.logs)
     }
 
+@app.get("/api/perf")
+async def get_perf():
+    """Get REST scheduler counters and recorded timings"""
+    return {
+        "rest": bot_state.bot.rest.get_stats() if bot_state.bot else {},
+        "message_cleanup": bot_state.bot.sweeper.get_stats() if bot_state.bot else {},
+        "permissions": bot_state.bot.permission_sync.get_stats() if bot_state.bot else {},
+        "track_cache": bot_state.bot.track_cache.get_stats() if bot_state.bot else {},
+        "sessions": bot_state.bot.sessions.get_stats() if bot_state.bot else {},
+        "loudness": bot_state.bot.loudness.get_stats() if bot_state.bot else {},
+        "opus_cache": bot_state.bot.opus_cache.get_stats() if bot_state.bot else {},
+        "source_tiers": get_source_tier_stats(),
+        "broadcast": bot_state.bot.broadcast.get_stats() if bot_state.bot and bot_state.bot.broadcast else {},
+        "stations": bot_state.bot.stations.get_stats() if bot_state.bot else {},
+        "buffers": {
+            str(guild_id): stats for guild_id, manager in list(bot_state.bot.managers.items())
+            if (stats := manager.get_buffer_stats())
+        } if bot_state.bot else {},
+        "ffmpeg": bot_state.bot.ffmpeg_supervisor.get_stats() if bot_state.bot else {},
+        "audio_nodes": bot_state.bot.audio_nodes.get_stats() if bot_state.bot else {},
+        "logging": get_log_stats(),
+        "websocket": bot_state.ws_hub.get_stats(),
+        "timings": timings.snapshot()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics (histograms, gauges and the dashboard timings)"""
+    return PlainTextResponse(await get_metrics_text(), media_type="text/plain; version=0.0.4")
+
+async def get_metrics_text():
+    return metrics_registry.render(timings)
+
 @app.get("/api/commands")
 async def get_commands():
     """Get available bot commands"""
@@ -146,7 +206,9 @@ async def get_commands():
             {"name": "/shuffle", "description": "สุ่มลำดับเพลงในคิว"},
             {"name": "/loop", "description": "เปิด/ปิดการเล่นซ้ำคิวเพลง"},
             {"name": "/autoplay", "description": "เปิด/ปิดโหมดเล่นเพลงอัตโนมัติ"},
-            {"name": "/filter", "description": "ตั้งค่า filter/effect (bass, nightcore, pitch)"},
+            {"name": "/filter", "description": "ตั้งค่า filter/effect (รวมได้ เช่น nightcore, bass=6 speed=1.1, eq=1000:-3 reverb)"},
+            {"name": "/seek", "description": "ข้ามไปยังตำแหน่งที่ต้องการในเพลงปัจจุบัน"},
+            {"name": "/station", "description": "โหมดสถานีเพลง 24/7 (start, stop, list)"},
         ]
     }
 
@@ -155,98 +217,134 @@ async def get_commands():
 async def websocket_logs(websocket: WebSocket):
     """WebSocket endpoint for real-time log streaming"""
     await websocket.accept()
-    bot_state.websocket_clients.append(websocket)
-    
-    try:
-        # Send initial logs
-        await websocket.send_json({
-            "type": "initial",
-            "logs": bot_state.logs[-10:]
-        })
-        
-        # Keep connection alive
-        while True:
-            try:
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                if data == "ping":
-                    await websocket.send_text("pong")
-            except asyncio.TimeoutError:
-                await websocket.send_json({"type": "keepalive"})
-                
-    except WebSocketDisconnect:
-        bot_state.websocket_clients.remove(websocket)
-    except Exception as e:
-        print(f"WebSocket error: {e}")
-        if websocket in bot_state.websocket_clients:
-            bot_state.websocket_clients.remove(websocket)
-
-def run_dashboard_server():
-    """Run FastAPI dashboard server"""
-    uvicorn.run(app, host="0.0.0.0", port=8080, log_level="error")
-
-Thread(target=run_dashboard_server, daemon=True).start()
+    await bot_state.ws_hub.serve(websocket, initial={
+        "type": "initial",
+        "logs": bot_state.logs[-10:],
+        "stats": bot_state.stats.snapshot()[0]
+    })
+
+class DashboardServer(uvicorn.Server):
+    """uvicorn server running as a task on the bot's event loop; signals are left to main's handlers."""
+    @contextmanager
+    def capture_signals(self):
+        yield
+
+    def install_signal_handlers(self):
+        pass
+
+def start_dashboard_server() -> Optional[asyncio.Task]:
+    """Serve the FastAPI dashboard on the running (bot) event loop"""
+    bot_state.loop = asyncio.get_running_loop()
+    # In cluster mode the launcher serves the (merged) dashboard instead
+    if CLUSTER_ID is not None:
+        return None
+    bot_state.dashboard = DashboardServer(uvicorn.Config(app, host="0.0.0.0", port=8080, log_level="error"))
+    return asyncio.create_task(bot_state.dashboard.serve())
 
 # --- 2. Configuration and Logging ---
-load_dotenv()
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
 from logging.handlers import RotatingFileHandler
+from log_pipeline import setup_logging, get_stats as get_log_stats
+
+LOG_FORMAT = logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s')
 
 # Setup logging with rotation
 log_handler = RotatingFileHandler(
-    'bot.log',
+    'bot.log' if CLUSTER_ID is None else f'bot-{CLUSTER_ID}.log',
     maxBytes=5*1024*1024,  # 5MB
     backupCount=5,
     encoding='utf-8'
 )
-log_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s'))
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s %(name)s: %(message)s',
-    handlers=[log_handler, logging.StreamHandler()]
-)
-logger = logging.getLogger('discord_bot')
+log_handler.setFormatter(LOG_FORMAT)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(LOG_FORMAT)
 
 # Custom logging handler to send logs to dashboard
 class DashboardLogHandler(logging.Handler):
     def emit(self, record):
         try:
             log_type = "INFO" if record.levelname == "INFO" else "ERROR"
-            message = self.format(record)
-            # Remove timestamp from message as it's added by bot_state.add_log
-            message = message.split('] ', 1)[-1] if '] ' in message else message
-            bot_state.add_log(log_type, message)
-        except:
+            # The queue handler has already merged args (and any traceback) into record.msg
+            bot_state.add_log(log_type, record.getMessage())
+        except Exception:
             pass
 
 dashboard_handler = DashboardLogHandler()
-dashboard_handler.setFormatter(logging.Formatter('%(message)s'))
-logger.addHandler(dashboard_handler)
+dashboard_handler.addFilter(logging.Filter('discord_bot'))
+
+# All three handlers run on the log listener thread, never in the caller
+setup_logging([log_handler, console_handler, dashboard_handler], level=logging.INFO)
+logger = logging.getLogger('discord_bot')
 
 # --- 3. Bot Utilities ---
-async def notify_admin(bot: commands.Bot, message: str):
-    """Send DM to admin when a critical error occurs."""
-    if ADMIN_USER_ID:
+from rest_scheduler import RestScheduler, Priority
+from message_sweeper import MessageSweeper
+from permissions import PermissionSync
+from music_rooms import MusicRoomIndex
+from track_cache import TrackCache
+from session_store import SessionStore
+from loudness import LoudnessAnalyzer
+from opus_cache import OpusDiskCache
+from broadcast import BroadcastHub, BROADCAST_ENABLED
+from stations import StationDirectory
+from ffmpeg_supervisor import supervisor as ffmpeg_supervisor
+from audio_node import AudioNodePool
+
+def send_admin_dm(bot: commands.Bot, content: str):
+    """Queue a DM to the admin as cosmetic work (dropped if Discord is under pressure)."""
+    if not ADMIN_USER_ID:
+        return
+
+    async def _send():
         try:
-            user = await bot.fetch_user(ADMIN_USER_ID)
-            await user.send(f"[CRITICAL ERROR]\n{message}")
+            user = bot.get_user(ADMIN_USER_ID) or await bot.fetch_user(ADMIN_USER_ID)
+            await user.send(content)
         except Exception as e:
             logger.error(f"Failed to notify admin: {e}")
 
+    bot.rest.submit_nowait(Priority.COSMETIC, "admin_dm", _send)
+
+async def notify_admin(bot: commands.Bot, message: str):
+    """Send DM to admin when a critical error occurs."""
+    send_admin_dm(bot, f"[CRITICAL ERROR]\n{message}")
+
 # --- 4. Bot Definition ---
 from music_manager import MusicManager
+from player import YTDL_INSTANCE, get_source_tier_stats
+from views import MusicControlView, ResumeSessionView
 from database import Database
 
-class MyBot(commands.Bot):
+# Cluster processes are AutoShardedBots over their slice of shards; a single process stays a plain Bot
+BotBase = commands.AutoShardedBot if SHARD_IDS is not None else commands.Bot
+
+class MyBot(BotBase):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.voice_states = True
-        super().__init__(command_prefix="!", intents=intents)
+        sharding = {'shard_ids': SHARD_IDS, 'shard_count': SHARD_COUNT} if SHARD_IDS is not None else {}
+        super().__init__(command_prefix="!", intents=intents, **sharding)
         self.managers: Dict[int, MusicManager] = {}
         self.user_last_request: Dict[int, float] = {}
+        self.rest = RestScheduler()  # Prioritised outgoing REST calls
+        self.sweeper = MessageSweeper(self.rest)  # Batched music room cleanup
+        self.permission_sync = PermissionSync(self)  # Debounced music room overwrites
+        self.music_rooms = MusicRoomIndex()  # Known music rooms by name
+        self.control_view: Optional[MusicControlView] = None  # Shared persistent control panel
         self.db = Database()  # Initialize database
+        self.track_cache = TrackCache(self.db)  # Resolved track metadata
+        self.sessions = SessionStore(self, self.db)  # Queue/position snapshots for resume
+        self.opus_cache = OpusDiskCache(self.db)  # Pre-encoded hot tracks on disk
+        self.broadcast = BroadcastHub() if BROADCAST_ENABLED else None  # Shared decodes across guilds
+        self.stations = StationDirectory(self.broadcast)  # Configured 24/7 stations
+        self.loudness = LoudnessAnalyzer(self.track_cache, resolver=YTDL_INSTANCE.extract_info)  # Background gain analysis
+        self.ffmpeg_supervisor = ffmpeg_supervisor  # FFmpeg process stats, stall recovery, zombie reaping
+        self.audio_nodes = AudioNodePool()  # Worker processes that decode/encode audio (if configured)
+        self.cluster: Optional[ClusterClient] = None  # Link to the cluster launcher (cluster mode only)
+        self.pending_sessions: Dict[int, dict] = {}  # Saved sessions waiting for Resume/Discard
+        self.resume_offered = False
+        self.shutting_down = False
 
     def get_manager(self, guild_id: int) -> MusicManager:
         """Retrieves or creates a MusicManager instance for a guild."""
@@ -260,6 +358,25 @@ class MyBot(commands.Bot):
 
     async def setup_hook(self):
         """Load cogs and sync slash commands."""
+        # Register the persistent control panel once so its buttons survive restarts
+        self.control_view = MusicControlView(self)
+        self.add_view(self.control_view)
+        self.add_view(ResumeSessionView(self))
+        self.ffmpeg_supervisor.start(self)
+        loop_monitor.start()
+        if CLUSTER_ID is not None:
+            self.cluster = ClusterClient(CLUSTER_ID, {
+                'health': health_check, 'stats': get_stats_snapshot, 'logs': get_logs,
+                'perf': get_perf, 'commands': get_commands, 'metrics': get_metrics_text,
+                'profile': profile,
+            })
+            self.cluster.start()
+        if self.audio_nodes.enabled:
+            await self.audio_nodes.start()
+        self.pending_sessions = self.sessions.load()
+        if self.pending_sessions:
+            logger.info(f"Found {len(self.pending_sessions)} interrupted session(s) to offer for resume")
+        
         try:
             await self.load_extension('basic')
             logger.info("Loaded basic Cog.")
@@ -271,13 +388,30 @@ class MyBot(commands.Bot):
             logger.error(f"Failed to load extensions: {e}", exc_info=True)
             raise
         
-        # Sync all slash commands globally
-        await self.tree.sync()
-        logger.info("Slash commands synced in setup_hook.")
+        # Sync all slash commands globally (once per cluster, from its first process)
+        if not CLUSTER_ID:
+            await self.tree.sync()
+            logger.info("Slash commands synced in setup_hook.")
 
 bot = MyBot()
 bot_state.bot = bot
 
+def executor_backlog() -> int:
+    """Jobs waiting for a thread in the loop's default executor (yt-dlp, source priming, cache writes)."""
+    executor = getattr(asyncio.get_running_loop(), '_default_executor', None)
+    work_queue = getattr(executor, '_work_queue', None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+# Gauges are read when /metrics is scraped
+metrics_registry.gauge('voice_connections', 'Connected voice clients', lambda: len(bot.voice_clients))
+metrics_registry.gauge('queued_tracks', 'Tracks waiting in all guild queues',
+                       lambda: sum(len(manager.queue) for manager in list(bot.managers.values())))
+metrics_registry.gauge('queue_length_max', 'Longest guild queue',
+                       lambda: max((len(manager.queue) for manager in list(bot.managers.values())), default=0))
+metrics_registry.gauge('executor_backlog', 'Jobs queued for the default thread pool executor', executor_backlog)
+metrics_registry.gauge('gateway_latency_seconds', 'Gateway heartbeat latency', lambda: bot.latency)
+metrics_registry.gauge('guilds', 'Guilds the bot is in', lambda: len(bot_state.stats.member_counts))
+
 # --- 5. Event Handlers ---
 
 @bot.event
@@ -290,26 +424,132 @@ async def on_ready():
     )
     await bot.change_presence(status=discord.Status.online, activity=activity)
     bot_state.is_online = True
+    bot_state.stats.rebuild(bot.guilds)
     bot_state.add_log("INFO", "Bot is now ONLINE")
-    
-    try:
-        if ADMIN_USER_ID:
-            user = await bot.fetch_user(ADMIN_USER_ID)
-            await user.send(f"[BOT STATUS] ✅ Bot is ONLINE as {bot.user}")
-    except Exception as e:
-        logger.error(f"Failed to notify admin on_ready: {e}")
+    send_admin_dm(bot, f"[BOT STATUS] ✅ Bot is ONLINE as {bot.user}")
+    if bot.cluster:
+        bot.cluster.send_event("ready")
+    if not bot.resume_offered:
+        bot.resume_offered = True
+        await restore_stations()
+        await offer_session_resumes()
+
+async def restore_stations():
+    """Reconnects rooms that were tuned to a 24/7 station before the restart."""
+    for row in bot.db.get_guild_stations():
+        if not owns_guild(row['guild_id']):
+            continue
+        guild = bot.get_guild(row['guild_id'])
+        voice_channel = guild.get_channel(row['voice_channel_id'] or 0) if guild else None
+        if voice_channel is None or row['station'] not in bot.stations.stations:
+            bot.db.delete_guild_station(row['guild_id'])
+            continue
+        # The station replaces whatever session was interrupted
+        bot.pending_sessions.pop(guild.id, None)
+        manager = bot.get_manager(guild.id)
+        try:
+            vc = guild.voice_client or await voice_channel.connect()
+            manager.attach_voice_client(vc)
+            await guild.me.edit(deafen=True)
+            manager.music_channel_id = row['text_channel_id']
+            await manager.start_station(row['station'])
+            logger.info(f"Restored station '{row['station']}' in guild {guild.id}")
+        except Exception as e:
+            logger.error(f"Failed to restore station in guild {guild.id}: {e}")
+
+async def offer_session_resumes():
+    """Posts a Resume/Discard prompt in the music room of every interrupted session."""
+    for guild_id, session in list(bot.pending_sessions.items()):
+        channel = bot.get_channel(session.get('text_channel_id') or 0)
+        if channel is None:
+            bot.pending_sessions.pop(guild_id, None)
+            bot.sessions.delete(guild_id)
+            continue
+        manager = bot.get_manager(guild_id)
+        manager.music_channel_id = channel.id
+        manager.owner_id = session.get('owner_id')
+
+        lines = []
+        current_url = session.get('current_url')
+        if current_url:
+            cached = bot.track_cache.get(current_url)
+            title = cached.get('title') if cached else None
+            position = int(session.get('position') or 0)
+            lines.append(f"🎵 **{title or current_url}** (ที่ {position // 60}:{position % 60:02d})")
+        lines.append(f"📋 เพลงในคิว: {len(session['queue'])} เพลง")
+        embed = discord.Embed(
+            title="Previous Session",
+            description="บอทถูกรีสตาร์ทระหว่างเล่นเพลง ต้องการเล่นต่อหรือไม่?\n\n" + "\n".join(lines),
+            color=0x7289da
+        )
+        try:
+            await bot.rest.submit(
+                Priority.NORMAL, f"channel:{channel.id}",
+                lambda channel=channel, embed=embed: channel.send(embed=embed, view=ResumeSessionView(bot))
+            )
+        except Exception as e:
+            logger.warning(f"Could not offer session resume in guild {guild_id}: {e}")
 
 @bot.event
 async def on_guild_join(guild: discord.Guild):
     try:
         logger.info(f"Bot invited to server: {guild.name} (ID: {guild.id})")
         bot_state.add_log("INFO", f"Joined server: {guild.name}")
+        bot_state.stats.set_guild(guild)
         bot.get_manager(guild.id) # Initialize manager
         await bot.tree.sync(guild=guild)
         logger.info(f"Slash commands synced for guild {guild.id}")
     except Exception as e:
         logger.error(f"Exception in on_guild_join: {e}")
 
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    deferred_at = interaction.extras.get('deferred_at')
+    if deferred_at is not None:
+        INTERACTION_FOLLOWUP_SECONDS.observe(time.perf_counter() - deferred_at, command.qualified_name)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    bot.music_rooms.forget_guild(guild.id)
+    bot_state.stats.remove_guild(guild.id)
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    bot_state.stats.set_guild(guild)
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    # Cluster mode only: a shard that re-identified after startup brings its guilds back; on_ready does the first count
+    if bot.is_ready():
+        bot_state.stats.rebuild(bot.guilds)
+
+# Member events need the members intent; without it counts refresh on guild events only
+@bot.event
+async def on_member_join(member: discord.Member):
+    bot_state.stats.set_guild(member.guild)
+
+@bot.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    guild = bot.get_guild(payload.guild_id)
+    if guild is not None:
+        bot_state.stats.set_guild(guild)
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    # Rooms created by hand (or recreated after a delete) must be found by /join too
+    if isinstance(channel, discord.TextChannel):
+        bot.music_rooms.add(channel)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    bot.music_rooms.discard(channel)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if before.name != after.name:
+        bot.music_rooms.discard(before)
+        bot.music_rooms.add(after)
+
 @bot.event
 async def on_message(message: discord.Message):
     try:
@@ -322,8 +562,7 @@ async def on_message(message: discord.Message):
         now = asyncio.get_event_loop().time()
         last = bot.user_last_request.get(message.author.id, 0)
         if now - last < 2:
-            try: await message.delete()
-            except Exception: pass
+            bot.sweeper.add(message)
             return
         bot.user_last_request[message.author.id] = now
 
@@ -334,32 +573,30 @@ async def on_message(message: discord.Message):
             # Permission Check - ต้องอยู่ในห้องเสียงเดียวกับบอท
             if not message.author.voice or not message.author.voice.channel:
                 embed = discord.Embed(title="Error", description="❌ คุณต้องอยู่ในห้องเสียงก่อน!", color=0xff0000)
-                await message.channel.send(embed=embed, delete_after=5)
-                try: await message.delete()
-                except Exception: pass
+                await bot.sweeper.send_temporary(message.channel, 5, embed=embed)
+                bot.sweeper.add(message)
                 return
             
             # ตรวจสอบว่าอยู่ห้องเดียวกับบอทหรือไม่
             vc = message.guild.voice_client
             if vc and vc.channel and message.author.voice.channel.id != vc.channel.id:
                 embed = discord.Embed(title="Error", description="❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", color=0xff0000)
-                await message.channel.send(embed=embed, delete_after=5)
-                try: await message.delete()
-                except Exception: pass
+                await bot.sweeper.send_temporary(message.channel, 5, embed=embed)
+                bot.sweeper.add(message)
                 return
 
             # Connect/Move bot
             channel = message.author.voice.channel
             if message.guild.voice_client is None:
-                await channel.connect()
+                manager.attach_voice_client(await channel.connect())
                 bot_state.add_log("INFO", f"Connected to voice channel in {message.guild.name}")
             elif message.guild.voice_client.channel != channel:
                 await message.guild.voice_client.move_to(channel)
+                manager.attach_voice_client(message.guild.voice_client)
 
             await manager.handle_music_request(message, content)
             
-            try: await message.delete()
-            except Exception: pass
+            bot.sweeper.add(message)
             return
 
         await bot.process_commands(message) # For prefix commands like !ping
@@ -377,55 +614,31 @@ async def on_error(event_method, *args, **kwargs):
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     guild_id = member.guild.id
-    manager = bot.get_manager(guild_id)
     
     # Check if the bot itself is the one whose voice state changed
     if member.id == bot.user.id:
         # Delegate the handling to the manager
+        manager = bot.get_manager(guild_id)
         await manager.handle_voice_state_update(member, before, after)
         return
     
-    # อัพเดท permissions ของห้องแชทเมื่อมีคนเข้า/ออกห้องเสียง
-    if manager.music_channel_id:
-        music_channel = member.guild.get_channel(manager.music_channel_id)
-        vc = manager.voice_client
-        
-        if music_channel and vc and vc.channel:
-            # คนเข้าห้องเสียงที่บอทอยู่
-            if after.channel and after.channel.id == vc.channel.id and not member.bot:
-                try:
-                    await music_channel.set_permissions(
-                        member,
-                        read_messages=True,
-                        send_messages=True,
-                        mention_everyone=False
-                    )
-                    logger.info(f"Added {member.name} to music channel permissions")
-                except Exception as e:
-                    logger.error(f"Failed to add permissions for {member.name}: {e}")
-            
-            # คนออกจากห้องเสียงที่บอทอยู่
-            elif before.channel and before.channel.id == vc.channel.id and not member.bot:
-                # ไม่ลบ permission ออก เพื่อให้ยังเห็นประวัติแชทได้
-                # แต่ถ้าต้องการลบ uncomment บรรทัดด้านล่าง
-                # try:
-                #     await music_channel.set_permissions(member, overwrite=None)
-                #     logger.info(f"Removed {member.name} from music channel permissions")
-                # except Exception as e:
-                #     logger.error(f"Failed to remove permissions for {member.name}: {e}")
-                pass
+    # Other members only matter where the bot is active; don't create managers for them
+    manager = bot.managers.get(guild_id)
+    if not manager:
+        return
+    joined = manager.handle_member_voice_update(member, before, after)
+    
+    # อัพเดท permissions ของห้องแชทเมื่อมีคนเข้าห้องเสียง (รวมหลายคนเป็นการแก้ไขครั้งเดียว)
+    # ไม่ลบ permission เมื่อออก เพื่อให้ยังเห็นประวัติแชทได้
+    if joined and manager.music_channel_id:
+        bot.permission_sync.schedule(guild_id)
 
 @bot.event
 async def on_disconnect():
     bot_state.is_online = False
     logger.warning("Bot is OFFLINE (disconnected)")
     bot_state.add_log("ERROR", "Bot disconnected")
-    try:
-        if ADMIN_USER_ID:
-            user = await bot.fetch_user(ADMIN_USER_ID)
-            await user.send("[BOT STATUS] ❌ Bot is OFFLINE (disconnected)")
-    except Exception as e:
-        logger.error(f"Failed to notify admin on_disconnect: {e}")
+    send_admin_dm(bot, "[BOT STATUS] ❌ Bot is OFFLINE (disconnected)")
 
 @bot.event
 async def on_resumed():
@@ -433,12 +646,7 @@ async def on_resumed():
     bot_state.is_online = True
     logger.info("Bot reconnected and resumed session")
     bot_state.add_log("INFO", "Bot reconnected successfully")
-    try:
-        if ADMIN_USER_ID:
-            user = await bot.fetch_user(ADMIN_USER_ID)
-            await user.send("[BOT STATUS] ✅ Bot reconnected")
-    except Exception as e:
-        logger.error(f"Failed to notify admin on_resumed: {e}")
+    send_admin_dm(bot, "[BOT STATUS] ✅ Bot reconnected")
 
 # --- 6. Main Execution with Auto-Reconnect ---
 
@@ -471,6 +679,8 @@ def validate_environment():
 
 async def run_bot_with_retry():
     """Run bot with automatic reconnection on failure"""
+    dashboard_task = start_dashboard_server()
+    
     # Validate environment first
     if not validate_environment():
         return
@@ -491,18 +701,25 @@ async def run_bot_with_retry():
         bot_state.add_log("ERROR", f"Bot crashed: {e}")
         await notify_admin(bot, f"Bot crashed: {e}")
     finally:
-        if bot.db:
+        bot.shutting_down = True
+        # shutdown() may already have flushed and closed the database
+        if bot.db and bot.db.conn:
+            bot.sessions.flush()
             bot.db.close()
         await bot.close()
+        if dashboard_task:
+            bot_state.dashboard.should_exit = True
+            await dashboard_task
 
 async def shutdown():
     """Graceful shutdown handler"""
     logger.info("Shutting down gracefully...")
     bot_state.add_log("INFO", "Shutting down...")
     
-    # Close database
-    if bot.db:
-        bot.db.close()
+    # Save queues/positions before voice disconnects clear them
+    bot.shutting_down = True
+    bot.sessions.capture_positions()
+    bot.sessions.flush()
     
     # Disconnect from all voice channels
     for guild_id, manager in bot.managers.items():
@@ -512,6 +729,18 @@ async def shutdown():
         except Exception as e:
             logger.error(f"Error disconnecting from guild {guild_id}: {e}")
     
+    # Stop spawned audio nodes
+    await bot.audio_nodes.close()
+    loop_monitor.stop()
+    
+    # Close database
+    if bot.db:
+        bot.db.close()
+    
+    # Stop the dashboard
+    if bot_state.dashboard:
+        bot_state.dashboard.should_exit = True
+    
     # Close bot connection
     await bot.close()
     
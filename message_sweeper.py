@@ -0,0 +1,120 @@
+"""
+Music room message sweeper
+Collects messages that should disappear and removes them with bulk deletes instead of one call each
+"""
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import discord
+
+from rest_scheduler import RestScheduler, Priority
+
+logger = logging.getLogger('discord_bot')
+
+# Seconds between flushes of collected messages
+BULK_DELETE_INTERVAL = float(os.getenv("BULK_DELETE_INTERVAL", "3"))
+# Discord limits: at most 100 messages per call, none older than 14 days
+BULK_DELETE_MAX = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+
+
+class MessageSweeper:
+    """Batches message deletions per channel and flushes them periodically as cosmetic REST work."""
+    def __init__(self, rest: RestScheduler, interval: float = BULK_DELETE_INTERVAL):
+        self.rest = rest
+        self.interval = interval
+        self._pending: Dict[int, Dict[int, discord.Message]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Counters for the dashboard
+        self.messages_deleted = 0
+        self.bulk_calls = 0
+        self.single_calls = 0
+
+    def add(self, message: discord.Message, delay: float = 0.0):
+        """Queues a message for deletion, optionally after `delay` seconds."""
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.add, message)
+            return
+        self._pending.setdefault(message.channel.id, {})[message.id] = message
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def send_temporary(self, channel: discord.abc.Messageable, delay: float, **kwargs) -> Optional[discord.Message]:
+        """Replacement for `delete_after=`: sends normally, then sweeps the message after `delay` seconds."""
+        message = await self.rest.submit(Priority.NORMAL, f"channel:{channel.id}", lambda: channel.send(**kwargs))
+        if message is not None:
+            self.add(message, delay)
+        return message
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Hands everything collected so far to the REST scheduler."""
+        pending, self._pending = self._pending, {}
+        for messages in pending.values():
+            if messages:
+                self._flush_channel(list(messages.values()))
+
+    def _flush_channel(self, messages: List[discord.Message]):
+        channel = messages[0].channel
+        cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+        fresh = [m for m in messages if m.created_at > cutoff]
+        singles = [m for m in messages if m.created_at <= cutoff]
+
+        for i in range(0, len(fresh), BULK_DELETE_MAX):
+            chunk = fresh[i:i + BULK_DELETE_MAX]
+            if len(chunk) == 1:
+                # Bulk delete needs at least two messages
+                singles.extend(chunk)
+                continue
+            self.rest.submit_nowait(
+                Priority.COSMETIC, f"channel:{channel.id}",
+                lambda chunk=chunk: self._bulk_delete(channel, chunk)
+            )
+
+        for message in singles:
+            self._submit_single(message)
+
+    def _submit_single(self, message: discord.Message):
+        self.rest.submit_nowait(
+            Priority.COSMETIC, f"channel:{message.channel.id}",
+            lambda: self._single_delete(message)
+        )
+
+    async def _bulk_delete(self, channel, chunk: List[discord.Message]):
+        try:
+            self.bulk_calls += 1
+            await channel.delete_messages(chunk)
+            self.messages_deleted += len(chunk)
+        except discord.NotFound:
+            # Channel is gone (room closed), nothing left to delete
+            pass
+        except discord.HTTPException as e:
+            logger.warning(f"Bulk delete failed in channel {channel.id}, falling back to single deletes: {e}")
+            # Each fallback delete is its own cosmetic job, charged to the channel's budget and sheddable
+            for message in chunk:
+                self._submit_single(message)
+
+    async def _single_delete(self, message: discord.Message):
+        try:
+            self.single_calls += 1
+            await message.delete()
+            self.messages_deleted += 1
+        except discord.NotFound:
+            pass
+
+    def get_stats(self) -> dict:
+        calls = self.bulk_calls + self.single_calls
+        return {
+            'messages_deleted': self.messages_deleted,
+            'bulk_calls': self.bulk_calls,
+            'single_calls': self.single_calls,
+            'calls_saved': max(0, self.messages_deleted - calls),
+            'pending': sum(len(m) for m in self._pending.values()),
+        }
@@ -0,0 +1,244 @@
+"""
+Lightweight timing registry for the dashboard
+Keeps a rolling window of samples per named timing and reports percentiles.
+The Prometheus registry below adds fixed-bucket histograms and scrape-time gauges for /metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class LatencyStats:
+    """Rolling window of latency samples (seconds) with percentile snapshots."""
+    def __init__(self, size: int = 512):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self) -> dict:
+        if not self.samples:
+            return {'count': self.count, 'avg_ms': 0, 'p50_ms': 0, 'p95_ms': 0, 'max_ms': 0}
+        ordered = sorted(self.samples)
+        n = len(ordered)
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 2),
+            'p50_ms': round(ordered[n // 2] * 1000, 2),
+            'p95_ms': round(ordered[min(n - 1, int(n * 0.95))] * 1000, 2),
+            'max_ms': round(ordered[-1] * 1000, 2),
+        }
+
+
+class TimingRegistry:
+    """Named LatencyStats, created on first use."""
+    def __init__(self):
+        self.timings: Dict[str, LatencyStats] = {}
+
+    def get(self, name: str) -> LatencyStats:
+        stats = self.timings.get(name)
+        if stats is None:
+            stats = self.timings[name] = LatencyStats()
+        return stats
+
+    def observe(self, name: str, seconds: float):
+        self.get(name).observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Context manager that records the elapsed time of its block under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        return {name: stats.snapshot() for name, stats in sorted(self.timings.items())}
+
+
+# Shared registry used across the bot
+timings = TimingRegistry()
+
+
+# --- Prometheus exposition ---
+
+# Latency buckets in seconds: voice/REST work sits in the low buckets, yt-dlp extraction in the high ones
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is a bisect and a few increments under an uncontended lock,
+    cheap enough for the voice threads; buckets are made cumulative only when scraped.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Gauge (or counter) read from a callback at scrape time, so nothing is tracked between scrapes."""
+    def __init__(self, name: str, documentation: str, read: Callable[[], float], kind: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            lines.append(f"{self.name} {_format_value(self.read())}")
+        except Exception:
+            pass  # Source not available yet (e.g. before login)
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms and gauges under one name prefix, rendered in the Prometheus text format."""
+    def __init__(self, prefix: str = 'sakudoko'):
+        self.prefix = prefix
+        self.metrics: Dict[str, object] = {}
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        name = f"{self.prefix}_{name}"
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, documentation, labelnames, buckets)
+        return self.metrics[name]
+
+    def gauge(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        name = f"{self.prefix}_{name}"
+        self.metrics[name] = Gauge(name, documentation, read)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, read: Callable[[], float]) -> Gauge:
+        """A monotonically increasing value the owner already counts, read at scrape time."""
+        name = f"{self.prefix}_{name}"
+        self.metrics[name] = Gauge(name, documentation, read, kind='counter')
+        return self.metrics[name]
+
+    def render(self, timing_registry: Optional[TimingRegistry] = None) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        if timing_registry is not None:
+            lines.extend(self._render_timings(timing_registry))
+        return '\n'.join(lines) + '\n'
+
+    def _render_timings(self, timing_registry: TimingRegistry) -> List[str]:
+        """The dashboard timings as one summary (quantiles over each rolling window)."""
+        name = f"{self.prefix}_timing_seconds"
+        lines = [f"# HELP {name} Dashboard timings (rolling window quantiles)", f"# TYPE {name} summary"]
+        for timing, stats in sorted(timing_registry.timings.items()):
+            ordered = sorted(stats.samples)
+            for quantile in (0.5, 0.95):
+                if ordered:
+                    value = ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]
+                    lines.append(f'{name}{{name="{_escape(timing)}",quantile="{quantile}"}} {_format_value(value)}')
+            lines.append(f'{name}_sum{{name="{_escape(timing)}"}} {_format_value(stats.total)}')
+            lines.append(f'{name}_count{{name="{_escape(timing)}"}} {stats.count}')
+        return lines
+
+
+def merge_expositions(texts: Dict[str, str], label: str) -> str:
+    """Merges the /metrics output of several processes, labelling each sample with `label`=key.
+    Samples stay grouped under one HELP/TYPE header per metric, as the text format requires."""
+    families: Dict[str, List[str]] = {}
+    for value, text in texts.items():
+        extra = f'{label}="{_escape(value)}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith(('# HELP ', '# TYPE ')):
+                family = line.split()[2]
+                lines = families.setdefault(family, [])
+                if line not in lines[:2]:
+                    lines.append(line)
+                continue
+            if not line or line.startswith('#') or family is None:
+                continue
+            metric, _, sample = line.partition(' ')
+            metric = f"{metric[:-1]},{extra}}}" if metric.endswith('}') else f"{metric}{{{extra}}}"
+            families[family].append(f"{metric} {sample}")
+    return '\n'.join(line for lines in families.values() for line in lines) + '\n'
+
+
+# Shared Prometheus registry (see /metrics)
+registry = MetricsRegistry()
+
+EXTRACTION_SECONDS = registry.histogram(
+    'extraction_seconds', 'Time to turn a queued track into a playable source, by source tier', ['tier'])
+FIRST_AUDIO_SECONDS = registry.histogram(
+    'time_to_first_audio_seconds', 'From starting a queued track to its first audio frame, by source tier', ['tier'])
+FFMPEG_SPAWN_SECONDS = registry.histogram(
+    'ffmpeg_spawn_seconds', 'Time to start an FFmpeg process, by use', ['kind'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+NOW_PLAYING_SECONDS = registry.histogram(
+    'now_playing_update_seconds', 'Latency of Now Playing message edits and sends (including REST queueing)', ['op'])
+INTERACTION_FOLLOWUP_SECONDS = registry.histogram(
+    'interaction_followup_seconds', 'From deferring a slash command to finishing it (its followup), by command',
+    ['command'])
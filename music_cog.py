@@ -3,10 +3,30 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from typing import Literal, Optional, List
+import asyncio
 import logging
+import time
+from metrics import timings
+from music_rooms import music_room_name
+from now_playing import format_duration, parse_duration
+from filters import parse_filter, FilterError, PRESETS
+from permissions import build_room_overwrites
+from rest_scheduler import Priority
 
 logger = logging.getLogger('discord_bot')
 
+
+async def defer(interaction: discord.Interaction):
+    """Defers an ephemeral response (unless already answered) and notes when, for the defer-to-followup histogram."""
+    if not interaction.response.is_done():
+        await interaction.response.defer(ephemeral=True)
+        interaction.extras['deferred_at'] = time.perf_counter()
+
+async def followup(interaction: discord.Interaction, *args, **kwargs):
+    """Sends an interaction followup through the REST scheduler as a critical call (a user is waiting on it)."""
+    return await interaction.client.rest.submit(Priority.CRITICAL, f"interaction:{interaction.id}",
+                                                lambda: interaction.followup.send(*args, **kwargs))
+
 class MusicCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -41,10 +61,11 @@ class MusicCog(commands.Cog):
 
     @app_commands.command(name="join", description="ให้บอทเข้าห้องเสียงและสร้างห้องแชทส่วนตัวสำหรับผู้ใช้")
     async def join(self, interaction):
+        started = time.perf_counter()
         # Defer IMMEDIATELY before any checks to prevent timeout
         try:
-            if not interaction.response.is_done():
-                await interaction.response.defer(ephemeral=True)
+            with timings.timer("join.defer"):
+                await defer(interaction)
         except discord.errors.NotFound:
             logger.warning("Interaction expired before deferring")
             return
@@ -56,143 +77,157 @@ class MusicCog(commands.Cog):
         
         # Check voice channel
         if not interaction.user.voice or not interaction.user.voice.channel:
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงก่อน!", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงก่อน!", ephemeral=True)
             return
         
+        # Check if the user is already the owner of a room
+        if manager.owner_id and manager.owner_id != interaction.user.id:
+            # If the room exists and is owned by someone else, only admin can take over
+            if not interaction.user.guild_permissions.administrator:
+                await followup(interaction, f"❌ ห้องเพลงถูกสร้างโดย <@{manager.owner_id}> แล้ว", ephemeral=True)
+                return
+            # Admin takeover logic:
+            manager.owner_id = interaction.user.id
+            
+        # If no owner, set the current user as owner
+        if not manager.owner_id:
+            manager.owner_id = interaction.user.id
+
         try:
-            # Connect to voice channel
             channel = interaction.user.voice.channel
-            if interaction.guild.voice_client is None:
-                vc = await channel.connect()
-                # เปิดไมค์ แต่ปิดหูฟังแบบ server เพื่อประหยัด bandwidth
-                await interaction.guild.me.edit(mute=False, deafen=True)
-            elif interaction.guild.voice_client.channel != channel:
-                await interaction.guild.voice_client.move_to(channel)
-                # เปิดไมค์ แต่ปิดหูฟังแบบ server
-                await interaction.guild.me.edit(mute=False, deafen=True)
-
-            # Create/Get Music Room
-            chat_name = f"{interaction.user.name.lower().replace(' ', '-')}-music-room"
-            existing = discord.utils.get(interaction.guild.text_channels, name=chat_name)
-            category = channel.category if channel and channel.category else None
-            
-            # Check if the user is already the owner of a room
-            if manager.owner_id and manager.owner_id != interaction.user.id:
-                # If the room exists and is owned by someone else, only admin can take over
-                if not interaction.user.guild_permissions.administrator:
-                    await interaction.followup.send(f"❌ ห้องเพลงถูกสร้างโดย <@{manager.owner_id}> แล้ว", ephemeral=True)
-                    return
-                # Admin takeover logic:
-                manager.owner_id = interaction.user.id
-                
-            # If no owner, set the current user as owner
-            if not manager.owner_id:
-                manager.owner_id = interaction.user.id
-
-            embed = discord.Embed(title="🎶 Music Room Created", color=0x1DB954)
-            embed.add_field(name="เจ้าของห้อง", value=interaction.user.mention, inline=True)
-            embed.add_field(name="Welcome!", value=f"คุณถูกย้ายเข้าห้องเสียงและสร้างห้องแชทส่วนตัวแล้ว\nสามารถขอเพลงหรือควบคุมเพลงได้ทันที!", inline=False)
-            embed.set_thumbnail(url="https://cdn-icons-png.flaticon.com/512/727/727245.png")
-            embed.set_footer(text="Sakudoko Music Bot", icon_url="https://cdn-icons-png.flaticon.com/512/727/727245.png")
-            
-            from views import RequestFirstSongView # Import here to avoid circular dependency
-            view = RequestFirstSongView()
-            
-            if not existing:
-                # Create a new channel - ให้ทุกคนในห้องเสียงเห็นและใช้งานได้
-                voice_channel = interaction.user.voice.channel
-                overwrites = {
-                    interaction.guild.default_role: discord.PermissionOverwrite(
-                        read_messages=False,  # คนนอกห้องเสียงไม่เห็น
-                        send_messages=False,
-                        mention_everyone=False
-                    ),
-                    interaction.guild.me: discord.PermissionOverwrite(
-                        read_messages=True,
-                        send_messages=True,
-                        mention_everyone=False
-                    )
-                }
-                
-                # เพิ่ม permission สำหรับทุกคนที่อยู่ในห้องเสียง
-                for member in voice_channel.members:
-                    if not member.bot:  # ไม่รวม bot อื่น
-                        overwrites[member] = discord.PermissionOverwrite(
-                            read_messages=True,
-                            send_messages=True,
-                            mention_everyone=False
-                        )
-                
-                music_channel = await interaction.guild.create_text_channel(
-                    chat_name, 
-                    overwrites=overwrites, 
-                    category=category
-                )
-                manager.music_channel_id = music_channel.id
-                
-                # ปิดเสียงแจ้งเตือนของห้อง (suppress @everyone and @here)
-                try:
-                    await music_channel.edit(
-                        default_auto_archive_duration=60,
-                        # Set to only mentions (no all messages notifications)
+            # Voice connect and room setup don't depend on each other, run them together
+            results = await asyncio.gather(
+                self._connect_voice(interaction, channel),
+                self._prepare_room(interaction, manager, channel),
+                return_exceptions=True
+            )
+            if isinstance(results[0], BaseException):
+                if not isinstance(results[1], BaseException) and results[1][1]:
+                    await self._discard_new_room(manager, results[1][0])
+                raise results[0]
+            if isinstance(results[1], BaseException):
+                raise results[1]
+            music_channel, created, updated_count = results[1]
+
+            with timings.timer("join.respond"):
+                if created:
+                    await followup(interaction, f"✅ สร้างห้องแชท {music_channel.mention} แล้ว!", ephemeral=True)
+                else:
+                    await followup(
+                        interaction,
+                        f"✅ เข้าห้องแชท {music_channel.mention} แล้ว! อัพเดท permissions สำหรับ {updated_count} คน",
+                        ephemeral=True
                     )
-                except Exception as e:
-                    logger.warning(f"Could not edit channel notification settings: {e}")
-                
-                # ส่งข้อความแรกแบบ silent (suppress notifications)
-                await music_channel.send(embed=embed, view=view, silent=True)
-                await interaction.followup.send(f"✅ สร้างห้องแชท {music_channel.mention} แล้ว!", ephemeral=True)
-                
-                # Start cleanup task (moved to manager in main.py)
+            timings.observe("join.total", time.perf_counter() - started)
+
+            # Room decoration happens after the user already has an answer
+            if created:
                 manager.start_cleanup_task(interaction.guild)
-                
-            else:
-                # Use existing channel - อัพเดท permissions ให้ทุกคนในห้องเสียง
-                music_channel = existing
-                manager.music_channel_id = music_channel.id
-                
-                # อัพเดท permissions สำหรับทุกคนที่อยู่ในห้องเสียง
-                voice_channel = interaction.user.voice.channel
-                updated_count = 0
-                for member in voice_channel.members:
-                    if not member.bot:
-                        try:
-                            await music_channel.set_permissions(
-                                member,
-                                read_messages=True,
-                                send_messages=True,
-                                mention_everyone=False
-                            )
-                            updated_count += 1
-                        except Exception as e:
-                            logger.error(f"Failed to update permissions for {member.name}: {e}")
-                
-                await interaction.followup.send(
-                    f"✅ เข้าห้องแชท {music_channel.mention} แล้ว! อัพเดท permissions สำหรับ {updated_count} คน",
-                    ephemeral=True
-                )
-                
+                asyncio.create_task(self._finish_new_room(interaction, music_channel))
+            elif not manager.now_playing_msg:
                 # Send the control view to the music channel if it doesn't exist
-                if not manager.now_playing_msg:
-                    await music_channel.send(embed=embed, view=view)
+                from views import RequestFirstSongView # Import here to avoid circular dependency
+                await music_channel.send(embed=self._welcome_embed(interaction), view=RequestFirstSongView())
                     
         except Exception as e:
             logger.error(f"Error in join command: {e}")
-            await interaction.followup.send(f"❌ เกิดข้อผิดพลาด: {str(e)}", ephemeral=True)
+            await followup(interaction, f"❌ เกิดข้อผิดพลาด: {str(e)}", ephemeral=True)
+
+    async def _connect_voice(self, interaction, channel):
+        """Connects or moves the bot to the user's voice channel, then self-deafens."""
+        vc = interaction.guild.voice_client
+        if vc is not None and vc.channel == channel:
+            return
+        with timings.timer("join.voice_connect"):
+            if vc is None:
+                vc = await channel.connect()
+            else:
+                await vc.move_to(channel)
+        self.bot.get_manager(interaction.guild_id).attach_voice_client(vc)
+        # เปิดไมค์ แต่ปิดหูฟังแบบ server เพื่อประหยัด bandwidth
+        with timings.timer("join.deafen"):
+            await interaction.guild.me.edit(mute=False, deafen=True)
+
+    async def _prepare_room(self, interaction, manager, voice_channel):
+        """Finds or creates the music room. Returns (channel, created, permissions_updated)."""
+        chat_name = music_room_name(interaction.user)
+        with timings.timer("join.room_lookup"):
+            existing = self.bot.music_rooms.get(interaction.guild, chat_name)
+
+        if existing:
+            # Use existing channel - อัพเดท permissions ให้ทุกคนในห้องเสียง (แก้ไขครั้งเดียว)
+            manager.music_channel_id = existing.id
+            try:
+                with timings.timer("join.permissions"):
+                    updated_count = await self.bot.permission_sync.reconcile(existing, voice_channel)
+            except Exception as e:
+                updated_count = 0
+                logger.error(f"Failed to update music channel permissions: {e}")
+            return existing, False, updated_count
+
+        # Create a new channel - ให้ทุกคนในห้องเสียงเห็นและใช้งานได้
+        overwrites = build_room_overwrites(interaction.guild, voice_channel)
+        with timings.timer("join.room_create"):
+            music_channel = await interaction.guild.create_text_channel(
+                chat_name, 
+                overwrites=overwrites, 
+                category=voice_channel.category
+            )
+        self.bot.music_rooms.add(music_channel)
+        manager.music_channel_id = music_channel.id
+        return music_channel, True, 0
+
+    async def _discard_new_room(self, manager, music_channel):
+        """Deletes a room created for a /join whose voice connect failed, so it isn't left orphaned."""
+        self.bot.music_rooms.discard(music_channel)
+        if manager.music_channel_id == music_channel.id:
+            manager.music_channel_id = None
+        try:
+            await music_channel.delete(reason="Voice connect failed")
+        except Exception as e:
+            logger.warning(f"Could not delete music room after failed voice connect: {e}")
+
+    async def _finish_new_room(self, interaction, music_channel):
+        """Sends the welcome message and adjusts channel settings concurrently."""
+        from views import RequestFirstSongView # Import here to avoid circular dependency
+
+        async def configure():
+            # ปิดเสียงแจ้งเตือนของห้อง (suppress @everyone and @here)
+            try:
+                await music_channel.edit(default_auto_archive_duration=60)
+            except Exception as e:
+                logger.warning(f"Could not edit channel notification settings: {e}")
+
+        async def welcome():
+            # ส่งข้อความแรกแบบ silent (suppress notifications)
+            with timings.timer("join.welcome"):
+                await music_channel.send(embed=self._welcome_embed(interaction), view=RequestFirstSongView(), silent=True)
+
+        results = await asyncio.gather(configure(), welcome(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to finish music room setup: {result}")
+
+    def _welcome_embed(self, interaction) -> discord.Embed:
+        embed = discord.Embed(title="🎶 Music Room Created", color=0x1DB954)
+        embed.add_field(name="เจ้าของห้อง", value=interaction.user.mention, inline=True)
+        embed.add_field(name="Welcome!", value=f"คุณถูกย้ายเข้าห้องเสียงและสร้างห้องแชทส่วนตัวแล้ว\nสามารถขอเพลงหรือควบคุมเพลงได้ทันที!", inline=False)
+        embed.set_thumbnail(url="https://cdn-icons-png.flaticon.com/512/727/727245.png")
+        embed.set_footer(text="Sakudoko Music Bot", icon_url="https://cdn-icons-png.flaticon.com/512/727/727245.png")
+        return embed
 
 
     @app_commands.command(name="leave", description="ให้บอทออกจากห้องเสียงและลบห้องแชทเพลง")
     async def leave(self, interaction):
         # Defer immediately
         try:
-            if not interaction.response.is_done():
-                await interaction.response.defer(ephemeral=True)
+            await defer(interaction)
         except Exception as e:
             logger.error(f"Error deferring interaction: {e}")
             return
         
         if not self.is_in_voice_with_bot(interaction):
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
             return
         manager = self.bot.get_manager(interaction.guild_id)
         
@@ -202,7 +237,7 @@ class MusicCog(commands.Cog):
         if interaction.guild_id in self.bot.managers:
             del self.bot.managers[interaction.guild_id]
             
-        await interaction.followup.send("🚪 บอทออกจากห้องและลบห้องแชทเพลงเรียบร้อยแล้ว!", ephemeral=True)
+        await followup(interaction, "🚪 บอทออกจากห้องและลบห้องแชทเพลงเรียบร้อยแล้ว!", ephemeral=True)
 
     @app_commands.command(name="queue", description="แสดงคิวเพลงปัจจุบัน")
     async def queue(self, interaction):
@@ -251,27 +286,127 @@ class MusicCog(commands.Cog):
             return
         manager = self.bot.get_manager(interaction.guild_id)
         manager.auto_play = not manager.auto_play
+        manager.persist_settings()
         status = "เปิด" if manager.auto_play else "ปิด"
         await interaction.response.send_message(f"🤖 Auto Play: **{status}**", ephemeral=True)
 
-    @app_commands.command(name="filter", description="ตั้งค่า filter/effect ให้กับเพลง")
-    @app_commands.describe(filter_name="ชื่อ filter (เช่น bass, nightcore, pitch) หรือ 'none' เพื่อปิด")
-    async def filter(self, interaction: "discord.Interaction", filter_name: Literal['none', 'bass', 'nightcore', 'pitch']):
+    @app_commands.command(name="filter", description="ตั้งค่า filter/effect ให้กับเพลง (รวมหลาย effect ได้)")
+    @app_commands.describe(
+        effects="เช่น nightcore, bass=6 speed=1.1, eq=1000:-3 reverb หรือ 'none' เพื่อปิด",
+        set_default="บันทึกเป็น filter เริ่มต้นของเซิร์ฟเวอร์ (เฉพาะแอดมิน)"
+    )
+    async def filter(self, interaction: "discord.Interaction", effects: str, set_default: bool = False):
         if not self.is_in_voice_with_bot(interaction):
             await interaction.response.send_message("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
             return
+        try:
+            spec = parse_filter(effects)
+        except FilterError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
+        if set_default and not self.bot.is_admin(interaction.user):
+            await interaction.response.send_message("❌ เฉพาะแอดมินเท่านั้นที่ตั้งค่า filter เริ่มต้นได้", ephemeral=True)
+            return
         manager = self.bot.get_manager(interaction.guild_id)
-        
-        if filter_name == 'none':
-            manager.selected_filter = None
-            await interaction.response.send_message("✅ ปิด filter/effect แล้ว", ephemeral=True)
+        manager.selected_filter = spec
+        manager.persist_settings()
+        if set_default:
+            self.bot.db.update_guild_settings(interaction.guild_id, default_filter=spec or 'none')
+        await defer(interaction)
+        
+        # Apply to the current song right away by restarting FFmpeg at the current position
+        applied = await manager.restart_current(filter_name=spec) is not None
+        default_note = " (บันทึกเป็นค่าเริ่มต้นแล้ว)" if set_default else ""
+        if spec is None:
+            await followup(interaction, f"✅ ปิด filter/effect แล้ว{default_note}", ephemeral=True)
+        elif applied:
+            await followup(interaction, f"✅ ตั้งค่า filter เป็น `{spec}` แล้ว{default_note}", ephemeral=True)
         else:
-            manager.selected_filter = filter_name
-            await interaction.response.send_message(f"✅ ตั้งค่า filter เป็น **{filter_name}** แล้ว เพลงถัดไปจะใช้ filter นี้", ephemeral=True)
+            await followup(interaction, f"✅ ตั้งค่า filter เป็น `{spec}` แล้ว เพลงถัดไปจะใช้ filter นี้{default_note}", ephemeral=True)
+
+    @filter.autocomplete('effects')
+    async def filter_autocomplete(self, interaction: "discord.Interaction", current: str) -> List[app_commands.Choice[str]]:
+        # Complete the last word with a preset or effect name, keeping what was typed before it
+        head, _, last = current.rpartition(' ')
+        prefix = f"{head} " if head else ""
+        names = ['none'] + list(PRESETS) + ['eq=1000:3', 'bass=6', 'speed=1.1', 'pitch=1.1', 'rate=1.1', 'reverb=0.3', 'normalize']
+        return [app_commands.Choice(name=prefix + n, value=prefix + n) for n in names if n.startswith(last.lower())][:25]
+
+    @app_commands.command(name="seek", description="ข้ามไปยังตำแหน่งที่ต้องการในเพลงปัจจุบัน")
+    @app_commands.describe(position="ตำแหน่ง เช่น 90 หรือ 1:30")
+    async def seek(self, interaction: "discord.Interaction", position: str):
+        if not self.is_in_voice_with_bot(interaction):
+            await interaction.response.send_message("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
+            return
+        manager = self.bot.get_manager(interaction.guild_id)
+        song = manager.current_song
+        if not song or manager.elapsed is None:
+            await interaction.response.send_message("❌ ไม่มีเพลงที่กำลังเล่นอยู่", ephemeral=True)
+            return
+        seconds = parse_duration(position)
+        duration = song.get('duration') or 0
+        if seconds is None or (duration and seconds >= duration):
+            await interaction.response.send_message(f"❌ ตำแหน่งไม่ถูกต้อง (ความยาวเพลง {format_duration(duration)})", ephemeral=True)
+            return
+        await defer(interaction)
         
-        # Note: To apply the filter to the current song, the song needs to be reloaded.
-        # This is complex and usually done by skipping to the next song or replaying the current one.
-        # For simplicity, we only apply it to the next song.
+        position = await manager.restart_current(start=seconds, filter_name=manager.selected_filter)
+        if position is None:
+            await followup(interaction, "❌ ไม่สามารถข้ามตำแหน่งในเพลงนี้ได้ (เช่น ไลฟ์สด)", ephemeral=True)
+            return
+        await followup(interaction, f"⏩ ข้ามไปที่ {format_duration(position)}", ephemeral=True)
+
+    station = app_commands.Group(name="station", description="สถานีเพลง 24/7")
+
+    @station.command(name="list", description="แสดงสถานีเพลง 24/7 ที่มี")
+    async def station_list(self, interaction: "discord.Interaction"):
+        stations = self.bot.stations.get_stats()
+        if not stations:
+            await interaction.response.send_message("❌ ยังไม่มีสถานีที่ตั้งค่าไว้", ephemeral=True)
+            return
+        embed = discord.Embed(title="📻 Stations", color=0x7289da)
+        for name, stats in stations.items():
+            status = "🟢 on air" if stats['state'] == 'live' else ("🟡 reconnecting" if stats['state'] == 'reconnecting' else "⚪ idle")
+            embed.add_field(name=f"{stats['title']} (`{name}`)", value=f"{status} • {stats['listeners']} ห้อง", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @station.command(name="start", description="เปิดโหมดสถานี 24/7 ในห้องนี้")
+    @app_commands.describe(name="ชื่อสถานี")
+    async def station_start(self, interaction: "discord.Interaction", name: str):
+        manager = self.bot.get_manager(interaction.guild_id)
+        if not self.is_in_voice_with_bot(interaction) or not manager.voice_client:
+            await interaction.response.send_message("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท! ใช้ `/join` ก่อน", ephemeral=True)
+            return
+        if manager.owner_id != interaction.user.id and not self.bot.is_admin(interaction.user):
+            await interaction.response.send_message("❌ เฉพาะเจ้าของห้องหรือแอดมินเท่านั้น", ephemeral=True)
+            return
+        if name not in self.bot.stations.stations:
+            await interaction.response.send_message(f"❌ ไม่พบสถานี `{name}`", ephemeral=True)
+            return
+        await defer(interaction)
+        await manager.start_station(name, interaction.channel)
+        title = self.bot.stations.stations[name].config.title
+        await followup(interaction, f"📻 เปิดสถานี **{title}** แล้ว ห้องจะเปิดค้างไว้ตราบที่ยังมีคนฟัง", ephemeral=True)
+
+    @station_start.autocomplete('name')
+    async def station_autocomplete(self, interaction: "discord.Interaction", current: str) -> List[app_commands.Choice[str]]:
+        return [app_commands.Choice(name=f"{station.config.title} ({name})", value=name)
+                for name, station in self.bot.stations.stations.items() if current.lower() in name.lower()][:25]
+
+    @station.command(name="stop", description="ปิดโหมดสถานีและกลับไปเล่นคิวเพลงปกติ")
+    async def station_stop(self, interaction: "discord.Interaction"):
+        manager = self.bot.get_manager(interaction.guild_id)
+        if not self.is_in_voice_with_bot(interaction):
+            await interaction.response.send_message("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
+            return
+        if manager.owner_id != interaction.user.id and not self.bot.is_admin(interaction.user):
+            await interaction.response.send_message("❌ เฉพาะเจ้าของห้องหรือแอดมินเท่านั้น", ephemeral=True)
+            return
+        await defer(interaction)
+        if await manager.stop_station(interaction.channel):
+            await followup(interaction, "⏹️ ปิดโหมดสถานีแล้ว", ephemeral=True)
+        else:
+            await followup(interaction, "❌ ห้องนี้ไม่ได้เปิดโหมดสถานีอยู่", ephemeral=True)
 
     @app_commands.command(name="play", description="เล่นเพลงจาก YouTube")
     @app_commands.describe(query="ชื่อเพลงหรือ YouTube URL")
@@ -279,8 +414,7 @@ class MusicCog(commands.Cog):
         """Play a song from YouTube"""
         # Defer immediately to prevent timeout
         try:
-            if not interaction.response.is_done():
-                await interaction.response.defer(ephemeral=True)
+            await defer(interaction)
         except Exception as e:
             logger.error(f"Error deferring interaction: {e}")
             return
@@ -289,28 +423,29 @@ class MusicCog(commands.Cog):
         
         # Check if user is in voice channel
         if not interaction.user.voice or not interaction.user.voice.channel:
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงก่อน! ใช้ `/join` เพื่อเข้าห้องเสียง", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงก่อน! ใช้ `/join` เพื่อเข้าห้องเสียง", ephemeral=True)
             return
         
         # Check if bot is connected
         if not interaction.guild.voice_client:
-            await interaction.followup.send("❌ บอทยังไม่ได้เข้าห้องเสียง! ใช้ `/join` ก่อน", ephemeral=True)
+            await followup(interaction, "❌ บอทยังไม่ได้เข้าห้องเสียง! ใช้ `/join` ก่อน", ephemeral=True)
             return
         
         # Check if user is in the same voice channel as bot
         if not self.is_in_voice_with_bot(interaction):
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
             return
         
         # Check if music room exists
         if not manager.music_channel_id:
-            await interaction.followup.send("❌ ยังไม่มีห้องแชทเพลง! ใช้ `/join` ก่อน", ephemeral=True)
+            await followup(interaction, "❌ ยังไม่มีห้องแชทเพลง! ใช้ `/join` ก่อน", ephemeral=True)
             return
         
         # Check if user is in the music room
         music_channel = interaction.guild.get_channel(manager.music_channel_id)
         if music_channel and interaction.channel_id != manager.music_channel_id:
-            await interaction.followup.send(
+            await followup(
+                interaction,
                 f"❌ คุณต้องใช้คำสั่งนี้ในห้องแชทเพลง {music_channel.mention} เท่านั้น!",
                 ephemeral=True
             )
@@ -323,7 +458,7 @@ class MusicCog(commands.Cog):
             info = await ytdl.extract_info(query, download=False)
             
             if not info:
-                await interaction.followup.send("❌ ไม่พบเพลงหรือวิดีโอจากคำค้นนี้", ephemeral=True)
+                await followup(interaction, "❌ ไม่พบเพลงหรือวิดีโอจากคำค้นนี้", ephemeral=True)
                 return
 
             urls_to_add = []
@@ -335,9 +470,9 @@ class MusicCog(commands.Cog):
                 
                 if urls_to_add:
                     manager.add_to_queue(urls_to_add)
-                    await interaction.followup.send(f"✅ เพิ่ม **{len(urls_to_add)}** เพลงจากเพลย์ลิสต์ลงในคิว", ephemeral=True)
+                    await followup(interaction, f"✅ เพิ่ม **{len(urls_to_add)}** เพลงจากเพลย์ลิสต์ลงในคิว", ephemeral=True)
                 else:
-                    await interaction.followup.send("❌ ไม่พบเพลงในเพลย์ลิสต์นี้", ephemeral=True)
+                    await followup(interaction, "❌ ไม่พบเพลงในเพลย์ลิสต์นี้", ephemeral=True)
                     return
             else:
                 # Handle single track
@@ -345,9 +480,9 @@ class MusicCog(commands.Cog):
                 title = info.get('title', 'Unknown Song')
                 if url:
                     manager.add_to_queue([url])
-                    await interaction.followup.send(f"✅ เพิ่มเพลง **{title}** ในคิวแล้ว!", ephemeral=True)
+                    await followup(interaction, f"✅ เพิ่มเพลง **{title}** ในคิวแล้ว!", ephemeral=True)
                 else:
-                    await interaction.followup.send("❌ ไม่สามารถดึง URL ของเพลงได้", ephemeral=True)
+                    await followup(interaction, "❌ ไม่สามารถดึง URL ของเพลงได้", ephemeral=True)
                     return
 
             # Start playing if not already playing
@@ -359,14 +494,13 @@ class MusicCog(commands.Cog):
                 
         except Exception as e:
             logger.error(f"Error adding song to queue: {e}")
-            await interaction.followup.send(f"❌ เกิดข้อผิดพลาด: {str(e)}", ephemeral=True)
+            await followup(interaction, f"❌ เกิดข้อผิดพลาด: {str(e)}", ephemeral=True)
 
     @app_commands.command(name="sync_permissions", description="อัพเดท permissions ของห้องแชทให้ตรงกับคนในห้องเสียง")
     async def sync_permissions(self, interaction):
         """Sync music channel permissions with voice channel members"""
         try:
-            if not interaction.response.is_done():
-                await interaction.response.defer(ephemeral=True)
+            await defer(interaction)
         except Exception as e:
             logger.error(f"Error deferring interaction: {e}")
             return
@@ -383,7 +517,8 @@ class MusicCog(commands.Cog):
         last_sync = self.sync_cooldowns.get(interaction.guild_id, 0)
         if now - last_sync < 30:
             remaining = int(30 - (now - last_sync))
-            await interaction.followup.send(
+            await followup(
+                interaction,
                 f"⏳ กรุณารอ {remaining} วินาที ก่อนใช้คำสั่งนี้อีกครั้ง",
                 ephemeral=True
             )
@@ -393,63 +528,57 @@ class MusicCog(commands.Cog):
         
         # Check if user is in voice channel
         if not interaction.user.voice or not interaction.user.voice.channel:
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงก่อน!", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงก่อน!", ephemeral=True)
             return
         
         # Check if music channel exists
         if not manager.music_channel_id:
-            await interaction.followup.send("❌ ยังไม่มีห้องแชทเพลง! ใช้ `/join` ก่อน", ephemeral=True)
+            await followup(interaction, "❌ ยังไม่มีห้องแชทเพลง! ใช้ `/join` ก่อน", ephemeral=True)
             return
         
         music_channel = interaction.guild.get_channel(manager.music_channel_id)
         if not music_channel:
-            await interaction.followup.send("❌ ไม่พบห้องแชทเพลง!", ephemeral=True)
+            await followup(interaction, "❌ ไม่พบห้องแชทเพลง!", ephemeral=True)
             return
         
         # Check if bot is in voice channel
         vc = manager.voice_client
         if not vc or not vc.channel:
-            await interaction.followup.send("❌ บอทยังไม่ได้เข้าห้องเสียง!", ephemeral=True)
+            await followup(interaction, "❌ บอทยังไม่ได้เข้าห้องเสียง!", ephemeral=True)
             return
         
         # Check if user is in the same voice channel as bot
         if interaction.user.voice.channel.id != vc.channel.id:
-            await interaction.followup.send("❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", ephemeral=True)
             return
         
-        # Sync permissions for all members in voice channel
+        # Sync permissions for all members in voice channel (one channel edit)
         voice_channel = vc.channel
-        updated_count = 0
+        listeners = manager.presence.listener_count
         failed_count = 0
-        
-        for member in voice_channel.members:
-            if not member.bot:
-                try:
-                    await music_channel.set_permissions(
-                        member,
-                        read_messages=True,
-                        send_messages=True,
-                        mention_everyone=False
-                    )
-                    updated_count += 1
-                except discord.Forbidden:
-                    logger.error(f"No permission to update {member.name}")
-                    failed_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to sync permissions for {member.name}: {e}")
-                    failed_count += 1
+        try:
+            await self.bot.permission_sync.reconcile(music_channel, voice_channel)
+        except discord.Forbidden:
+            logger.error("No permission to update music channel overwrites")
+            failed_count = listeners
+        except Exception as e:
+            logger.error(f"Failed to sync permissions: {e}")
+            failed_count = listeners
+        updated_count = listeners - failed_count
         
         # Update cooldown
         self.sync_cooldowns[interaction.guild_id] = now
         
         if failed_count > 0:
-            await interaction.followup.send(
+            await followup(
+                interaction,
                 f"⚠️ อัพเดท permissions สำเร็จ {updated_count} คน, ล้มเหลว {failed_count} คน\n"
                 f"ทุกคนในห้องเสียงสามารถเห็นและใช้งาน {music_channel.mention} ได้แล้ว",
                 ephemeral=True
             )
         else:
-            await interaction.followup.send(
+            await followup(
+                interaction,
                 f"✅ อัพเดท permissions สำเร็จ! ทุกคนในห้องเสียง ({updated_count} คน) สามารถเห็นและใช้งาน {music_channel.mention} ได้แล้ว",
                 ephemeral=True
             )
@@ -470,7 +599,9 @@ class MusicCog(commands.Cog):
         embed.add_field(name="/shuffle", value="สุ่มลำดับเพลงในคิว", inline=False)
         embed.add_field(name="/loop", value="เปิด/ปิดการเล่นซ้ำคิวเพลง", inline=False)
         embed.add_field(name="/autoplay", value="เปิด/ปิดโหมดเล่นเพลงอัตโนมัติเมื่อคิวหมด", inline=False)
-        embed.add_field(name="/filter [ชื่อ]", value="ตั้งค่า filter/effect (bass, nightcore, pitch)", inline=False)
+        embed.add_field(name="/filter [ชื่อ]", value="ตั้งค่า filter/effect เช่น nightcore, bass=6 speed=1.1, eq=1000:-3 reverb", inline=False)
+        embed.add_field(name="/seek [ตำแหน่ง]", value="ข้ามไปยังตำแหน่งในเพลง เช่น 1:30", inline=False)
+        embed.add_field(name="/station start|stop|list", value="โหมดสถานีเพลง 24/7", inline=False)
         embed.add_field(name="ในห้องแชทเพลง", value="พิมพ์ชื่อเพลงหรือวางลิงก์เพื่อเพิ่มเพลงในคิว", inline=False)
         embed.set_footer(text="ควบคุมเพลงเพิ่มเติมได้จากปุ่มในข้อความ Now Playing")
         
@@ -5,8 +5,12 @@ import time
 import random
 import logging
 from typing import Optional, Dict, Any, List, Set
-from views import MusicControlView
 from player import YTDLSource, YTDL_INSTANCE as ytdl
+from now_playing import NowPlayingRenderer, render_progress_bar
+from voice_presence import VoicePresence
+from metrics import timings
+from filters import parse_filter, FilterError
+from ffmpeg_supervisor import supervisor, FFMPEG_MAX_RECOVERIES, FFMPEG_EARLY_END_MARGIN
 from discord.ext import tasks
 
 logger = logging.getLogger('discord_bot')
@@ -32,15 +36,40 @@ class MusicManager:
         self.now_playing_msg: Optional[discord.Message] = None
         self.music_channel_id: Optional[int] = None
         self.owner_id: Optional[int] = None # The user who started the room
-        self.selected_filter: Optional[str] = None
+        self.selected_filter: Optional[str] = self.get_default_filter()
         self.last_activity_time: float = time.time()
         self.warning_sent: bool = False  # Flag to prevent duplicate warnings
+        self.current_song: Optional[Dict[str, Any]] = None
+        self.now_playing = NowPlayingRenderer(self)
+        self.presence = VoicePresence()  # Members in the bot's voice channel
+        self._voice_client: Optional[discord.VoiceClient] = None
+        self._resume_offset: float = 0.0  # Start position for the next track (session resume)
+        self._restart_lock = asyncio.Lock()  # Serialises seek/filter restarts
+        self._restart_lead: float = 0.3  # Last measured FFmpeg start-up time, used to line up filter switches
+        self._recovery: tuple = (None, 0)  # (entry, attempts) of stream recoveries for the current track
+        self._recovery_pending = False  # The next play_next restarts the same track after an early end
+        self.station: Optional[str] = None  # Name of the 24/7 station this room is tuned to
         self.cleanup_task = self.cleanup_check.start()
 
     @property
     def voice_client(self) -> Optional[discord.VoiceClient]:
-        """Returns the VoiceClient for the guild."""
-        return discord.utils.get(self.bot.voice_clients, guild__id=self.guild_id)
+        """Returns the VoiceClient for the guild (O(1), no scan over bot.voice_clients)."""
+        vc = self._voice_client
+        if vc is None or not vc.is_connected():
+            # Not attached by our connect path, or dropped without detach (gateway drop, kick, forced move);
+            # both lookups are dict gets
+            guild = self.bot.get_guild(self.guild_id)
+            vc = guild.voice_client if guild else None
+            self._voice_client = vc
+        return vc
+
+    def attach_voice_client(self, vc: Optional[discord.VoiceClient]):
+        """Stores the voice client after connect or move."""
+        self._voice_client = vc
+
+    def detach_voice_client(self):
+        """Forgets the voice client after a disconnect."""
+        self._voice_client = None
 
     def get_text_channel(self) -> Optional[discord.TextChannel]:
         """Returns the music text channel."""
@@ -54,10 +83,11 @@ class MusicManager:
     async def cleanup_check(self):
         """Checks for inactivity and cleans up the room after 5 minutes of no music."""
         vc = self.voice_client
+        idle_since = self.get_idle_since(vc)
         
-        # ตรวจสอบว่าไม่มีเพลงเล่นและคิวว่าง
-        if vc and not vc.is_playing() and not self.queue:
-            time_since_last_activity = time.time() - self.last_activity_time
+        # ตรวจสอบว่าไม่มีเพลงเล่นและคิวว่าง หรือไม่มีใครฟังอยู่ในห้องเสียง
+        if vc and idle_since is not None:
+            time_since_last_activity = time.time() - idle_since
             
             # แจ้งเตือนเมื่อเหลือเวลา 1 นาที (แจ้งครั้งเดียว)
             if time_since_last_activity > TIMEOUT_SECONDS - 60 and not self.warning_sent:
@@ -69,7 +99,7 @@ class MusicManager:
                             description="บอทจะออกจากห้องใน 1 นาที หากไม่มีการเล่นเพลง", 
                             color=0xffcc00
                         )
-                        await channel.send(embed=embed, delete_after=60)
+                        await self.bot.sweeper.send_temporary(channel, 60, embed=embed)
                         self.warning_sent = True
                     except Exception:
                         pass
@@ -88,6 +118,203 @@ class MusicManager:
             # Reset warning flag เมื่อมีเพลงเล่นหรือมีคิว
             self.warning_sent = False
 
+    def get_idle_since(self, vc: Optional[discord.VoiceClient]) -> Optional[float]:
+        """When the room became idle: nothing playing and empty queue, or nobody listening."""
+        if not vc:
+            return None
+        if self.station:
+            # 24/7 stations stay up while anyone is listening
+            return self.presence.empty_since
+        if not vc.is_playing() and not self.queue:
+            return self.last_activity_time
+        return self.presence.empty_since
+
+    def get_default_filter(self) -> Optional[str]:
+        """The guild's default filter spec from guild_settings, if one is set."""
+        db = getattr(self.bot, 'db', None)
+        if not db:
+            return None
+        spec = db.get_guild_settings(self.guild_id).get('default_filter')
+        try:
+            return parse_filter(spec)
+        except FilterError as e:
+            logger.warning(f"Ignoring invalid default filter for guild {self.guild_id}: {e}")
+            return None
+
+    @property
+    def sessions(self):
+        """The bot's SessionStore, if session snapshots are enabled."""
+        return getattr(self.bot, 'sessions', None)
+
+    @property
+    def track_cache(self):
+        return getattr(self.bot, 'track_cache', None)
+
+    @property
+    def opus_cache(self):
+        return getattr(self.bot, 'opus_cache', None)
+
+    @property
+    def broadcast(self):
+        """The shared BroadcastHub, if decode fan-out is enabled."""
+        return getattr(self.bot, 'broadcast', None)
+
+    @property
+    def audio_node(self):
+        """The audio node this guild's tracks are decoded on, or None to decode in this process."""
+        pool = getattr(self.bot, 'audio_nodes', None)
+        return pool.node_for(self.guild_id) if pool and pool.enabled else None
+
+    def persist_settings(self):
+        """Snapshots room settings for crash/redeploy recovery."""
+        if not self.sessions:
+            return
+        vc = self.voice_client
+        self.sessions.update_state(
+            self.guild_id,
+            voice_channel_id=vc.channel.id if vc and vc.channel else None,
+            text_channel_id=self.music_channel_id,
+            owner_id=self.owner_id,
+            loop_queue=int(self.loop_queue),
+            auto_play=int(self.auto_play),
+            selected_filter=self.selected_filter
+        )
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """Position in the current track in seconds, or None if nothing is playing."""
+        vc = self.voice_client
+        source = vc.source if vc else None
+        return source.elapsed if isinstance(source, YTDLSource) else None
+
+    def get_buffer_stats(self) -> Optional[dict]:
+        """Read-ahead fill level and underruns of the current source, if it is buffered."""
+        vc = self.voice_client
+        source = getattr(vc.source, 'original', None) if vc and vc.source else None
+        return source.get_stats() if source is not None and hasattr(source, 'get_stats') else None
+
+    async def restart_current(self, start: Optional[float] = None, filter_name: Optional[str] = None,
+                              data: Optional[dict] = None) -> Optional[float]:
+        """
+        Restarts FFmpeg for the current track at `start` (default: where it is now) with `filter_name`,
+        reusing the already resolved stream URL unless freshly resolved `data` is given. The new source is
+        primed before it replaces the old one, so playback continues until the swap.
+        Returns the new position, or None if nothing could be restarted.
+        """
+        async with self._restart_lock:
+            vc = self.voice_client
+            old = vc.source if vc else None
+            # Live streams cannot seek; they are only restarted (from the live edge) to recover them
+            if not isinstance(old, YTDLSource) or (old.is_live and data is None):
+                return None
+
+            began = time.perf_counter()
+            if old.is_live:
+                start = 0.0
+            elif start is None:
+                # The old source keeps playing while the new one starts; begin where it will be by then
+                start = old.elapsed + self._restart_lead * old.speed
+            entry = self.current_song.get('entry') if self.current_song else None
+            new = (YTDLSource.from_opus_cache(self.opus_cache, entry, old.data, filter_name=filter_name, start=start, volume=old.volume)
+                   or YTDLSource.from_data(data or old.data, filter_name=filter_name, start=start, volume=old.volume,
+                                           # A recovery must not rejoin the shared upstream that failed
+                                           broadcast=self.broadcast if data is None else None,
+                                           node=self.audio_node, replacing=old.original))
+            supervisor.assign(new.original, self.guild_id)
+            primed = await self.bot.loop.run_in_executor(None, new.prime)
+
+            if not primed or vc.source is not old:
+                # Stream URL no longer usable, or the track ended/was skipped meanwhile
+                new.cleanup()
+                return None
+
+            was_paused = vc.is_paused()
+            vc.source = new
+            if was_paused:
+                vc.pause()
+            old.cleanup()
+
+            self._restart_lead = time.perf_counter() - began
+            timings.observe('playback.restart', self._restart_lead)
+            # A shared upstream may start a little before or after the requested position
+            position = new.start_offset
+            if self.sessions:
+                self.sessions.update_state(self.guild_id, position=round(position, 1))
+            logger.info(f"Restarted track at {position:.1f}s (filter={filter_name}) in {self._restart_lead * 1000:.0f}ms for guild {self.guild_id}")
+            return position
+
+    def _take_recovery(self, entry) -> bool:
+        """Counts a recovery attempt for `entry`; False once the per-track limit is reached."""
+        last, attempts = self._recovery
+        attempts = attempts + 1 if last == entry else 1
+        if attempts > FFMPEG_MAX_RECOVERIES:
+            return False
+        self._recovery = (entry, attempts)
+        return True
+
+    async def _resolve_fresh(self, entry: str) -> Optional[dict]:
+        """Drops the cached stream URL of `entry` and extracts a new one."""
+        if self.track_cache:
+            self.track_cache.invalidate_stream(entry)
+        try:
+            data = await ytdl.extract_info(entry, download=False)
+        except Exception as e:
+            logger.error(f"Failed to re-resolve {entry}: {e}")
+            return None
+        if not data or 'url' not in data:
+            return None
+        return self.track_cache.put(entry, data) if self.track_cache else data
+
+    async def recover_stream(self, reason: str) -> bool:
+        """
+        Called by the FFmpeg supervisor when the current stream stalls: re-resolves the URL and
+        restarts the track where it stopped, without interrupting the queue.
+        """
+        vc = self.voice_client
+        old = vc.source if vc else None
+        entry = self.current_song.get('entry') if self.current_song else None
+        if not isinstance(old, YTDLSource) or not isinstance(entry, str) or not self._take_recovery(entry):
+            return False
+        position = old.elapsed
+        logger.warning(f"Recovering stream ({reason}) at {position:.1f}s for guild {self.guild_id}")
+        data = await self._resolve_fresh(entry)
+        restarted = data is not None and await self.restart_current(
+            start=position, filter_name=self.selected_filter, data=data) is not None
+        supervisor.record_recovery(reason, restarted)
+        return restarted
+
+    def _ended_early(self, source) -> bool:
+        """True if FFmpeg hit EOF well before the end of the track (expired URL, dropped connection)."""
+        if not isinstance(source, YTDLSource) or not getattr(source.original, 'ended', False):
+            return False
+        if source.is_live:
+            return True
+        return bool(source.duration) and source.elapsed < source.duration - FFMPEG_EARLY_END_MARGIN
+
+    async def _recover_early_end(self, channel: discord.TextChannel, entry: str, position: float):
+        """Puts the track back at the front of the queue and plays it again from `position` with a fresh URL."""
+        logger.warning(f"Stream ended early at {position:.1f}s for guild {self.guild_id}; restarting with a fresh URL")
+        supervisor.record_recovery('early_end', True)
+        if self.track_cache:
+            self.track_cache.invalidate_stream(entry)
+        if self.loop_queue and self.queue and self.queue[-1] == entry:
+            self.queue.pop()  # play_next re-appends it
+        self.queue.insert(0, entry)
+        if self.sessions:
+            self.sessions.queue_replaced(self.guild_id, self.queue)
+        self._resume_offset = position
+        self._recovery_pending = True
+        await self.play_next(channel)
+
+    def schedule_loudness(self, current: Optional[str] = None):
+        """Queues loudness analysis for the current track (for replays) and the next ones up."""
+        analyzer = getattr(self.bot, 'loudness', None)
+        if not analyzer:
+            return
+        for entry in ([current] if current else []) + self.queue[:2]:
+            if isinstance(entry, str):
+                analyzer.schedule(entry)
+
     def start_cleanup_task(self, guild: discord.Guild):
         """Starts the cleanup task when the room is created."""
         self.last_activity_time = time.time()
@@ -116,9 +343,13 @@ class MusicManager:
         if not vc:
             logger.warning(f"Voice client not found for guild {self.guild_id}. Cannot play next.")
             return
+        if self.station:
+            return  # Queued songs wait until the station is stopped
 
         if not self.queue:
-            if self.auto_play:
+            if self.auto_play and self.presence.is_empty:
+                logger.info(f"Auto Play skipped for guild {self.guild_id}: nobody is listening")
+            elif self.auto_play:
                 logger.info(f"Auto Play triggered for guild {self.guild_id}")
                 default_keywords = ["lofi hip hop", "pop hits", "EDM", "chill music"]
                 keyword = random.choice(default_keywords)
@@ -136,6 +367,8 @@ class MusicManager:
 
                     if urls:
                         self.queue.append(urls[0])
+                        if self.sessions:
+                            self.sessions.queue_appended(self.guild_id, urls[:1])
                         logger.info(f"Auto Play: Added '{urls[0]}' to queue for server {self.guild_id}")
                         await self.play_next(channel)
                         return
@@ -143,18 +376,30 @@ class MusicManager:
                     logger.error(f"Auto Play failed: {e}")
             
             # Queue is truly empty
+            self.current_song = None
+            if self.sessions:
+                self.sessions.update_state(self.guild_id, current_url=None, position=0)
             embed = discord.Embed(title="Queue Empty", description="🎶 คิวเพลงหมดแล้ว! บอทจะออกจากห้องใน 5 นาทีหากไม่มีการเล่นเพลง", color=0xffcc00)
             await channel.send(embed=embed)
             return
 
         next_entry = self.queue.pop(0)
+        if self.sessions:
+            self.sessions.queue_removed(self.guild_id, 0)
         
         if self.loop_queue:
             self.queue.append(next_entry)
+            if self.sessions:
+                self.sessions.queue_appended(self.guild_id, [next_entry])
+
+        start, self._resume_offset = self._resume_offset, 0.0
+        requested_at = time.perf_counter()
 
         try:
-            # Use run_in_executor for blocking ytdl operation
-            player = await YTDLSource.from_url(next_entry, loop=self.bot.loop, stream=True, filter_name=self.selected_filter)
+            # Cached stream URLs skip yt-dlp; otherwise extraction runs in an executor
+            player = await YTDLSource.from_url(next_entry, loop=self.bot.loop, stream=True, filter_name=self.selected_filter,
+                                               start=start, cache=self.track_cache, opus_cache=self.opus_cache,
+                                               broadcast=self.broadcast, node=self.audio_node)
             
             if not player:
                 await channel.send(embed=discord.Embed(title="Error", description="❌ ไม่พบข้อมูลเพลง", color=0xff0000))
@@ -166,8 +411,18 @@ class MusicManager:
                 vc.stop()
             
             player.volume = 0.0 # Start at 0 volume for fade in
+            player.requested_at = requested_at  # Time-to-first-audio is recorded on the first frame read
 
             def after_play(e):
+                if self.station:
+                    return  # A station took over the voice client
+                # The source may have been replaced by a seek/filter restart
+                source = self.voice_client.source if self.voice_client else None
+                if (not e and isinstance(next_entry, str) and self._ended_early(source)
+                        and self._take_recovery(next_entry)):
+                    position = 0.0 if source.is_live else source.elapsed
+                    asyncio.run_coroutine_threadsafe(self._recover_early_end(channel, next_entry, position), self.bot.loop)
+                    return
                 if e:
                     logger.error(f'Player error: {e}')
                     # Attempt to play next song on error
@@ -185,6 +440,10 @@ class MusicManager:
                     logger.info(f"Voice client disconnected for guild {self.guild_id}. Stopping playback.")
 
             vc.play(player, after=after_play)
+            supervisor.assign(player.original, self.guild_id)
+            if not self._recovery_pending:
+                self._recovery = (None, 0)
+            self._recovery_pending = False
             await self.fade_volume(0.0, 0.3, duration=1.0) # Fade in to 30% volume
 
             # Save to history
@@ -192,8 +451,15 @@ class MusicManager:
                 'title': getattr(player, 'title', 'Unknown'),
                 'url': getattr(player, 'webpage_url', next_entry),
                 'duration': getattr(player, 'duration', 0),
-                'thumbnail': getattr(player, 'thumbnail', None)
+                'thumbnail': getattr(player, 'thumbnail', None),
+                'entry': next_entry
             }
+            if self.sessions:
+                self.sessions.update_state(self.guild_id, current_url=next_entry, position=start)
+                self.persist_settings()
+            self.schedule_loudness(next_entry)
+            if self.opus_cache and isinstance(next_entry, str):
+                self.opus_cache.record_play(next_entry, player.data)
             
             # Save to database if available
             if hasattr(self.bot, 'db') and self.bot.db:
@@ -217,24 +483,9 @@ class MusicManager:
                 except Exception as e:
                     logger.error(f"Failed to save song history: {e}")
             
-            # Create Now Playing embed
-            embed = discord.Embed(
-                title="Now Playing",
-                description=f"[{getattr(player, 'title', 'Unknown')}]({getattr(player, 'webpage_url', next_entry)})",
-                color=NOW_PLAYING_COLOR
-            )
-            embed.set_thumbnail(url=EMBED_THUMBNAIL)
-            embed.set_footer(text=EMBED_FOOTER_TEXT, icon_url=EMBED_FOOTER_ICON)
-            
-            # Update Now Playing message with MusicControlView
-            view = MusicControlView(self.bot, logger, channel.guild, channel.id, self.guild_id)
-            try:
-                if self.now_playing_msg:
-                    await self.now_playing_msg.edit(embed=embed, view=view)
-                else:
-                    self.now_playing_msg = await channel.send(embed=embed, view=view)
-            except Exception as e:
-                logger.error(f"Failed to send/edit Now Playing message: {e}")
+            # Update Now Playing message (coalesced and rate limited by the renderer)
+            self.now_playing.request(channel, self.build_now_playing_embed(), view=self.bot.control_view)
+            self.now_playing.start_progress(channel)
 
         except Exception as e:
             logger.error(f"Failed to play next music: {e}")
@@ -243,6 +494,118 @@ class MusicManager:
             if self.queue or self.auto_play:
                 await self.play_next(channel)
 
+    def build_now_playing_embed(self) -> Optional[discord.Embed]:
+        """Builds the Now Playing embed for the current song, including a progress bar."""
+        if not self.current_song:
+            return None
+        embed = discord.Embed(
+            title="Now Playing",
+            description=f"[{self.current_song['title']}]({self.current_song['url']})",
+            color=NOW_PLAYING_COLOR
+        )
+        elapsed = self.elapsed or 0.0
+        embed.add_field(name="Progress", value=render_progress_bar(elapsed, self.current_song['duration']), inline=False)
+        embed.set_thumbnail(url=EMBED_THUMBNAIL)
+        embed.set_footer(text=EMBED_FOOTER_TEXT, icon_url=EMBED_FOOTER_ICON)
+        return embed
+
+    # --- 24/7 stations ---
+    @property
+    def stations(self):
+        return getattr(self.bot, 'stations', None)
+
+    async def start_station(self, name: str, channel: Optional[discord.TextChannel] = None):
+        """Tunes the room to a 24/7 station, replacing queue playback until stop_station()."""
+        vc = self.voice_client
+        if not vc or not self.stations or name not in self.stations.stations:
+            return False
+        previous = self.station
+        self.station = name
+        if previous and previous != name:
+            self.stations.listeners[previous] = max(0, self.stations.listeners.get(previous, 1) - 1)
+        if previous != name:
+            self.stations.listeners[name] = self.stations.listeners.get(name, 0) + 1
+        if vc.is_playing() or vc.is_paused():
+            vc.stop()  # after_play sees self.station and stays quiet
+        self._play_station(vc)
+
+        station = self.stations.stations[name]
+        self.current_song = {'title': station.config.title, 'url': station.config.source, 'duration': None,
+                             'thumbnail': None, 'entry': None}
+        if self.sessions:
+            self.sessions.update_state(self.guild_id, current_url=None, position=0)
+        if self.bot.db:
+            self.bot.db.save_guild_station(self.guild_id, name, vc.channel.id if vc.channel else None, self.music_channel_id)
+        channel = channel or self.get_text_channel()
+        if channel:
+            self.now_playing.request(channel, self.build_now_playing_embed(), view=self.bot.control_view)
+        logger.info(f"Guild {self.guild_id} tuned to station '{name}'")
+        return True
+
+    def _play_station(self, vc: discord.VoiceClient):
+        name = self.station
+        source = discord.PCMVolumeTransformer(self.stations.tune(name), volume=0.3)
+
+        def after_station(e):
+            if e:
+                logger.error(f"Station player error in guild {self.guild_id}: {e}")
+            # Keep the room on air unless the station was stopped or the bot left
+            if self.station == name and self.voice_client:
+                self.bot.loop.call_soon_threadsafe(self.bot.loop.call_later, 1.0, self._resume_station, name)
+
+        vc.play(source, after=after_station)
+
+    def _resume_station(self, name: str):
+        vc = self.voice_client
+        if self.station == name and vc and not vc.is_playing():
+            self._play_station(vc)
+
+    def _leave_station(self):
+        if self.station and self.stations:
+            self.stations.listeners[self.station] = max(0, self.stations.listeners.get(self.station, 1) - 1)
+        if self.station and self.bot.db:
+            self.bot.db.delete_guild_station(self.guild_id)
+        self.station = None
+
+    async def stop_station(self, channel: Optional[discord.TextChannel] = None):
+        """Leaves station mode and returns to the normal queue."""
+        if not self.station:
+            return False
+        self._leave_station()
+        self.current_song = None
+        vc = self.voice_client
+        if vc and (vc.is_playing() or vc.is_paused()):
+            vc.stop()
+        self.last_activity_time = time.time()
+        channel = channel or self.get_text_channel()
+        if self.queue and channel:
+            await self.play_next(channel)
+        return True
+
+    async def restore_session(self, session: Dict[str, Any], channel: discord.TextChannel):
+        """Restores a saved session and resumes the interrupted track at its saved position."""
+        self.music_channel_id = channel.id
+        self.owner_id = session.get('owner_id') or self.owner_id
+        self.loop_queue = session.get('loop_queue', False)
+        self.auto_play = session.get('auto_play', False)
+        self.selected_filter = session.get('selected_filter')
+
+        queue = list(session.get('queue', []))
+        current = session.get('current_url')
+        if current:
+            # With loop on, the current track was already re-queued at the end
+            if self.loop_queue and queue and queue[-1] == current:
+                queue.pop()
+            queue.insert(0, current)
+            self._resume_offset = float(session.get('position') or 0.0)
+
+        self.queue = queue
+        if self.sessions:
+            self.sessions.queue_replaced(self.guild_id, queue)
+        self.persist_settings()
+        self.start_cleanup_task(channel.guild)
+        await self.play_next(channel)
+
     async def skip_to_next(self, channel: discord.TextChannel):
         """Stops current song and calls play_next."""
         vc = self.voice_client
@@ -260,23 +623,30 @@ class MusicManager:
         """Shuffles the current queue."""
         if len(self.queue) > 1:
             random.shuffle(self.queue)
+            if self.sessions:
+                self.sessions.queue_replaced(self.guild_id, self.queue)
             return True
         return False
 
     def toggle_loop(self) -> bool:
         """Toggles the loop state."""
         self.loop_queue = not self.loop_queue
+        self.persist_settings()
         return self.loop_queue
 
     def add_to_queue(self, urls: List[str]):
         """Adds a list of URLs to the queue."""
         self.queue.extend(urls)
+        if self.sessions:
+            self.sessions.queue_appended(self.guild_id, urls)
         self.last_activity_time = time.time()  # Reset timeout เมื่อเพิ่มเพลง
         self.warning_sent = False  # Reset warning flag
 
     def remove_from_queue(self, index: int) -> Optional[str]:
         """Removes a song from the queue by index (1-based)."""
         if 1 <= index <= len(self.queue):
+            if self.sessions:
+                self.sessions.queue_removed(self.guild_id, index - 1)
             return self.queue.pop(index - 1)
         return None
 
@@ -322,15 +692,13 @@ class MusicManager:
 
     def get_required_votes(self) -> int:
         """Calculates the required votes for skip."""
-        vc = self.voice_client
-        if not vc or not vc.channel:
-            return 1
-        # Count non-bot members who are not muted/deafened by server
-        member_count = len([m for m in vc.channel.members if not m.bot and not m.voice.self_mute and not m.voice.self_deaf])
-        return max(1, member_count // 2)
+        # Non-bot members who are not self-muted/deafened, tracked incrementally
+        return max(1, self.presence.eligible_count // 2)
 
     def add_vote_skip(self, user_id: int) -> bool:
         """Adds a vote to skip. Returns True if skip threshold is met."""
+        if self.presence.channel_id is not None and not self.presence.is_listening(user_id):
+            return False
         self.vote_skip.add(user_id)
         required = self.get_required_votes()
         if len(self.vote_skip) >= required:
@@ -351,6 +719,7 @@ class MusicManager:
         vc = self.voice_client
         if vc:
             await vc.disconnect()
+        self.detach_voice_client()
         
         # Cancel cleanup task
         self.cleanup_task.cancel()
@@ -365,21 +734,32 @@ class MusicManager:
                     logger.error(f"Failed to delete music channel: {e}")
         
         # Delete Now Playing message
+        self.now_playing.close()
         if self.now_playing_msg:
             try:
                 await self.now_playing_msg.delete()
             except Exception as e:
                 logger.error(f"Failed to delete Now Playing message: {e}")
         
+        # The room was closed on purpose - nothing to resume
+        if self.sessions:
+            self.sessions.delete(self.guild_id)
+        
         # Reset state
         self.queue = []
         self.loop_queue = False
         self.auto_play = False
         self.vote_skip = set()
+        self.presence.reset(None)
         self.now_playing_msg = None
+        self.now_playing.reset()
+        self.current_song = None
         self.music_channel_id = None
         self.owner_id = None
-        self.selected_filter = None
+        self.selected_filter = self.get_default_filter()
+        self._leave_station()
+        if getattr(self.bot, 'audio_nodes', None):
+            self.bot.audio_nodes.release(self.guild_id)
         
         logger.info(f"Cleaned up MusicManager for guild {self.guild_id}")
 
@@ -392,7 +772,7 @@ class MusicManager:
             info = await ytdl.extract_info(query, download=False)
             
             if not info:
-                await channel.send(embed=discord.Embed(title="Error", description="❌ ไม่พบเพลงหรือวิดีโอจากคำค้นนี้", color=0xff0000), delete_after=5)
+                await self.bot.sweeper.send_temporary(channel, 5, embed=discord.Embed(title="Error", description="❌ ไม่พบเพลงหรือวิดีโอจากคำค้นนี้", color=0xff0000))
                 return
 
             urls_to_add = []
@@ -405,9 +785,9 @@ class MusicManager:
                 if urls_to_add:
                     self.add_to_queue(urls_to_add)
                     embed = discord.Embed(title="Playlist Added", description=f"✅ เพิ่ม **{len(urls_to_add)}** เพลงจากเพลย์ลิสต์ **{info.get('title', 'Unknown Playlist')}** ลงในคิว", color=0x00ff99)
-                    await channel.send(embed=embed, delete_after=10)
+                    await self.bot.sweeper.send_temporary(channel, 10, embed=embed)
                 else:
-                    await channel.send(embed=discord.Embed(title="Error", description="❌ ไม่พบเพลงในเพลย์ลิสต์นี้", color=0xff0000), delete_after=5)
+                    await self.bot.sweeper.send_temporary(channel, 5, embed=discord.Embed(title="Error", description="❌ ไม่พบเพลงในเพลย์ลิสต์นี้", color=0xff0000))
                     return
             else:
                 # Handle single track
@@ -416,9 +796,9 @@ class MusicManager:
                 if url:
                     self.add_to_queue([url])
                     embed = discord.Embed(title="Song Added", description=f"✅ เพิ่มเพลง **{title}** ลงในคิว", color=0x00ff99)
-                    await channel.send(embed=embed, delete_after=10)
+                    await self.bot.sweeper.send_temporary(channel, 10, embed=embed)
                 else:
-                    await channel.send(embed=discord.Embed(title="Error", description="❌ ไม่สามารถดึง URL ของเพลงได้", color=0xff0000), delete_after=5)
+                    await self.bot.sweeper.send_temporary(channel, 5, embed=discord.Embed(title="Error", description="❌ ไม่สามารถดึง URL ของเพลงได้", color=0xff0000))
                     return
 
             # 2. Start playing if not already playing
@@ -433,16 +813,32 @@ class MusicManager:
         except Exception as e:
             logger.error(f"Error handling music request: {e}")
             try:
-                await channel.send(embed=discord.Embed(title="Error", description=f"❌ เกิดข้อผิดพลาดในการประมวลผลคำขอ: {e}", color=0xff0000), delete_after=5)
+                await self.bot.sweeper.send_temporary(channel, 5, embed=discord.Embed(title="Error", description=f"❌ เกิดข้อผิดพลาดในการประมวลผลคำขอ: {e}", color=0xff0000))
             except discord.errors.NotFound:
                 logger.warning("Could not send error message, channel not found")
 
     # Add a method to handle voice state updates (e.g., bot disconnected manually)
+    def handle_member_voice_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> Optional[bool]:
+        """Applies another member's voice change. Returns True on join, False on leave, None otherwise."""
+        change = self.presence.update(member, before, after)
+        if change is False:
+            # Votes from members who left no longer count
+            self.vote_skip.discard(member.id)
+        return change
+
     async def handle_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
         """Handles voice state updates, primarily for bot disconnection."""
         if member.id == self.bot.user.id:
+            # Bot connected or moved - rebuild the listener set once
+            if after.channel and (not before.channel or before.channel.id != after.channel.id):
+                self.attach_voice_client(member.guild.voice_client)
+                self.presence.reset(after.channel)
             # Bot was in a voice channel and is no longer in one
             if before.channel and not after.channel:
+                self.detach_voice_client()
+                if getattr(self.bot, 'shutting_down', False):
+                    # Keep the room and session so they can be resumed after the restart
+                    return
                 logger.info(f"Bot manually disconnected from voice channel in guild {self.guild_id}. Cleaning up.")
                 guild = self.bot.get_guild(self.guild_id)
                 if guild:
@@ -465,20 +861,31 @@ class MusicManager:
                     logger.error(f"Failed to delete music channel: {e}")
         
         # Delete Now Playing message
+        self.now_playing.close()
         if self.now_playing_msg:
             try:
                 await self.now_playing_msg.delete()
             except Exception as e:
                 logger.error(f"Failed to delete Now Playing message: {e}")
         
+        # The room was closed on purpose - nothing to resume
+        if self.sessions:
+            self.sessions.delete(self.guild_id)
+        
         # Reset state
         self.queue = []
         self.loop_queue = False
         self.auto_play = False
         self.vote_skip = set()
+        self.presence.reset(None)
         self.now_playing_msg = None
+        self.now_playing.reset()
+        self.current_song = None
         self.music_channel_id = None
         self.owner_id = None
-        self.selected_filter = None
+        self.selected_filter = self.get_default_filter()
+        self._leave_station()
+        if getattr(self.bot, 'audio_nodes', None):
+            self.bot.audio_nodes.release(self.guild_id)
         
         logger.info(f"Cleaned up MusicManager state for guild {self.guild_id}")
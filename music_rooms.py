@@ -0,0 +1,58 @@
+"""
+Music room index
+Maps (guild, room name) to channel IDs so /join doesn't scan every text channel
+"""
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+import discord
+
+logger = logging.getLogger('discord_bot')
+
+MUSIC_ROOM_SUFFIX = "-music-room"
+
+
+def music_room_name(user: discord.abc.User) -> str:
+    """Name of the music room created for a user."""
+    return f"{user.name.lower().replace(' ', '-')}{MUSIC_ROOM_SUFFIX}"
+
+
+class MusicRoomIndex:
+    """Index of known music rooms. Each guild is scanned at most once, then kept up to date by events."""
+    def __init__(self):
+        self._rooms: Dict[Tuple[int, str], int] = {}
+        self._indexed: Set[int] = set()
+
+    def index_guild(self, guild: discord.Guild):
+        """Scans a guild's text channels once for existing music rooms."""
+        for channel in guild.text_channels:
+            if channel.name.endswith(MUSIC_ROOM_SUFFIX):
+                self._rooms[(guild.id, channel.name)] = channel.id
+        self._indexed.add(guild.id)
+
+    def get(self, guild: discord.Guild, name: str) -> Optional[discord.TextChannel]:
+        """Returns the music room with this name, or None."""
+        if guild.id not in self._indexed:
+            self.index_guild(guild)
+        channel_id = self._rooms.get((guild.id, name))
+        if channel_id is None:
+            return None
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            # Stale entry (deleted while we weren't watching)
+            self._rooms.pop((guild.id, name), None)
+        return channel
+
+    def add(self, channel: discord.abc.GuildChannel):
+        if channel.name.endswith(MUSIC_ROOM_SUFFIX):
+            self._rooms[(channel.guild.id, channel.name)] = channel.id
+
+    def discard(self, channel: discord.abc.GuildChannel):
+        key = (channel.guild.id, channel.name)
+        if self._rooms.get(key) == channel.id:
+            del self._rooms[key]
+
+    def forget_guild(self, guild_id: int):
+        self._indexed.discard(guild_id)
+        for key in [k for k in self._rooms if k[0] == guild_id]:
+            del self._rooms[key]
@@ -0,0 +1,172 @@
+"""
+Now Playing message renderer
+Coalesces Now Playing updates per guild so rapid skips don't flood Discord with edits
+"""
+import asyncio
+import os
+import time
+import logging
+from typing import Optional, Tuple
+
+import discord
+
+from rest_scheduler import Priority
+from metrics import NOW_PLAYING_SECONDS
+
+logger = logging.getLogger('discord_bot')
+
+# Minimum seconds between two edits of the same Now Playing message
+NOW_PLAYING_MIN_INTERVAL = float(os.getenv("NOW_PLAYING_MIN_INTERVAL", "2.0"))
+# Seconds between progress bar refreshes (0 = disabled)
+NOW_PLAYING_PROGRESS_INTERVAL = float(os.getenv("NOW_PLAYING_PROGRESS_INTERVAL", "15"))
+
+PROGRESS_BAR_LENGTH = 16
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Formats seconds as m:ss or h:mm:ss."""
+    if seconds is None:
+        return "--:--"
+    seconds = int(max(0, seconds))
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Parses "90", "1:30" or "1:02:30" into seconds; returns None if invalid."""
+    try:
+        parts = [float(p) for p in text.strip().split(':')]
+    except ValueError:
+        return None
+    if not parts or len(parts) > 3 or any(p < 0 for p in parts):
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def render_progress_bar(elapsed: float, duration: Optional[float]) -> str:
+    """Renders a text progress bar like ▬▬🔘▬▬ 1:23 / 3:45."""
+    if not duration:
+        return f"🔴 LIVE {format_duration(elapsed)}"
+    ratio = max(0.0, min(1.0, elapsed / duration))
+    pos = min(PROGRESS_BAR_LENGTH - 1, int(ratio * PROGRESS_BAR_LENGTH))
+    bar = "▬" * pos + "🔘" + "▬" * (PROGRESS_BAR_LENGTH - pos - 1)
+    return f"{bar} {format_duration(elapsed)} / {format_duration(duration)}"
+
+
+class NowPlayingRenderer:
+    """
+    Per-guild Now Playing updater.
+    Updates are last-write-wins: only the newest pending embed is sent, no more often than
+    `min_interval`, and edits whose rendered embed is unchanged are skipped entirely.
+    """
+    def __init__(self, manager, min_interval: float = NOW_PLAYING_MIN_INTERVAL,
+                 progress_interval: float = NOW_PLAYING_PROGRESS_INTERVAL):
+        self.manager = manager
+        self.min_interval = min_interval
+        self.progress_interval = progress_interval
+        self._pending: Optional[Tuple[discord.TextChannel, discord.Embed, Optional[discord.ui.View]]] = None
+        self._last_payload: Optional[dict] = None
+        self._last_view: Optional[discord.ui.View] = None
+        self._last_edit: float = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._progress_task: Optional[asyncio.Task] = None
+        # Counters for the dashboard
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    def request(self, channel: discord.TextChannel, embed: discord.Embed, view: Optional[discord.ui.View] = None):
+        """Schedules an update. Replaces any update that has not been sent yet."""
+        if self._pending is not None:
+            self.coalesced += 1
+        self._pending = (channel, embed, view)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def start_progress(self, channel: discord.TextChannel):
+        """Starts refreshing the progress bar of the current track."""
+        if self.progress_interval <= 0:
+            return
+        if self._progress_task is None or self._progress_task.done():
+            self._progress_task = asyncio.create_task(self._progress_loop(channel))
+
+    async def _progress_loop(self, channel: discord.TextChannel):
+        try:
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                vc = self.manager.voice_client
+                if not vc or not vc.source:
+                    return
+                if vc.is_playing():
+                    embed = self.manager.build_now_playing_embed()
+                    if embed:
+                        self.request(channel, embed)
+        except asyncio.CancelledError:
+            pass
+
+    async def _flush(self):
+        while self._pending is not None:
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            channel, embed, view = self._pending
+            self._pending = None
+            await self._apply(channel, embed, view)
+
+    async def _apply(self, channel: discord.TextChannel, embed: discord.Embed, view: Optional[discord.ui.View]):
+        payload = embed.to_dict()
+        view_changed = view is not None and view is not self._last_view
+        msg = self.manager.now_playing_msg
+        if msg and payload == self._last_payload and not view_changed:
+            self.skipped += 1
+            return
+
+        kwargs = {'embed': embed}
+        if view is not None:
+            kwargs['view'] = view
+        rest = self.manager.bot.rest
+        bucket = f"channel:{channel.id}"
+        try:
+            if msg:
+                try:
+                    with NOW_PLAYING_SECONDS.time('edit'):
+                        await rest.submit(Priority.CRITICAL, bucket, lambda: msg.edit(**kwargs))
+                except discord.NotFound:
+                    # Message was deleted by someone, send a fresh one
+                    with NOW_PLAYING_SECONDS.time('send'):
+                        self.manager.now_playing_msg = await rest.submit(Priority.CRITICAL, bucket, lambda: channel.send(**kwargs))
+            else:
+                with NOW_PLAYING_SECONDS.time('send'):
+                    self.manager.now_playing_msg = await rest.submit(Priority.CRITICAL, bucket, lambda: channel.send(**kwargs))
+            self._last_payload = payload
+            if view is not None:
+                self._last_view = view
+            self.sent += 1
+        except Exception as e:
+            logger.error(f"Failed to send/edit Now Playing message: {e}")
+        finally:
+            self._last_edit = time.monotonic()
+
+    def get_stats(self) -> dict:
+        return {'sent': self.sent, 'coalesced': self.coalesced, 'skipped': self.skipped}
+
+    def reset(self):
+        """Forgets the rendered message, e.g. after it was deleted."""
+        self._pending = None
+        self._last_payload = None
+        self._last_view = None
+
+    def close(self):
+        """Cancels pending updates and the progress refresher."""
+        self._pending = None
+        for task in (self._flush_task, self._progress_task):
+            if task and not task.done():
+                task.cancel()
+        self._flush_task = None
+        self._progress_task = None
@@ -0,0 +1,249 @@
+"""
+On-disk Opus cache
+Keeps pre-encoded Opus packets of frequently played tracks so they can be played from local
+files (memory-mapped, decoded in-process) instead of re-extracting, re-downloading and
+re-transcoding them with FFmpeg on every play
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import time
+import logging
+from array import array
+from collections import Counter
+from typing import Dict, Optional
+
+import discord
+from discord.oggparse import OggStream
+
+from metrics import timings
+from ffmpeg_supervisor import supervisor
+
+logger = logging.getLogger('discord_bot')
+
+OPUS_CACHE_DIR = os.getenv("OPUS_CACHE_DIR", "cache/opus")
+OPUS_CACHE_MAX_BYTES = int(os.getenv("OPUS_CACHE_MAX_MB", "512")) * 1024 * 1024
+# A track is encoded to the cache once it has been played this many times
+OPUS_CACHE_MIN_PLAYS = int(os.getenv("OPUS_CACHE_MIN_PLAYS", "2"))
+# Longer tracks (and live streams) are never cached
+OPUS_CACHE_MAX_DURATION = int(os.getenv("OPUS_CACHE_MAX_DURATION", "900"))
+
+FRAME_LENGTH = 0.02
+PACKET_LENGTH = struct.Struct('<H')
+OPUS_HEADERS = (b'OpusHead', b'OpusTags')
+
+
+class OpusCacheAudio(discord.AudioSource):
+    """
+    Plays a cached track: packets are sliced out of a memory-mapped file and decoded with libopus,
+    so PCMVolumeTransformer (fades, volume buttons) keeps working without an FFmpeg process.
+    """
+    def __init__(self, path: str, offsets: array, start: float = 0.0, gain: float = 0.0):
+        self._decoder = discord.opus.Decoder()
+        # The decoder has no limiter (FFmpeg adds alimiter after a boost), so only attenuate here
+        gain = min(gain, 0.0)
+        if gain:
+            self._decoder.set_gain(gain)
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = offsets
+        self._position = min(int(start / FRAME_LENGTH), len(offsets))
+
+    def read(self) -> bytes:
+        if self._mm is None or self._position >= len(self._offsets):
+            return b''
+        offset = self._offsets[self._position]
+        (length,) = PACKET_LENGTH.unpack_from(self._mm, offset)
+        start = offset + PACKET_LENGTH.size
+        self._position += 1
+        return self._decoder.decode(self._mm[start:start + length], fec=False)
+
+    def cleanup(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+class OpusDiskCache:
+    """
+    Byte-budgeted cache of encoded tracks. Entries live in the opus_cache table; when the budget
+    is exceeded the least frequently used entry (oldest first among equals) is evicted.
+    Encoding runs in the background, one niced FFmpeg process at a time.
+    """
+    def __init__(self, db=None, directory: str = OPUS_CACHE_DIR, max_bytes: int = OPUS_CACHE_MAX_BYTES):
+        self.db = db
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: Dict[str, dict] = {}
+        self._offsets: Dict[str, array] = {}
+        self._plays: Counter = Counter()
+        self._pending: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.encoded = 0
+        self.evicted = 0
+        self.failed = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _load(self):
+        for entry in (self.db.get_opus_cache_entries() if self.db else []):
+            if os.path.exists(self._path(entry['file_key'], 'opus')) and os.path.exists(self._path(entry['file_key'], 'idx')):
+                self.entries[entry['url']] = entry
+            elif self.db:
+                self.db.delete_opus_cache_entry(entry['url'])
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry['size'] for entry in self.entries.values())
+
+    # --- Playback ---
+    def open(self, url: str, start: float = 0.0, gain: float = 0.0) -> Optional[OpusCacheAudio]:
+        """Returns a source for a cached track, or None on a miss."""
+        entry = self.entries.get(url)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            offsets = self._offsets.get(url)
+            if offsets is None:
+                offsets = array('I')
+                with open(self._path(entry['file_key'], 'idx'), 'rb') as f:
+                    offsets.frombytes(f.read())
+                self._offsets[url] = offsets
+            audio = OpusCacheAudio(self._path(entry['file_key'], 'opus'), offsets, start=start, gain=gain)
+        except discord.opus.OpusNotLoaded:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable opus cache entry for {url}: {e}")
+            self._remove(url)
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['hits'] += 1
+        entry['last_used'] = time.time()
+        if self.db:
+            self.db.save_opus_cache_entry(entry)
+        return audio
+
+    def record_play(self, url: str, data: dict):
+        """Counts a play of a streamed track and queues it for encoding once it is played often enough."""
+        if url in self.entries or url in self._pending:
+            return
+        if data.get('is_live') or not data.get('url') or not data.get('duration') or data['duration'] > OPUS_CACHE_MAX_DURATION:
+            return
+        self._plays[url] += 1
+        if self._plays[url] < OPUS_CACHE_MIN_PLAYS:
+            return
+        self._pending[url] = data
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # --- Encoding ---
+    async def _run(self):
+        while self._pending:
+            url = next(iter(self._pending))
+            data = self._pending[url]
+            try:
+                with timings.timer('opus_cache.encode'):
+                    await self._encode(url, data)
+                self.encoded += 1
+                self._plays.pop(url, None)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Opus cache encode failed for {url}: {e}")
+            finally:
+                self._pending.pop(url, None)
+
+    async def _encode(self, url: str, data: dict):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        ogg_path = self._path(key, 'ogg.tmp')
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+            '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+            '-i', data['url'], '-vn', '-ac', '2', '-ar', '48000',
+            '-c:a', 'libopus', '-b:a', '128k', '-frame_duration', '20', '-application', 'audio',
+            '-f', 'ogg', '-y', ogg_path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=(lambda: os.nice(10)) if hasattr(os, 'nice') else None
+        )
+        supervisor.track_process(process, 'opus_encode', url=data['url'])
+        _, stderr = await process.communicate()
+        try:
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode(errors='ignore').strip()[-200:] or f"ffmpeg exited with {process.returncode}")
+            size = await asyncio.get_running_loop().run_in_executor(None, self._write_packets, ogg_path, key)
+        finally:
+            if os.path.exists(ogg_path):
+                os.remove(ogg_path)
+
+        self.entries[url] = entry = {
+            'url': url, 'file_key': key, 'size': size, 'duration': data.get('duration'),
+            'hits': 0, 'last_used': time.time()
+        }
+        if self.db:
+            self.db.save_opus_cache_entry(entry)
+        logger.info(f"Cached {data.get('title') or url} as Opus ({size / 1024:.0f} KiB)")
+        self._evict()
+
+    def _write_packets(self, ogg_path: str, key: str) -> int:
+        """Converts the Ogg file into length-prefixed packets plus an offset index."""
+        offsets = array('I')
+        position = 0
+        with open(ogg_path, 'rb') as ogg, open(self._path(key, 'opus'), 'wb') as out:
+            for packet in OggStream(ogg).iter_packets():
+                if packet.startswith(OPUS_HEADERS):
+                    continue
+                offsets.append(position)
+                out.write(PACKET_LENGTH.pack(len(packet)))
+                out.write(packet)
+                position += PACKET_LENGTH.size + len(packet)
+        with open(self._path(key, 'idx'), 'wb') as idx:
+            idx.write(offsets.tobytes())
+        return position + len(offsets) * offsets.itemsize
+
+    # --- Eviction ---
+    def _evict(self):
+        total = self.total_bytes
+        while total > self.max_bytes and self.entries:
+            url = min(self.entries, key=lambda u: (self.entries[u]['hits'], self.entries[u]['last_used']))
+            total -= self.entries[url]['size']
+            self._remove(url)
+            self.evicted += 1
+
+    def _remove(self, url: str):
+        entry = self.entries.pop(url, None)
+        self._offsets.pop(url, None)
+        if entry is None:
+            return
+        for ext in ('opus', 'idx'):
+            try:
+                os.remove(self._path(entry['file_key'], ext))
+            except FileNotFoundError:
+                pass
+        if self.db:
+            self.db.delete_opus_cache_entry(url)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'encoded': self.encoded,
+            'evicted': self.evicted,
+            'failed': self.failed,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,114 @@
+"""
+Music room permission synchroniser
+Computes the full overwrite map for a music room and applies it with a single channel edit
+"""
+import asyncio
+import os
+import time
+import logging
+from typing import Dict, Optional, Set, Union
+
+import discord
+
+from metrics import timings
+from rest_scheduler import Priority
+
+logger = logging.getLogger('discord_bot')
+
+# Seconds to wait after a voice join before reconciling, so join bursts become one edit
+PERMISSION_SYNC_DEBOUNCE = float(os.getenv("PERMISSION_SYNC_DEBOUNCE", "3"))
+
+
+def listener_overwrite() -> discord.PermissionOverwrite:
+    """Overwrite given to everyone in the bot's voice channel."""
+    return discord.PermissionOverwrite(read_messages=True, send_messages=True, mention_everyone=False)
+
+
+def build_room_overwrites(guild: discord.Guild, voice_channel) -> Dict[Union[discord.Role, discord.Member], discord.PermissionOverwrite]:
+    """Overwrites for a brand new music room: hidden from everyone except the bot and current listeners."""
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(
+            read_messages=False,  # คนนอกห้องเสียงไม่เห็น
+            send_messages=False,
+            mention_everyone=False
+        ),
+        guild.me: listener_overwrite(),
+    }
+    for member in voice_channel.members:
+        if not member.bot:  # ไม่รวม bot อื่น
+            overwrites[member] = listener_overwrite()
+    return overwrites
+
+
+class PermissionSync:
+    """Reconciles music room overwrites with the members of the bot's voice channel."""
+    def __init__(self, bot, debounce: float = PERMISSION_SYNC_DEBOUNCE):
+        self.bot = bot
+        self.debounce = debounce
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.reconciles = 0
+        self.edits = 0
+
+    async def reconcile(self, music_channel: discord.TextChannel, voice_channel) -> int:
+        """
+        Grants every non-bot listener access in one `channel.edit(overwrites=...)`.
+        Existing overwrites are kept so people who left can still read the history.
+        Returns how many members were added.
+        """
+        start = time.perf_counter()
+        try:
+            current = dict(music_channel.overwrites)
+            wanted = listener_overwrite()
+            added = 0
+            for member in voice_channel.members:
+                if member.bot:
+                    continue
+                if current.get(member) != wanted:
+                    current[member] = wanted
+                    added += 1
+
+            if added:
+                await self.bot.rest.submit(
+                    Priority.NORMAL, f"channel:{music_channel.id}",
+                    lambda: music_channel.edit(overwrites=current, reason="Sync music room with voice channel")
+                )
+                self.edits += 1
+            self.reconciles += 1
+            return added
+        finally:
+            timings.observe("permissions.reconcile", time.perf_counter() - start)
+
+    def schedule(self, guild_id: int):
+        """Marks a guild for reconciliation; bursts within the debounce window share one edit."""
+        self._dirty.add(guild_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            await asyncio.sleep(self.debounce)
+            dirty, self._dirty = self._dirty, set()
+            for guild_id in dirty:
+                await self._reconcile_guild(guild_id)
+
+    async def _reconcile_guild(self, guild_id: int):
+        manager = self.bot.managers.get(guild_id)
+        if not manager or not manager.music_channel_id:
+            return
+        guild = self.bot.get_guild(guild_id)
+        vc = manager.voice_client
+        if not guild or not vc or not vc.channel:
+            return
+        music_channel = guild.get_channel(manager.music_channel_id)
+        if not music_channel:
+            return
+        try:
+            added = await self.reconcile(music_channel, vc.channel)
+            if added:
+                logger.info(f"Added {added} member(s) to music channel permissions in guild {guild_id}")
+        except Exception as e:
+            logger.error(f"Failed to sync permissions for guild {guild_id}: {e}")
+
+    def get_stats(self) -> dict:
+        return {'reconciles': self.reconciles, 'edits': self.edits, 'pending': len(self._dirty)}
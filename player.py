@@ -2,27 +2,74 @@ import discord
 import yt_dlp
 import asyncio
 import os
+import time
 import logging
+from functools import lru_cache
+from typing import Optional
+from filters import resolve_filter
+from buffered_audio import BufferedAudio, READ_AHEAD_ENABLED
+from ffmpeg_supervisor import supervisor
+from metrics import EXTRACTION_SECONDS, FIRST_AUDIO_SECONDS, FFMPEG_SPAWN_SECONDS
+from loop_monitor import voice_deadlines
 
 logger = logging.getLogger('discord_bot')
 
-# ตั้งค่า FFmpeg
-def get_ffmpeg_options(filter_name=None):
-    """Generates FFmpeg options with optional audio filters."""
-    filter_map = {
-        'bass': 'bass=g=10',
-        'nightcore': 'asetrate=44100*1.25,aresample=44100,atempo=1.1',
-        'pitch': 'asetrate=44100*1.15,aresample=44100',
-    }
-    filter_str = filter_map.get(filter_name)
-    
+FRAME_LENGTH = 0.02  # Seconds of audio per 20ms PCM frame
+# Which tier served each track in from_url (Opus disk cache, cached stream URL, yt-dlp extraction)
+source_tiers = {'opus_disk': 0, 'stream_url': 0, 'extract': 0}
+# Apply the per-track gain measured by loudness.py at playback start
+LOUDNESS_NORMALIZATION = os.getenv("LOUDNESS_NORMALIZATION", "true").lower() == "true"
+
+def get_filter_speed(filter_name=None) -> float:
+    """Playback speed of a filter, so elapsed output time can be mapped back to a track position."""
+    return resolve_filter(filter_name).speed
+
+@lru_cache(maxsize=256)
+def _base_ffmpeg_options(filter_name=None, gain: float = 0.0):
+    graph = resolve_filter(filter_name)
+    stages = [graph.af] if graph.af else []
+    # Skip the static gain when the filter already normalises loudness itself
+    if gain and 'normalize' not in (graph.spec or ''):
+        stages.append(f"volume={gain:g}dB")
+        if gain > 0:
+            stages.append("alimiter=limit=0.95")  # Boosted quiet tracks must not clip
     options = '-vn -b:a 128k'
-    if filter_str:
-        options += f' -af "{filter_str}"'
+    if stages:
+        options += f' -af "{",".join(stages)}"'
+    return options, '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+def get_track_gain(data) -> float:
+    """Loudness correction (dB) stored with the cached metadata, if normalisation is enabled."""
+    if not LOUDNESS_NORMALIZATION:
+        return 0.0
+    return data.get('loudness_gain') or 0.0
+
+def read_ahead(source: discord.AudioSource) -> discord.AudioSource:
+    """
+    Puts a read-ahead buffer in front of an FFmpeg source (see buffered_audio.py).
+    Its frames are memoryviews; it must be played through YTDLSource's volume transformer.
+    """
+    return BufferedAudio(source) if READ_AHEAD_ENABLED else source
+
+def open_ffmpeg(source: str, ffmpeg_opts: dict, *, kind: str = 'playback', buffered: bool = True) -> discord.AudioSource:
+    """Starts FFmpeg under the process supervisor, behind a read-ahead buffer unless the caller paces reads itself."""
+    with FFMPEG_SPAWN_SECONDS.time(kind):
+        audio = discord.FFmpegPCMAudio(source, **ffmpeg_opts)
+    wrapped = read_ahead(audio) if buffered else audio
+    # Stall detection needs the buffer's last-frame timestamp
+    supervisor.track(audio, kind, source=wrapped if wrapped is not audio else None, url=source)
+    return wrapped
+
+# ตั้งค่า FFmpeg
+def get_ffmpeg_options(filter_name=None, start: float = 0.0, gain: float = 0.0):
+    """Generates FFmpeg options with an optional filter spec (see filters.py), loudness gain (dB) and start offset (seconds)."""
+    options, before_options = _base_ffmpeg_options(filter_name, gain)
+    if start > 0:
+        before_options = f'-ss {start:.2f} ' + before_options
     
     return {
         'options': options,
-        'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+        'before_options': before_options
     }
 
 # yt-dlp config - ใช้หลาย client เพื่อหลีกเลี่ยง bot detection
@@ -107,36 +154,203 @@ logger.info("YTDLWrapper initialized")
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+    def __init__(self, source, *, data, volume=0.5, start: float = 0.0, filter_name=None):
         super().__init__(source, volume)
+        self._set_track(data, start, filter_name)
+
+    def _set_track(self, data, start: float, filter_name):
         self.data = data
+        self.start_offset = start
+        self.filter_name = filter_name
+        self.speed = get_filter_speed(filter_name)
         self.title = data.get('title')
         self.url = data.get('url')
         self.webpage_url = data.get('webpage_url')
         self.duration = data.get('duration')
         self.thumbnail = data.get('thumbnail')
+        self.frames_read = 0
+        self._primed: Optional[bytes] = None
+        self.tier: Optional[str] = None  # Source tier that served the track (set by from_url)
+        self.requested_at: Optional[float] = None  # perf_counter when playback was requested, for time-to-first-audio
+        self._last_read: Optional[float] = None  # For missed frame deadlines
+
+    def _first_frame(self):
+        FIRST_AUDIO_SECONDS.observe(time.perf_counter() - self.requested_at, self.tier or 'unknown')
+        self.requested_at = None
+
+    def read(self) -> bytes:
+        if self._primed is not None:
+            data, self._primed = self._primed, None
+        else:
+            data = super().read()
+        if data:
+            self.frames_read += 1
+            self._last_read = voice_deadlines.check(self._last_read)
+            if self.requested_at is not None:
+                self._first_frame()
+        return data
+
+    def prime(self) -> bool:
+        """
+        Blocks until FFmpeg has produced its first frame and keeps it for the next read().
+        Run in an executor before swapping sources so the switch itself is gapless.
+        The frame goes through the volume transformer like every other one.
+        """
+        self._primed = super().read()
+        return bool(self._primed)
+
+    @property
+    def elapsed(self) -> float:
+        """Position in the track in seconds (start offset plus 20ms per frame read, scaled by filter speed)."""
+        # Silence fed on underruns is not part of the track
+        frames = self.frames_read - getattr(self.original, 'underruns', 0)
+        return self.start_offset + frames * FRAME_LENGTH * self.speed
+
+    @property
+    def is_live(self) -> bool:
+        return bool(self.data.get('is_live'))
+
+    @classmethod
+    def from_opus_cache(cls, opus_cache, url, data, *, filter_name=None, start: float = 0.0, volume: float = 0.5):
+        """Plays from the on-disk Opus cache; None on a miss or when a filter needs FFmpeg."""
+        if opus_cache is None or resolve_filter(filter_name).af:
+            return None
+        audio = opus_cache.open(url, start=start, gain=get_track_gain(data))
+        if audio is None:
+            return None
+        return cls(audio, data=data, volume=volume, start=start, filter_name=filter_name)
+
+    @classmethod
+    def _open_stream(cls, data, *, filter_name=None, start: float = 0.0, volume: float = 0.5, broadcast=None, node=None,
+                     replacing=None):
+        """Starts FFmpeg on the resolved stream URL: on an audio node, through the broadcast hub, or locally."""
+        ffmpeg_opts = get_ffmpeg_options(filter_name, start=start, gain=get_track_gain(data))
+        if node is not None:
+            return NodeSource(node.open_stream(data['url'], ffmpeg_opts, volume), data=data, volume=volume,
+                              start=start, filter_name=filter_name)
+        if broadcast is None:
+            return cls(open_ffmpeg(data['url'], ffmpeg_opts), data=data, volume=volume,
+                       start=start, filter_name=filter_name)
+        # Same track + same output options -> one shared FFmpeg (-ss is handled by the hub's offset buckets)
+        key = (data.get('webpage_url') or data['url'], ffmpeg_opts['options'])
+        # The upstream reads through the read-ahead ring and copies each frame out to bytes before fanning it out
+        audio = broadcast.subscribe(key, lambda: open_ffmpeg(data['url'], ffmpeg_opts, kind='broadcast'),
+                                    start=start, live=bool(data.get('is_live')), replacing=replacing)
+        # The upstream reports frames for the shared FFmpeg (stall detection)
+        supervisor.watch(audio.upstream.source, audio.upstream)
+        return cls(audio, data=data, volume=volume, start=audio.start_position, filter_name=filter_name)
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False, filter_name=None):
+    def from_data(cls, data, *, filter_name=None, start: float = 0.0, volume: float = 0.5, broadcast=None, node=None,
+                  replacing=None):
+        """
+        Builds a new source from already resolved data (no yt-dlp call), e.g. to seek or change filter.
+        `replacing` is the source it takes over from; a shared upstream it is on is not rejoined.
+        """
+        return cls._open_stream(data, filter_name=filter_name, start=start, volume=volume, broadcast=broadcast, node=node,
+                                replacing=replacing)
+
+    @classmethod
+    async def from_url(cls, url, *, loop=None, stream=False, filter_name=None, start: float = 0.0, cache=None, opus_cache=None,
+                       broadcast=None, node=None):
         loop = loop or asyncio.get_event_loop()
+        started = time.perf_counter()
         
-        try:
-            data = await ytdl_wrapper.extract_info(url, download=not stream)
-        except Exception as e:
-            logger.error(f"YTDL Error for {url}: {e}")
-            return None
+        # Tier 1: pre-encoded Opus on disk (no yt-dlp, no HTTP, no FFmpeg)
+        if cache and stream and opus_cache:
+            meta = cache.get(url)
+            player = cls.from_opus_cache(opus_cache, url, meta, filter_name=filter_name, start=start) if meta else None
+            if player:
+                source_tiers['opus_disk'] += 1
+                return cls._served(player, 'opus_disk', started)
+        
+        # Tier 2: a cached, still valid stream URL instead of running yt-dlp again
+        data = cache.get_playable(url) if (cache and stream) else None
+        tier = 'stream_url'
+        if data is not None:
+            source_tiers['stream_url'] += 1
+        
+        if data is None:
+            source_tiers['extract'] += 1
+            tier = 'extract'
+            try:
+                data = await ytdl_wrapper.extract_info(url, download=not stream)
+            except Exception as e:
+                logger.error(f"YTDL Error for {url}: {e}")
+                return None
 
-        if not data:
-            return None
+            if not data:
+                return None
 
-        if 'url' not in data:
-            logger.error(f"No direct URL found for {data.get('title')}")
-            return None
+            if 'url' not in data:
+                logger.error(f"No direct URL found for {data.get('title')}")
+                return None
+            
+            if cache and stream:
+                data = cache.put(url, data)
 
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
-        ffmpeg_opts = get_ffmpeg_options(filter_name)
+        if stream:
+            player = cls._open_stream(data, filter_name=filter_name, start=start, broadcast=broadcast, node=node)
+            return cls._served(player, tier, started)
         
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_opts), data=data)
+        filename = ytdl.prepare_filename(data)
+        ffmpeg_opts = get_ffmpeg_options(filter_name, start=start, gain=get_track_gain(data))
+        return cls(open_ffmpeg(filename, ffmpeg_opts), data=data, start=start, filter_name=filter_name)
+
+    @staticmethod
+    def _served(player, tier: str, started: float):
+        """Records which tier served the track and how long resolving it took."""
+        EXTRACTION_SECONDS.observe(time.perf_counter() - started, tier)
+        player.tier = tier
+        return player
+
+
+class NodeSource(YTDLSource):
+    """
+    A track played on an audio node (see audio_node.py): FFmpeg, volume and Opus encoding run in the
+    node process and this source hands the encoded packets straight to the voice client.
+    """
+    def __init__(self, stream, *, data, volume=0.5, start: float = 0.0, filter_name=None):
+        # PCMVolumeTransformer.__init__ rejects Opus sources; the node applies the volume instead
+        self.original = stream
+        self._volume = volume
+        self._set_track(data, start, filter_name)
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = max(value, 0.0)
+        self.original.set_volume(self._volume)
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            self.frames_read += 1
+            self._last_read = voice_deadlines.check(self._last_read)
+            if self.requested_at is not None:
+                self._first_frame()
+        return data
+
+    def prime(self) -> bool:
+        return self.original.wait_ready()
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+def get_source_tier_stats() -> dict:
+    """How often each tier served a track, with hit rates."""
+    total = sum(source_tiers.values())
+    return {
+        tier: {'count': count, 'rate': round(count / total, 3) if total else None}
+        for tier, count in source_tiers.items()
+    }
 
 
 # Export for use in music_manager
@@ -0,0 +1,209 @@
+"""
+Priority REST scheduler
+Keeps cosmetic Discord calls (message cleanup, admin DMs) from competing with playback-critical ones
+"""
+import asyncio
+import os
+import time
+import logging
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from metrics import LatencyStats
+
+logger = logging.getLogger('discord_bot')
+
+# Requests allowed per bucket per period (mirrors Discord's usual 5 per 5s per channel)
+REST_BUCKET_CAPACITY = int(os.getenv("REST_BUCKET_CAPACITY", "5"))
+REST_BUCKET_PERIOD = float(os.getenv("REST_BUCKET_PERIOD", "5.0"))
+# Cosmetic work is dropped when the backlog grows past this or waits longer than the TTL
+REST_COSMETIC_BACKLOG = int(os.getenv("REST_COSMETIC_BACKLOG", "200"))
+REST_COSMETIC_TTL = float(os.getenv("REST_COSMETIC_TTL", "60"))
+
+
+class Priority(IntEnum):
+    CRITICAL = 0  # Interaction followups, Now Playing updates - never queued
+    NORMAL = 1    # User-facing replies and permission changes
+    COSMETIC = 2  # Message cleanup, admin DMs - deferred or dropped under pressure
+
+
+class _Job:
+    __slots__ = ('priority', 'bucket', 'factory', 'future', 'enqueued_at')
+
+    def __init__(self, priority: Priority, bucket: str, factory: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.priority = priority
+        self.bucket = bucket
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity: int):
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+
+class RestScheduler:
+    """
+    Central scheduler for outgoing REST calls.
+    Each bucket (usually one per channel) gets a token budget. CRITICAL calls run immediately and
+    only charge the budget, NORMAL calls wait for a token, COSMETIC calls wait behind NORMAL ones
+    and are shed when the backlog is too long or too old.
+    """
+    def __init__(self, capacity: int = REST_BUCKET_CAPACITY, period: float = REST_BUCKET_PERIOD,
+                 cosmetic_backlog: int = REST_COSMETIC_BACKLOG, cosmetic_ttl: float = REST_COSMETIC_TTL):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.cosmetic_backlog = cosmetic_backlog
+        self.cosmetic_ttl = cosmetic_ttl
+        self._queues: Dict[Priority, deque] = {Priority.NORMAL: deque(), Priority.COSMETIC: deque()}
+        self._buckets: Dict[str, _Bucket] = {}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()  # In-flight jobs; the loop only keeps weak references
+        # Instrumentation
+        self.latency: Dict[Priority, LatencyStats] = {p: LatencyStats() for p in Priority}
+        self.completed: Dict[Priority, int] = {p: 0 for p in Priority}
+        self.failed: Dict[Priority, int] = {p: 0 for p in Priority}
+        self.shed: Dict[Priority, int] = {p: 0 for p in Priority}
+
+    # --- Budgets ---
+    def _bucket(self, key: str, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.capacity)
+        else:
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def _try_take(self, key: str, now: float) -> float:
+        """Takes a token if available. Returns 0 on success, otherwise seconds until one is free."""
+        bucket = self._bucket(key, now)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+    def _charge(self, key: str):
+        """Charges a token without waiting; the debt delays lower priorities on the same bucket."""
+        bucket = self._bucket(key, time.monotonic())
+        bucket.tokens = max(-self.capacity, bucket.tokens - 1)
+
+    # --- Submission ---
+    async def submit(self, priority: Priority, bucket: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs `factory()` under the given priority and bucket and returns its result."""
+        if priority == Priority.CRITICAL:
+            self._charge(bucket)
+            start = time.monotonic()
+            try:
+                result = await factory()
+                self.completed[priority] += 1
+                return result
+            except Exception:
+                self.failed[priority] += 1
+                raise
+            finally:
+                self.latency[priority].observe(time.monotonic() - start)
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(priority, bucket, factory, future))
+        return await future
+
+    def submit_nowait(self, priority: Priority, bucket: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Schedules `factory()` without waiting for it. Failures are logged, not raised."""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        self._enqueue(_Job(priority, bucket, factory, future))
+        return future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.debug(f"Scheduled REST call failed: {future.exception()}")
+
+    def _enqueue(self, job: _Job):
+        queue = self._queues[job.priority]
+        queue.append(job)
+        if job.priority == Priority.COSMETIC:
+            while len(queue) > self.cosmetic_backlog:
+                self._shed(queue.popleft())
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+
+    def _shed(self, job: _Job):
+        self.shed[job.priority] += 1
+        if not job.future.done():
+            job.future.set_result(None)
+
+    # --- Dispatching ---
+    def _next_runnable(self, now: float):
+        """Returns (job, None) for the next job that has a token, or (None, wait_seconds)."""
+        min_wait = None
+        cosmetic = self._queues[Priority.COSMETIC]
+        while cosmetic and now - cosmetic[0].enqueued_at > self.cosmetic_ttl:
+            self._shed(cosmetic.popleft())
+
+        blocked = set()
+        for priority in (Priority.NORMAL, Priority.COSMETIC):
+            queue = self._queues[priority]
+            for job in queue:
+                # Lower priorities never jump a bucket that a higher priority is waiting on
+                if job.bucket in blocked:
+                    continue
+                wait = self._try_take(job.bucket, now)
+                if wait == 0:
+                    queue.remove(job)
+                    return job, None
+                blocked.add(job.bucket)
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            job, wait = self._next_runnable(time.monotonic())
+            if job is not None:
+                task = asyncio.create_task(self._run(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                continue
+            if wait is None and not any(self._queues.values()):
+                # Nothing left to do; a new submission restarts the dispatcher
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: _Job):
+        try:
+            result = await job.factory()
+            self.completed[job.priority] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self.failed[job.priority] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            # Latency covers queueing plus the call itself
+            self.latency[job.priority].observe(time.monotonic() - job.enqueued_at)
+
+    def get_stats(self) -> dict:
+        """Per-class counters and end-to-end latency for the dashboard."""
+        return {
+            p.name.lower(): {
+                'completed': self.completed[p],
+                'failed': self.failed[p],
+                'shed': self.shed[p],
+                'queued': len(self._queues.get(p, ())),
+                'latency': self.latency[p].snapshot(),
+            }
+            for p in Priority
+        }
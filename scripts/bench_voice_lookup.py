@@ -0,0 +1,62 @@
+"""
+Benchmark: voice client lookup with many concurrent voice connections
+
+Compares the old linear scan over bot.voice_clients with MusicManager.voice_client.
+Run from the project root:  python scripts/bench_voice_lookup.py [connections]
+"""
+import asyncio
+import os
+import sys
+import timeit
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from music_manager import MusicManager  # noqa: E402
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.voice_client = None
+
+
+class FakeVoiceClient:
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+
+
+class FakeBot:
+    def __init__(self, connections: int):
+        self.guilds = {i: FakeGuild(i) for i in range(connections)}
+        self.voice_clients = []
+        for guild in self.guilds.values():
+            guild.voice_client = FakeVoiceClient(guild)
+            self.voice_clients.append(guild.voice_client)
+        self.managers = {}
+
+    def get_guild(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+
+async def main(connections: int, lookups: int = 100_000):
+    bot = FakeBot(connections)
+    # Worst case for the scan: the guild whose client is last in the list
+    guild_id = connections - 1
+    manager = MusicManager(bot, guild_id)
+    manager.cleanup_task.cancel()
+    manager.attach_voice_client(bot.guilds[guild_id].voice_client)
+
+    scan = timeit.timeit(lambda: discord.utils.get(bot.voice_clients, guild__id=guild_id), number=lookups)
+    direct = timeit.timeit(lambda: manager.voice_client, number=lookups)
+    manager.detach_voice_client()
+    fallback = timeit.timeit(lambda: (manager.detach_voice_client(), manager.voice_client), number=lookups)
+
+    print(f"{connections} voice connections, {lookups} lookups each")
+    print(f"  linear scan        : {scan / lookups * 1e6:8.2f} us/lookup")
+    print(f"  attached reference : {direct / lookups * 1e6:8.2f} us/lookup")
+    print(f"  guild fallback     : {fallback / lookups * 1e6:8.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
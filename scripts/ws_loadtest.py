@@ -0,0 +1,177 @@
+"""
+Load test: dashboard log fan-out with many connected WebSocket clients
+
+By default runs the FanoutHub in-process behind an aiohttp WebSocket server, publishes synthetic log
+batches at the dashboard's push rate and connects fast clients plus some that never read. It
+reports delivery latency for the fast clients and how the slow ones were handled.
+With --url it connects the clients to a running dashboard instead (e.g. ws://localhost:8080/ws/logs).
+
+Run from the project root:  python scripts/ws_loadtest.py [--clients 500] [--slow 20] [--seconds 10]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import sys
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import ClientSession, TCPConnector, WSMsgType, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ws_hub import FanoutHub  # noqa: E402
+
+PUSH_INTERVAL = 0.25  # main.LOG_PUSH_INTERVAL
+
+
+class AiohttpSocket:
+    """The bits of Starlette's WebSocket API the hub uses, over an aiohttp WebSocketResponse."""
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+
+    async def send_text(self, text: str):
+        await self.ws.send_str(text)
+
+    async def close(self, code: int = 1000):
+        await self.ws.close(code=code)
+
+
+async def start_server(hub: FanoutHub) -> web.AppRunner:
+    async def handler(request):
+        ws = web.WebSocketResponse(heartbeat=None)
+        await ws.prepare(request)
+        client = hub.connect(AiohttpSocket(ws))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            hub.disconnect(client)
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/ws/logs', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner
+
+
+async def publisher(hub: FanoutHub, seconds: float, lines_per_batch: int, publish_costs: list):
+    seq = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        now = time.time()
+        batch = [
+            {"time": time.strftime("[%H:%M:%S]"), "type": "INFO", "message": f"load test line {seq + i}", "sent": now}
+            for i in range(lines_per_batch)
+        ]
+        seq += lines_per_batch
+        started = time.perf_counter()
+        hub.publish({"type": "log_batch", "logs": batch})
+        publish_costs.append(time.perf_counter() - started)
+        await asyncio.sleep(PUSH_INTERVAL)
+
+
+async def fast_client(session: ClientSession, url: str, stats: dict, stop: asyncio.Event):
+    async with session.ws_connect(url, autoping=True) as ws:
+        stats['connected'] += 1
+        while not stop.is_set():
+            try:
+                msg = await asyncio.wait_for(ws.receive(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if msg.type != WSMsgType.TEXT:
+                stats['closed'] += 1
+                return
+            if msg.data == 'pong':
+                continue
+            data = json.loads(msg.data)
+            if data.get('type') == 'log_batch':
+                stats['frames'] += 1
+                stats['entries'] += len(data['logs'])
+                sent = data['logs'][0].get('sent')
+                if sent:
+                    stats['latencies'].append(time.time() - sent)
+
+
+async def slow_client(url: str, stats: dict, stop: asyncio.Event):
+    """Completes the handshake on a raw socket and never reads again, so the server's sends back up."""
+    parts = urlsplit(url)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (parts.hostname, parts.port or 80))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((
+        f"GET {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+    ).encode())
+    await reader.readuntil(b"\r\n\r\n")
+    stats['connected'] += 1
+    await stop.wait()
+    writer.transport.abort()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+async def main(args):
+    hub = runner = None
+    url = args.url
+    if url is None:
+        hub = FanoutHub(maxsize=args.queue, policy=args.policy, send_timeout=args.send_timeout)
+        runner = await start_server(hub)
+        port = runner.addresses[0][1]
+        url = f"ws://127.0.0.1:{port}/ws/logs"
+
+    fast = {'connected': 0, 'closed': 0, 'frames': 0, 'entries': 0, 'latencies': []}
+    slow = {'connected': 0}
+    stop = asyncio.Event()
+    publish_costs: list = []
+    # The default connector stops at 100 connections
+    async with ClientSession(connector=TCPConnector(limit=0)) as session:
+        tasks = [asyncio.create_task(fast_client(session, url, fast, stop)) for _ in range(args.clients)]
+        tasks += [asyncio.create_task(slow_client(url, slow, stop)) for _ in range(args.slow)]
+        # Let everyone connect before measuring
+        while fast['connected'] + slow['connected'] < args.clients + args.slow:
+            await asyncio.sleep(0.1)
+        if hub is not None:
+            await publisher(hub, args.seconds, args.lines, publish_costs)
+            await asyncio.sleep(1)
+        else:
+            await asyncio.sleep(args.seconds)
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"{args.clients} fast + {args.slow} slow clients, {args.seconds:.0f}s against {url}")
+    print(f"  fast clients: {fast['frames']} frames, {fast['entries']} log entries, {fast['closed']} closed")
+    if fast['latencies']:
+        print(f"  delivery latency: p50 {percentile(fast['latencies'], 0.5) * 1000:.1f} ms, "
+              f"p99 {percentile(fast['latencies'], 0.99) * 1000:.1f} ms, "
+              f"max {max(fast['latencies']) * 1000:.1f} ms")
+    if publish_costs:
+        print(f"  publish cost: {sum(publish_costs) / len(publish_costs) * 1e6:.0f} us/batch avg, "
+              f"{max(publish_costs) * 1e6:.0f} us max")
+    if hub is not None:
+        print(f"  hub: {hub.get_stats()}")
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="dashboard WebSocket URL (default: an in-process hub)")
+    parser.add_argument('--clients', type=int, default=500, help="clients that read promptly")
+    parser.add_argument('--slow', type=int, default=20, help="clients that never read")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--lines', type=int, default=20, help="log entries per published batch")
+    parser.add_argument('--queue', type=int, default=64, help="frames buffered per client")
+    parser.add_argument('--policy', choices=['drop', 'disconnect'], default='drop')
+    parser.add_argument('--send-timeout', type=float, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,184 @@
+"""
+Playback session snapshots
+Writes each guild's queue, settings and current position to SQLite as small deltas
+so sessions can be resumed after a crash or redeploy
+"""
+import asyncio
+import os
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from cluster import owns_guild
+
+logger = logging.getLogger('discord_bot')
+
+# Seconds between flushes of pending session writes
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+STATE_COLUMNS = ('voice_channel_id', 'text_channel_id', 'owner_id', 'loop_queue',
+                 'auto_play', 'selected_filter', 'current_url', 'position')
+
+
+class SessionStore:
+    """
+    Mirrors MusicManager state into the guild_sessions/session_queue tables.
+    Queue changes become row inserts/deletes (no full rewrites except shuffle), settings are
+    merged per guild, and everything pending is committed in one transaction per flush.
+    """
+    def __init__(self, bot, db, interval: float = SESSION_FLUSH_INTERVAL):
+        self.bot = bot
+        self.db = db
+        self.interval = interval
+        self._seqs: Dict[int, Deque[int]] = {}
+        self._next_seq: Dict[int, int] = {}
+        self._ops: List[Tuple[str, tuple]] = []
+        self._state: Dict[int, dict] = {}
+        self._positions: Dict[int, float] = {}
+        self._stale: Set[int] = set()  # Loaded at startup but not resumed yet
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.retries = 0  # Batches rolled back (e.g. database locked by another process) and kept for the next flush
+
+    # --- Loading ---
+    def load(self) -> Dict[int, dict]:
+        """Reads saved sessions and primes the queue sequence numbers."""
+        sessions = {}
+        for session in self.db.get_sessions():
+            guild_id = session['guild_id']
+            if not owns_guild(guild_id):
+                continue  # Resumed by the cluster process that runs this guild's shard
+            seqs = session.pop('queue_seqs')
+            self._seqs[guild_id] = deque(seqs)
+            self._next_seq[guild_id] = (seqs[-1] + 1) if seqs else 0
+            if session['queue'] or session['current_url']:
+                sessions[guild_id] = session
+                self._stale.add(guild_id)
+            else:
+                self.delete(guild_id)
+        return sessions
+
+    def _touch(self, guild_id: int):
+        """A new session replaces a saved one that was never resumed."""
+        if guild_id in self._stale:
+            self._stale.discard(guild_id)
+            self.delete(guild_id)
+
+    # --- Queue deltas ---
+    def queue_appended(self, guild_id: int, urls: Iterable[str]):
+        self._touch(guild_id)
+        self._state.setdefault(guild_id, {})  # Make sure the session row exists
+        seqs = self._seqs.setdefault(guild_id, deque())
+        seq = self._next_seq.get(guild_id, 0)
+        for url in urls:
+            self._ops.append(('INSERT INTO session_queue (guild_id, seq, url) VALUES (?, ?, ?)', (guild_id, seq, url)))
+            seqs.append(seq)
+            seq += 1
+        self._next_seq[guild_id] = seq
+        self._ensure_running()
+
+    def queue_removed(self, guild_id: int, index: int = 0):
+        """Records removal of the item at `index` (0-based)."""
+        self._touch(guild_id)
+        seqs = self._seqs.get(guild_id)
+        if not seqs or not 0 <= index < len(seqs):
+            return
+        if index == 0:
+            seq = seqs.popleft()
+        else:
+            seq = seqs[index]
+            del seqs[index]
+        self._ops.append(('DELETE FROM session_queue WHERE guild_id = ? AND seq = ?', (guild_id, seq)))
+        self._ensure_running()
+
+    def queue_replaced(self, guild_id: int, urls: List[str]):
+        """Full rewrite, for reorderings such as shuffle."""
+        self._touch(guild_id)
+        self._ops.append(('DELETE FROM session_queue WHERE guild_id = ?', (guild_id,)))
+        self._seqs[guild_id] = deque()
+        self._next_seq[guild_id] = 0
+        self.queue_appended(guild_id, urls)
+
+    # --- Settings / position ---
+    def update_state(self, guild_id: int, **fields):
+        self._touch(guild_id)
+        self._state.setdefault(guild_id, {}).update(fields)
+        self._ensure_running()
+
+    def delete(self, guild_id: int):
+        """Forgets a session (the room was closed on purpose)."""
+        self._stale.discard(guild_id)
+        self._state.pop(guild_id, None)
+        self._positions.pop(guild_id, None)
+        self._seqs.pop(guild_id, None)
+        self._next_seq.pop(guild_id, None)
+        self._ops.append(('DELETE FROM session_queue WHERE guild_id = ?', (guild_id,)))
+        self._ops.append(('DELETE FROM guild_sessions WHERE guild_id = ?', (guild_id,)))
+        self._ensure_running()
+
+    def capture_positions(self):
+        for guild_id, manager in list(self.bot.managers.items()):
+            if not manager.current_song:
+                continue
+            vc = manager.voice_client
+            position = getattr(vc.source, 'elapsed', None) if vc and vc.source else None
+            if position is None:
+                continue
+            position = round(position, 1)
+            if self._positions.get(guild_id) != position:
+                self._positions[guild_id] = position
+                self._state.setdefault(guild_id, {})['position'] = position
+
+    # --- Flushing ---
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # No loop yet (e.g. during startup); the next call will start it
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.capture_positions()
+            if not self._ops and not self._state:
+                if not any(m.current_song for m in self.bot.managers.values()):
+                    return
+                continue
+            self.flush()
+
+    def flush(self):
+        """Commits all pending writes in one transaction. A failed batch is kept and retried on the next flush."""
+        if self.db.conn is None:
+            return  # Closed at shutdown
+        queued, state = self._ops, self._state
+        self._ops, self._state = [], {}
+        ops = list(queued)
+        for guild_id, fields in state.items():
+            columns = [c for c in STATE_COLUMNS if c in fields]
+            if not columns:
+                ops.append(('INSERT OR IGNORE INTO guild_sessions (guild_id) VALUES (?)', (guild_id,)))
+                continue
+            values = tuple(fields[c] for c in columns)
+            updates = ", ".join(f"{c} = excluded.{c}" for c in columns)
+            ops.append((
+                f"INSERT INTO guild_sessions (guild_id, {', '.join(columns)}, updated_at) "
+                f"VALUES (?, {', '.join('?' for _ in columns)}, CURRENT_TIMESTAMP) "
+                f"ON CONFLICT(guild_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP",
+                (guild_id,) + values
+            ))
+        if not ops:
+            return
+        if self.db.apply_session_ops(ops):
+            self.writes += len(ops)
+            return
+        # Queue rows are seq-numbered deltas: dropping a batch would leave the saved queue wrong for good
+        self.retries += 1
+        self._ops[:0] = queued
+        for guild_id, fields in state.items():
+            self._state[guild_id] = {**fields, **self._state.get(guild_id, {})}
+        self._ensure_running()
+
+    def get_stats(self) -> dict:
+        return {'writes': self.writes, 'retries': self.retries, 'pending': len(self._ops) + len(self._state)}
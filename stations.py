@@ -0,0 +1,317 @@
+"""
+24/7 stations
+Always-on radio rooms fed by a configured live stream, playlist or local folder. Each station
+runs one long-lived upstream, shared by every guild tuned in through the broadcast hub, that
+survives upstream failures by reconnecting with backoff
+"""
+import json
+import os
+import random
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+import discord
+import yt_dlp
+
+from player import ytdl, ytdl_format_options, open_ffmpeg
+from loop_monitor import voice_deadlines
+
+logger = logging.getLogger('discord_bot')
+
+STATIONS_FILE = os.getenv("STATIONS_FILE", "configs/stations.json")
+STATION_RECONNECT_MIN = 1.0
+STATION_RECONNECT_MAX = float(os.getenv("STATION_RECONNECT_MAX", "60"))
+# A pipeline that stays up this long resets the reconnect backoff
+STATION_STABLE_AFTER = 30.0
+STATION_KINDS = ('stream', 'playlist', 'folder')
+AUDIO_EXTENSIONS = ('.mp3', '.ogg', '.opus', '.flac', '.wav', '.m4a', '.aac', '.webm')
+
+FRAME_LENGTH = 0.02
+SILENCE = b'\0' * discord.opus.Encoder.FRAME_SIZE
+STREAM_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_at_eof 1 -reconnect_delay_max 5'
+
+
+class StationConfig:
+    def __init__(self, name: str, kind: str, source: str, title: Optional[str] = None, shuffle: bool = False):
+        if kind not in STATION_KINDS:
+            raise ValueError(f"Unknown station kind '{kind}' for station '{name}'")
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.title = title or name
+        self.shuffle = shuffle
+
+
+def load_stations(path: str = STATIONS_FILE) -> Dict[str, StationConfig]:
+    """Reads station definitions: a JSON list of {name, kind, source, title?, shuffle?}."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        stations = {}
+        for entry in entries:
+            config = StationConfig(entry['name'], entry['kind'], entry['source'], entry.get('title'), entry.get('shuffle', False))
+            stations[config.name] = config
+        return stations
+    except Exception as e:
+        logger.error(f"Failed to load stations from {path}: {e}")
+        return {}
+
+
+class Station:
+    """Runtime state and metrics of one station."""
+    def __init__(self, config: StationConfig):
+        self.config = config
+        self.state = 'idle'
+        self.started_at: Optional[float] = None
+        self.connected_since: Optional[float] = None
+        self.reconnects = 0
+        self.failures = 0
+        self.frames = 0
+        self.current_title: Optional[str] = None
+        self.bitrate_kbps: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._playlist: List[str] = []
+        self._position = 0
+
+    # --- Upstream selection (blocking: runs on the station's worker thread, never in read()) ---
+    def resolve_next(self) -> dict:
+        """Picks the next item and resolves it to something FFmpeg can open (yt-dlp extraction for URLs)."""
+        kind = self.config.kind
+        if kind == 'stream':
+            return self._resolve_url(self.config.source)
+        if not self._playlist or self._position >= len(self._playlist):
+            self._playlist = self._list_items()
+            if not self._playlist:
+                raise RuntimeError("station source has no playable items")
+            if self.config.shuffle:
+                random.shuffle(self._playlist)
+            self._position = 0
+        item = self._playlist[self._position]
+        self._position += 1
+        if kind == 'folder':
+            return {'url': item, 'title': os.path.splitext(os.path.basename(item))[0], 'file_size': os.path.getsize(item)}
+        return self._resolve_url(item)
+
+    def _list_items(self) -> List[str]:
+        if self.config.kind == 'folder':
+            folder = self.config.source
+            return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                    if name.lower().endswith(AUDIO_EXTENSIONS)]
+        with yt_dlp.YoutubeDL({**ytdl_format_options, 'extract_flat': 'in_playlist'}) as flat:
+            info = flat.extract_info(self.config.source, download=False)
+        return [entry.get('url') or entry.get('webpage_url') for entry in (info or {}).get('entries') or [] if entry]
+
+    def _resolve_url(self, url: str) -> dict:
+        try:
+            info = ytdl.extract_info(url, download=False)
+        except yt_dlp.DownloadError:
+            # Plain Icecast/HTTP radio URLs can be played directly
+            if not url.startswith(('http://', 'https://')):
+                raise
+            info = {'url': url, 'title': self.config.title}
+        if 'entries' in info:
+            info = next(entry for entry in info['entries'] if entry)
+        return {
+            'url': info['url'],
+            'title': info.get('title') or self.config.title,
+            'bitrate': info.get('abr') or info.get('tbr'),
+            'before_options': STREAM_BEFORE_OPTIONS,
+        }
+
+    def open(self, item: dict) -> discord.AudioSource:
+        """Starts FFmpeg on an item from resolve_next()."""
+        options = {'options': '-vn'}
+        if item.get('before_options'):
+            options['before_options'] = item['before_options']
+        audio = open_ffmpeg(item['url'], options, kind='station', buffered=False)
+        audio.station_file_size = item.get('file_size')
+        self.current_title = item['title']
+        self.bitrate_kbps = item.get('bitrate') or self.bitrate_kbps
+        return audio
+
+    # --- Metrics ---
+    def get_stats(self, listeners: int = 0) -> dict:
+        now = time.time()
+        return {
+            'title': self.config.title,
+            'kind': self.config.kind,
+            'state': self.state,
+            'listeners': listeners,
+            'now_playing': self.current_title,
+            'uptime': round(now - self.started_at) if self.started_at else 0,
+            'connected_for': round(now - self.connected_since) if self.connected_since else 0,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'bitrate_kbps': round(self.bitrate_kbps, 1) if self.bitrate_kbps else None,
+            'last_error': self.last_error,
+        }
+
+
+class StationAudio(discord.AudioSource):
+    """
+    Never-ending source for a station: moves to the next item when one ends and reopens the
+    upstream with exponential backoff when it fails, feeding silence meanwhile.
+    Resolving and opening items (yt-dlp, FFmpeg startup) happens on a worker thread; read() only
+    swaps in a source whose first frame is already there. Playlist and folder items are resolved
+    one ahead while the current one plays.
+    """
+    def __init__(self, station: Station):
+        self.station = station
+        self._current: Optional[discord.AudioSource] = None
+        self._current_frames = 0
+        self._opened_at = 0.0
+        self._retry_at = 0.0
+        self._backoff = STATION_RECONNECT_MIN
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None  # Opening the next item
+        self._ready: Optional[tuple] = None  # (source, first frame, error) handed over by the worker
+        self._resolver: Optional[threading.Thread] = None  # Resolving the item after the current one
+        self._resolved: Optional[dict] = None
+        self._closed = False
+        self._last_read: Optional[float] = None  # For missed frame deadlines
+        station.state = 'connecting'
+        station.started_at = time.time()
+
+    def read(self) -> bytes:
+        self._last_read = voice_deadlines.check(self._last_read)
+        with self._lock:
+            station = self.station
+            if self._current is None:
+                return self._swap_in()
+
+            frame = self._current.read()
+            if frame:
+                self._count(frame)
+                return frame
+
+            # Current item ended
+            size = getattr(self._current, 'station_file_size', None)
+            self._current.cleanup()
+            self._current = None
+            played = self._current_frames * FRAME_LENGTH
+            if size and played:
+                station.bitrate_kbps = size * 8 / played / 1000
+            if station.config.kind == 'stream' or played < 1.0:
+                # A live stream should never end, and an item that ends immediately did not play
+                self._fail("upstream ended")
+            else:
+                self._start_worker()
+            return SILENCE
+
+    def _swap_in(self) -> bytes:
+        """Takes over the source prepared by the worker, or starts preparing one. Called with the lock held."""
+        if self._ready is None:
+            if self._worker is None and time.monotonic() >= self._retry_at:
+                self._start_worker()
+            return SILENCE
+        audio, frame, error = self._ready
+        self._ready = None
+        self._worker = None
+        if error is not None:
+            self._fail(f"open failed: {error}")
+            return SILENCE
+        self._current = audio
+        self._current_frames = 0
+        self._opened_at = time.monotonic()
+        if self._retry_at:
+            self.station.reconnects += 1
+            self._retry_at = 0.0
+        if self.station.config.kind != 'stream':
+            self._resolver = threading.Thread(target=self._resolve_ahead, name=f"station-{self.station.config.name}-next",
+                                              daemon=True)
+            self._resolver.start()
+        self._count(frame)
+        return frame
+
+    def _count(self, frame: bytes):
+        station = self.station
+        if self._current_frames == 0:
+            station.state = 'live'
+            station.connected_since = time.time()
+        self._current_frames += 1
+        station.frames += 1
+        if time.monotonic() - self._opened_at > STATION_STABLE_AFTER:
+            self._backoff = STATION_RECONNECT_MIN
+
+    def _start_worker(self):
+        if self._worker is None and not self._closed:
+            self._worker = threading.Thread(target=self._prepare, name=f"station-{self.station.config.name}", daemon=True)
+            self._worker.start()
+
+    def _resolve_ahead(self):
+        try:
+            self._resolved = self.station.resolve_next()
+        except Exception as e:
+            # The worker resolves it again (and reports the error) when the current item ends
+            logger.debug(f"Station '{self.station.config.name}' could not resolve the next item ahead: {e}")
+
+    def _prepare(self):
+        """Worker: resolves (unless done ahead) and opens the next item, then waits for its first frame."""
+        audio = None
+        try:
+            if self._resolver is not None:
+                self._resolver.join()
+                self._resolver = None
+            item, self._resolved = self._resolved, None
+            audio = self.station.open(item or self.station.resolve_next())
+            frame = audio.read()
+            if not frame:
+                raise RuntimeError("no audio from upstream")
+            result = (audio, frame, None)
+        except Exception as e:
+            if audio is not None:
+                audio.cleanup()
+            audio = None
+            result = (None, None, e)
+        with self._lock:
+            if self._closed:
+                if audio is not None:
+                    audio.cleanup()
+                return
+            self._ready = result
+
+    def _fail(self, reason: str):
+        station = self.station
+        station.state = 'reconnecting'
+        station.failures += 1
+        station.last_error = reason
+        station.connected_since = None
+        self._retry_at = time.monotonic() + self._backoff
+        logger.warning(f"Station '{station.config.name}' {reason}; retrying in {self._backoff:.0f}s")
+        self._backoff = min(self._backoff * 2, STATION_RECONNECT_MAX)
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            if self._current is not None:
+                self._current.cleanup()
+                self._current = None
+            if self._ready is not None and self._ready[0] is not None:
+                self._ready[0].cleanup()
+            self._ready = None
+        self.station.state = 'idle'
+        self.station.started_at = None
+        self.station.connected_since = None
+
+
+class StationDirectory:
+    """Configured stations and the shared upstream each guild tunes into."""
+    def __init__(self, hub=None, path: str = STATIONS_FILE):
+        self.hub = hub
+        self.configs = load_stations(path)
+        self.stations: Dict[str, Station] = {name: Station(config) for name, config in self.configs.items()}
+        self.listeners: Dict[str, int] = {}
+
+    def tune(self, name: str) -> discord.AudioSource:
+        """Returns an audio source for the station, shared through the broadcast hub when available."""
+        station = self.stations[name]
+        if self.hub is None:
+            return StationAudio(station)
+        return self.hub.subscribe(('station', name), lambda: StationAudio(station), live=True)
+
+    def get_stats(self) -> dict:
+        return {name: station.get_stats(self.listeners.get(name, 0)) for name, station in self.stations.items()}
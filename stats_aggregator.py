@@ -0,0 +1,107 @@
+"""
+Dashboard stats
+Server and user counts kept current from gateway events instead of summing every guild per request.
+/api/stats serves a prebuilt snapshot with an ETag, and changes are pushed to listeners
+(the dashboard WebSocket) at most once per STATS_PUSH_INTERVAL.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+# Seconds to coalesce counter changes before pushing a new snapshot
+STATS_PUSH_INTERVAL = 1.0
+
+
+def format_uptime(start_time: datetime) -> str:
+    delta = datetime.now() - start_time
+    return f"{delta.days}d {delta.seconds // 3600}h {(delta.seconds % 3600) // 60}m"
+
+
+def make_etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest()[:16] + '"'
+
+
+def stats_response(request: Request, payload: dict, body: Optional[bytes] = None, etag: Optional[str] = None) -> Response:
+    """JSON response with an ETag; 304 when the client already has this version."""
+    if body is None:
+        body = json.dumps(payload).encode()
+    if etag is None:
+        etag = make_etag(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class StatsAggregator:
+    """Per-guild member counts updated from events; snapshot() is O(1) until something changes."""
+    def __init__(self, start_time: datetime):
+        self.start_time = start_time
+        self.member_counts: Dict[int, int] = {}
+        self.users = 0
+        self.version = 0
+        self.listeners: List[Callable[[dict], None]] = []
+        self._snapshot: Optional[Tuple[tuple, dict, bytes, str]] = None
+        self._push_handle: Optional[asyncio.TimerHandle] = None
+
+    # --- Event updates ---
+    def rebuild(self, guilds: Iterable):
+        """Full recount (on ready, when the guild list is first known or after a resume)."""
+        self.member_counts = {guild.id: guild.member_count or 0 for guild in guilds}
+        self.users = sum(self.member_counts.values())
+        self._changed()
+
+    def set_guild(self, guild):
+        count = guild.member_count or 0
+        self.users += count - self.member_counts.get(guild.id, 0)
+        self.member_counts[guild.id] = count
+        self._changed()
+
+    def remove_guild(self, guild_id: int):
+        if guild_id in self.member_counts:
+            self.users -= self.member_counts.pop(guild_id)
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        if self.listeners and self._push_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._push_handle = loop.call_later(STATS_PUSH_INTERVAL, self._push)
+
+    def _push(self):
+        self._push_handle = None
+        payload = self.snapshot()[0]
+        for listener in list(self.listeners):
+            listener(payload)
+
+    # --- Snapshot ---
+    def snapshot(self) -> Tuple[dict, bytes, str]:
+        """(payload, JSON body, ETag), rebuilt only when the counters or the uptime minute change."""
+        uptime = format_uptime(self.start_time)
+        key = (self.version, uptime)
+        if self._snapshot is None or self._snapshot[0] != key:
+            elapsed = datetime.now() - self.start_time
+            payload = {
+                "servers": len(self.member_counts),
+                "users": self.users,
+                "uptime": uptime,
+                "uptime_raw": {
+                    "days": elapsed.days,
+                    "total_seconds": elapsed.total_seconds()
+                }
+            }
+            body = json.dumps(payload).encode()
+            etag = make_etag(body)
+            self._snapshot = (key, payload, body, etag)
+        return self._snapshot[1:]
+
+    def response(self, request: Request) -> Response:
+        payload, body, etag = self.snapshot()
+        return stats_response(request, payload, body, etag)
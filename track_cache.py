@@ -0,0 +1,109 @@
+"""
+Track metadata cache
+Remembers resolved yt-dlp results (title, duration, stream URL) in memory and in SQLite
+so replays and resumed sessions don't have to re-extract
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger('discord_bot')
+
+TRACK_CACHE_MEMORY_SIZE = int(os.getenv("TRACK_CACHE_MEMORY_SIZE", "512"))
+# Lifetime assumed for stream URLs that don't carry an expire= parameter
+STREAM_URL_TTL = float(os.getenv("STREAM_URL_TTL", "1800"))
+# Stream URLs closer than this to expiry are treated as expired
+STREAM_URL_MARGIN = 120.0
+
+CACHED_FIELDS = ('title', 'webpage_url', 'duration', 'thumbnail', 'is_live', 'url', 'stream_expires')
+
+
+def stream_expiry(stream_url: Optional[str]) -> Optional[float]:
+    """Reads the expire= timestamp of a googlevideo URL, or assumes STREAM_URL_TTL."""
+    if not stream_url:
+        return None
+    try:
+        expire = parse_qs(urlparse(stream_url).query).get('expire')
+        if expire:
+            return float(expire[0])
+    except ValueError:
+        pass
+    return time.time() + STREAM_URL_TTL
+
+
+class TrackCache:
+    """Two-tier (memory LRU, then SQLite) cache of resolved track metadata."""
+    def __init__(self, db=None, memory_size: int = TRACK_CACHE_MEMORY_SIZE):
+        self.db = db
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self.hits: Dict[str, int] = {'memory': 0, 'db': 0, 'miss': 0}
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Returns cached metadata (the stream URL may be expired)."""
+        data = self._memory.get(url)
+        if data is not None:
+            self._memory.move_to_end(url)
+            self.hits['memory'] += 1
+            return data
+        if self.db:
+            data = self.db.get_cached_track(url)
+            if data is not None:
+                self._remember(url, data)
+                self.hits['db'] += 1
+                return data
+        self.hits['miss'] += 1
+        return None
+
+    def get_playable(self, url: str) -> Optional[Dict]:
+        """Returns cached metadata only if its stream URL is still usable."""
+        data = self.get(url)
+        if not data or not data.get('url') or data.get('is_live'):
+            return None
+        expires = data.get('stream_expires')
+        if expires is None or expires - STREAM_URL_MARGIN < time.time():
+            return None
+        return data
+
+    def put(self, url: str, info: Dict) -> Dict:
+        """Stores the relevant fields of a yt-dlp info dict and returns the cached copy."""
+        data = {field: info.get(field) for field in CACHED_FIELDS}
+        if data.get('stream_expires') is None:
+            data['stream_expires'] = stream_expiry(data.get('url'))
+        # Keep extra fields (e.g. loudness) added by other stages
+        previous = self._memory.get(url) or (self.db.get_cached_track(url) if self.db else None)
+        if previous:
+            data = {**previous, **data}
+        self._remember(url, data)
+        if self.db:
+            self.db.save_cached_track(url, data)
+        return data
+
+    def invalidate_stream(self, url: str):
+        """Marks the stream URL as unusable (e.g. it returned 403) without losing metadata."""
+        data = self.get(url)
+        if data:
+            data['stream_expires'] = 0
+            if self.db:
+                self.db.save_cached_track(url, data)
+
+    def set_loudness(self, url: str, loudness: float, gain: float):
+        """Stores a loudness measurement next to the cached metadata."""
+        data = self._memory.get(url)
+        if data is not None:
+            data['loudness'] = loudness
+            data['loudness_gain'] = gain
+        if self.db:
+            self.db.save_track_loudness(url, loudness, gain)
+
+    def _remember(self, url: str, data: Dict):
+        self._memory[url] = data
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        return {'entries': len(self._memory), 'hits': dict(self.hits)}
@@ -5,6 +5,8 @@ import discord
 import time
 import logging
 
+from music_cog import followup
+
 logger = logging.getLogger('discord_bot')
 
 class RequestFirstSongView(discord.ui.View):
@@ -12,33 +14,88 @@ class RequestFirstSongView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
 
+class ResumeSessionView(discord.ui.View):
+    """Persistent Resume/Discard buttons offered after a restart for interrupted sessions."""
+    def __init__(self, bot):
+        super().__init__(timeout=None)
+        self.bot = bot
+
+    async def _close_offer(self, interaction: discord.Interaction, text: str, color: int):
+        embed = discord.Embed(title="Previous Session", description=text, color=color)
+        try:
+            await interaction.message.edit(embed=embed, view=None)
+        except Exception as e:
+            logger.warning(f"Could not update resume offer: {e}")
+
+    @discord.ui.button(label="▶️ Resume", custom_id="sakudoko:session_resume", style=discord.ButtonStyle.success)
+    async def resume_session(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        session = self.bot.pending_sessions.get(interaction.guild_id)
+        if not session:
+            await followup(interaction, "❌ ไม่พบ session ที่จะเล่นต่อ", ephemeral=True)
+            return
+        if not interaction.user.voice or not interaction.user.voice.channel:
+            await followup(interaction, "❌ คุณต้องอยู่ในห้องเสียงก่อน!", ephemeral=True)
+            return
+        del self.bot.pending_sessions[interaction.guild_id]
+
+        manager = self.bot.get_manager(interaction.guild_id)
+        channel = interaction.user.voice.channel
+        try:
+            vc = interaction.guild.voice_client
+            if vc is None:
+                vc = await channel.connect()
+            elif vc.channel != channel:
+                await vc.move_to(channel)
+            manager.attach_voice_client(vc)
+            await interaction.guild.me.edit(mute=False, deafen=True)
+
+            await self._close_offer(interaction, f"▶️ เล่นต่อโดย {interaction.user.mention}", 0x00ff99)
+            await followup(interaction, "✅ กำลังเล่นต่อจากเดิม", ephemeral=True)
+            await manager.restore_session(session, interaction.channel)
+        except Exception as e:
+            logger.error(f"Failed to resume session: {e}")
+            await followup(interaction, f"❌ เล่นต่อไม่สำเร็จ: {e}", ephemeral=True)
+
+    @discord.ui.button(label="🗑️ Discard", custom_id="sakudoko:session_discard", style=discord.ButtonStyle.secondary)
+    async def discard_session(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(ephemeral=True)
+        self.bot.pending_sessions.pop(interaction.guild_id, None)
+        if self.bot.sessions:
+            self.bot.sessions.delete(interaction.guild_id)
+        await self._close_offer(interaction, "🗑️ ยกเลิก session เดิมแล้ว", 0x808080)
+
 class MusicControlView(discord.ui.View):
-    """Simplified view for music controls"""
+    """
+    Persistent view for music controls.
+    A single instance is registered in MyBot.setup_hook; buttons have stable custom_ids so
+    they keep working after a restart, and clicks are routed to the guild's MusicManager.
+    """
     _cooldowns = {}  # user_id: last_used_time
     _last_cleanup = time.time()  # Track last cleanup time
 
-    def __init__(self, bot, logger_instance, guild: discord.Guild, channel_id: int, server_id: int):
+    def __init__(self, bot):
         super().__init__(timeout=None)
         self.bot = bot
-        self.logger = logger_instance
-        self.guild = guild
-        self.channel_id = channel_id
-        self.server_id = server_id
 
-    def get_manager(self):
-        """Retrieves the current MusicManager instance."""
-        return self.bot.get_manager(self.server_id)
+    def get_manager(self, interaction: discord.Interaction):
+        """Retrieves the MusicManager for the guild the button was clicked in."""
+        return self.bot.get_manager(interaction.guild_id)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Buttons only make sense inside a guild
+        return interaction.guild is not None
 
     async def _check_permission(self, interaction: discord.Interaction):
         """ตรวจสอบว่าผู้ใช้อยู่ในห้องเสียงเดียวกับบอทหรือไม่"""
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         
         # ตรวจสอบว่าผู้ใช้อยู่ในห้องเสียงหรือไม่
         if not interaction.user.voice or not interaction.user.voice.channel:
             if not interaction.response.is_done():
                 await interaction.response.defer(ephemeral=True)
             embed = discord.Embed(title="❌ ไม่มีสิทธิ์", description="คุณต้องอยู่ในห้องเสียงก่อน!", color=0xff0000)
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            await followup(interaction, embed=embed, ephemeral=True)
             return False
         
         # ตรวจสอบว่าอยู่ห้องเดียวกับบอทหรือไม่
@@ -47,7 +104,7 @@ class MusicControlView(discord.ui.View):
             if not interaction.response.is_done():
                 await interaction.response.defer(ephemeral=True)
             embed = discord.Embed(title="❌ ไม่มีสิทธิ์", description="คุณต้องอยู่ในห้องเสียงเดียวกับบอท!", color=0xff0000)
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            await followup(interaction, embed=embed, ephemeral=True)
             return False
         
         return True
@@ -67,16 +124,16 @@ class MusicControlView(discord.ui.View):
             if not interaction.response.is_done():
                 await interaction.response.defer(ephemeral=True)
             embed = discord.Embed(title="⏳ โปรดลองใหม่อีกครั้ง", description=f"คุณต้องรอ {cooldown} วินาทีระหว่างการกดปุ่ม", color=0xffcc00)
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            await followup(interaction, embed=embed, ephemeral=True)
             return False
         self._cooldowns[user_id] = now
         return True
 
-    @discord.ui.button(label="⏸️ Pause", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="⏸️ Pause", custom_id="sakudoko:pause", style=discord.ButtonStyle.secondary)
     async def pause(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction):
             return
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         vc = manager.voice_client
         if vc and vc.is_playing():
             vc.pause()
@@ -86,11 +143,11 @@ class MusicControlView(discord.ui.View):
             embed = discord.Embed(title="Error", description="ไม่มีเพลงที่กำลังเล่น!", color=0xff0000)
             await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    @discord.ui.button(label="▶️ Resume", style=discord.ButtonStyle.success)
+    @discord.ui.button(label="▶️ Resume", custom_id="sakudoko:resume", style=discord.ButtonStyle.success)
     async def resume(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction):
             return
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         vc = manager.voice_client
         if vc and vc.is_paused():
             vc.resume()
@@ -100,27 +157,27 @@ class MusicControlView(discord.ui.View):
             embed = discord.Embed(title="Error", description="ไม่มีเพลงที่หยุดชั่วคราว!", color=0xff0000)
             await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    @discord.ui.button(label="⏭️ Skip", style=discord.ButtonStyle.primary)
+    @discord.ui.button(label="⏭️ Skip", custom_id="sakudoko:skip", style=discord.ButtonStyle.primary)
     async def skip(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction):
             return
         
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         
         if not interaction.response.is_done():
             await interaction.response.defer(ephemeral=True)
             
-        channel = self.guild.get_channel(self.channel_id)
+        channel = manager.get_text_channel() or interaction.channel
         await manager.skip_to_next(channel)
         embed = discord.Embed(title="แจ้งเตือน", description="ข้ามเพลงแล้ว!", color=0x0099ff)
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        await followup(interaction, embed=embed, ephemeral=True)
 
-    @discord.ui.button(label="🔉 Vol-", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="🔉 Vol-", custom_id="sakudoko:volume_down", style=discord.ButtonStyle.secondary)
     async def volume_down(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction, cooldown=1):
             return
         
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         vc = manager.voice_client
         
         if vc and vc.source:
@@ -133,12 +190,12 @@ class MusicControlView(discord.ui.View):
             embed = discord.Embed(title="Error", description="ไม่มีเพลงที่กำลังเล่น!", color=0xff0000)
             await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    @discord.ui.button(label="🔊 Vol+", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="🔊 Vol+", custom_id="sakudoko:volume_up", style=discord.ButtonStyle.secondary)
     async def volume_up(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction, cooldown=1):
             return
         
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         vc = manager.voice_client
         
         if vc and vc.source:
@@ -151,17 +208,17 @@ class MusicControlView(discord.ui.View):
             embed = discord.Embed(title="Error", description="ไม่มีเพลงที่กำลังเล่น!", color=0xff0000)
             await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    @discord.ui.button(label="🚪 Leave", style=discord.ButtonStyle.danger)
+    @discord.ui.button(label="🚪 Leave", custom_id="sakudoko:leave", style=discord.ButtonStyle.danger)
     async def leave(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not await self._check_permission(interaction) or not await self._check_cooldown(interaction):
             return
         
-        manager = self.get_manager()
+        manager = self.get_manager(interaction)
         
         if not interaction.response.is_done():
             await interaction.response.defer(ephemeral=True)
             
-        await manager.disconnect_and_cleanup(self.guild)
+        await manager.disconnect_and_cleanup(interaction.guild)
         
         embed = discord.Embed(title="🚪 Bot Exited", description="บอทหยุดเล่นและลบห้องแชทเรียบร้อยแล้ว!", color=0xff0000)
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        await followup(interaction, embed=embed, ephemeral=True)
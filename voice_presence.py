@@ -0,0 +1,86 @@
+"""
+Voice presence tracker
+Keeps the members of the bot's voice channel per guild, updated from voice state deltas
+"""
+import time
+from typing import Optional, Set
+
+import discord
+
+
+def is_eligible_listener(member: discord.Member, state: Optional[discord.VoiceState]) -> bool:
+    """Non-bot members who aren't self-muted or self-deafened count towards vote skip."""
+    return not member.bot and state is not None and not state.self_mute and not state.self_deaf
+
+
+class VoicePresence:
+    """
+    Members currently in the bot's voice channel for one guild.
+    The channel is scanned once when the bot connects or moves; after that every
+    on_voice_state_update is applied as an O(1) delta and all queries are O(1).
+    """
+    def __init__(self):
+        self.channel_id: Optional[int] = None
+        self.members: Set[int] = set()
+        self.eligible: Set[int] = set()
+        self.empty_since: Optional[float] = None  # When the last listener left
+
+    def reset(self, channel: Optional[discord.VoiceChannel]):
+        """Rebuilds the member set for a new channel (or clears it when disconnected)."""
+        self.members.clear()
+        self.eligible.clear()
+        self.channel_id = channel.id if channel else None
+        self.empty_since = None
+        if channel is None:
+            return
+        for member in channel.members:
+            if member.bot:
+                continue
+            self.members.add(member.id)
+            if is_eligible_listener(member, member.voice):
+                self.eligible.add(member.id)
+        if not self.members:
+            self.empty_since = time.time()
+
+    def update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> Optional[bool]:
+        """
+        Applies a voice state change of another member.
+        Returns True if they joined our channel, False if they left it, None otherwise.
+        """
+        if self.channel_id is None or member.bot:
+            return None
+        was_here = before.channel is not None and before.channel.id == self.channel_id
+        is_here = after.channel is not None and after.channel.id == self.channel_id
+
+        if is_here:
+            self.members.add(member.id)
+            self.empty_since = None
+            if is_eligible_listener(member, after):
+                self.eligible.add(member.id)
+            else:
+                self.eligible.discard(member.id)
+            return None if was_here else True
+
+        if was_here:
+            self.members.discard(member.id)
+            self.eligible.discard(member.id)
+            if not self.members:
+                self.empty_since = time.time()
+            return False
+        return None
+
+    @property
+    def listener_count(self) -> int:
+        return len(self.members)
+
+    @property
+    def eligible_count(self) -> int:
+        return len(self.eligible)
+
+    @property
+    def is_empty(self) -> bool:
+        """True when the bot is in a channel with no human listeners."""
+        return self.empty_since is not None
+
+    def is_listening(self, user_id: int) -> bool:
+        return user_id in self.members
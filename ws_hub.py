@@ -0,0 +1,152 @@
+"""
+WebSocket fan-out
+Every dashboard client gets a bounded outbox and its own sender task. A published message is
+serialised once and the same text is queued for every client, so publishing never awaits a socket
+and one slow browser cannot hold up the others. Slow consumers lose their oldest frames or are
+disconnected, depending on WS_SLOW_CONSUMER.
+"""
+import asyncio
+import json
+import os
+import logging
+from collections import deque
+from typing import Optional, Set
+
+logger = logging.getLogger('discord_bot')
+
+# Frames buffered per client before the slow-consumer policy applies
+WS_CLIENT_QUEUE = int(os.getenv("WS_CLIENT_QUEUE", "64"))
+# 'drop' (discard the oldest queued frames) or 'disconnect'
+WS_POLICIES = ('drop', 'disconnect')
+WS_SLOW_CONSUMER = os.getenv("WS_SLOW_CONSUMER", "drop").strip().lower()
+# A single send taking longer than this disconnects the client under either policy
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_KEEPALIVE = 30.0
+
+KEEPALIVE = json.dumps({"type": "keepalive"})
+
+
+class HubClient:
+    """One connected WebSocket: its outbox of serialised frames and the task draining it."""
+    def __init__(self, websocket, maxsize: int):
+        self.websocket = websocket
+        self.outbox: deque = deque()
+        self.maxsize = maxsize
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+
+
+class FanoutHub:
+    """Broadcasts to any number of WebSocket clients without awaiting any of them."""
+    def __init__(self, maxsize: int = WS_CLIENT_QUEUE, policy: str = WS_SLOW_CONSUMER,
+                 send_timeout: float = WS_SEND_TIMEOUT):
+        self.clients: Set[HubClient] = set()
+        self.maxsize = maxsize
+        if policy not in WS_POLICIES:
+            logger.warning(f"Unknown WS_SLOW_CONSUMER policy '{policy}', using 'drop'")
+            policy = 'drop'
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.published = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+
+    def connect(self, websocket) -> HubClient:
+        """Registers an accepted WebSocket and starts its sender task."""
+        client = HubClient(websocket, self.maxsize)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients.add(client)
+        return client
+
+    def disconnect(self, client: HubClient, close_code: Optional[int] = None):
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.discard(client)
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        if close_code is not None:
+            asyncio.create_task(self._close(client, close_code))
+
+    async def _close(self, client: HubClient, code: int):
+        try:
+            await asyncio.wait_for(client.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+    def publish(self, message: dict):
+        """Serialises `message` once and queues it for every connected client."""
+        if not self.clients:
+            return
+        text = json.dumps(message)
+        self.published += 1
+        for client in list(self.clients):
+            self.send(client, text)
+
+    def send(self, client: HubClient, text: str):
+        """Queues an already serialised frame for one client, applying the slow-consumer policy."""
+        if client.closed:
+            return
+        if len(client.outbox) >= client.maxsize:
+            if self.policy == 'disconnect':
+                self.slow_disconnects += 1
+                logger.warning(f"Dashboard WebSocket client fell {client.maxsize} frames behind; disconnecting")
+                # 1013: try again later
+                self.disconnect(client, close_code=1013)
+                return
+            client.outbox.popleft()
+            client.dropped += 1
+            self.dropped += 1
+        client.outbox.append(text)
+        client.wakeup.set()
+
+    async def _sender(self, client: HubClient):
+        try:
+            while True:
+                if not client.outbox:
+                    client.wakeup.clear()
+                    await client.wakeup.wait()
+                    continue
+                text = client.outbox.popleft()
+                await asyncio.wait_for(client.websocket.send_text(text), self.send_timeout)
+                client.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.slow_disconnects += 1
+            self.disconnect(client, close_code=1013)
+        except Exception:
+            # The socket is gone; the endpoint's receive loop sees the disconnect too
+            self.disconnect(client)
+
+    async def serve(self, websocket, initial: Optional[dict] = None):
+        """Runs an accepted /ws/logs connection: initial frame, ping/pong and keepalives."""
+        client = self.connect(websocket)
+        try:
+            if initial is not None:
+                self.send(client, json.dumps(initial))
+            while not client.closed:
+                try:
+                    data = await asyncio.wait_for(websocket.receive_text(), timeout=WS_KEEPALIVE)
+                    if data == "ping":
+                        self.send(client, "pong")
+                except asyncio.TimeoutError:
+                    self.send(client, KEEPALIVE)
+        except Exception:
+            # WebSocketDisconnect, or the socket was closed under us
+            pass
+        finally:
+            self.disconnect(client)
+
+    def get_stats(self) -> dict:
+        return {
+            'clients': len(self.clients),
+            'published': self.published,
+            'queued': sum(len(client.outbox) for client in self.clients),
+            'dropped': self.dropped,
+            'slow_disconnects': self.slow_disconnects,
+            'policy': self.policy,
+        }